@@ -1,58 +1,73 @@
-import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
-from dotenv import load_dotenv
-from sqlalchemy import inspect, text
-
-load_dotenv()
-
-db = SQLAlchemy()
-login_manager = LoginManager()
-login_manager.login_view = "auth.login"
-
-
-def create_app():
-    app = Flask(__name__, static_folder="static", template_folder="templates")
-    app.config.from_object("config.Config")
-
-    db.init_app(app)
-    login_manager.init_app(app)
-
-    from .models import User  # noqa: F401
-
-    from .auth import auth_bp
-    from .main import main_bp
-    from .teacher import teacher_bp
-    from .student import student_bp
-    from .report import report_bp
-
-    app.register_blueprint(main_bp)
-    app.register_blueprint(auth_bp, url_prefix="/auth")
-    app.register_blueprint(teacher_bp, url_prefix="/teacher")
-    app.register_blueprint(student_bp, url_prefix="/student")
-    app.register_blueprint(report_bp, url_prefix="/report")
-
-    with app.app_context():
-        db.create_all()
-        try:
-            inspector = inspect(db.engine)
-            # question.time_limit_seconds
-            q_cols = [c["name"] for c in inspector.get_columns("question")]
-            if "time_limit_seconds" not in q_cols:
-                db.session.execute(text("ALTER TABLE question ADD COLUMN time_limit_seconds INTEGER"))
-                db.session.commit()
-            # user.class_name
-            u_cols = [c["name"] for c in inspector.get_columns("user")]
-            if "class_name" not in u_cols:
-                db.session.execute(text("ALTER TABLE user ADD COLUMN class_name VARCHAR(64)"))
-                db.session.commit()
-            # subject.class_name
-            s_cols = [c["name"] for c in inspector.get_columns("subject")]
-            if "class_name" not in s_cols:
-                db.session.execute(text("ALTER TABLE subject ADD COLUMN class_name VARCHAR(64)"))
-                db.session.commit()
-        except Exception:
-            pass
-
-    return app
+import os
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import LoginManager
+from dotenv import load_dotenv
+from . import storage
+
+load_dotenv()
+
+db = SQLAlchemy(session_options={"class_": storage.RoutingSession})
+login_manager = LoginManager()
+login_manager.login_view = "auth.login"
+
+
+def create_app():
+    app = Flask(__name__, static_folder="static", template_folder="templates")
+    app.config.from_object("config.Config")
+
+    storage.configure(app)
+    db.init_app(app)
+    storage.init_app(app)
+    login_manager.init_app(app)
+
+    from .tenancy import tenancy
+    tenancy.init_app(app)
+
+    from .models import User  # noqa: F401
+
+    from .auth import auth_bp
+    from .main import main_bp
+    from .teacher import teacher_bp
+    from .student import student_bp
+    from .report import report_bp
+
+    app.register_blueprint(main_bp)
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+    app.register_blueprint(teacher_bp, url_prefix="/teacher")
+    app.register_blueprint(student_bp, url_prefix="/student")
+    app.register_blueprint(report_bp, url_prefix="/report")
+
+    from .commands import register_commands
+    register_commands(app)
+
+    from .papers import paper_cache
+    from .autosave import answer_buffer
+    from .pdf import pdf_renderer
+    from .metrics import metrics
+    from .sweeper import expiry_sweeper
+    from .ranking import rankings
+    from .events import event_bus
+    from .models import user_cache
+    from .admission import admission
+    from .httpcache import http_cache
+    from .assets import assets
+    from .enrollment import password_hasher
+    paper_cache.init_app(app)
+    answer_buffer.init_app(app)
+    pdf_renderer.init_app(app)
+    metrics.init_app(app)
+    expiry_sweeper.init_app(app)
+    rankings.init_app(app)
+    event_bus.init_app(app)
+    user_cache.init_app(app)
+    admission.init_app(app)
+    http_cache.init_app(app)
+    assets.init_app(app)
+    password_hasher.init_app(app)
+
+    with app.app_context():
+        from .migrations import ensure_schema
+        ensure_schema(app)
+
+    return app
@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, or_
+from .models import ExamSession, User, UserRole
+from .events import event_bus
+from .papers import draw_paper
+from .storage import tenant_key
+from . import db
+
+# Waiters that stop polling for this long give up their place.
+STALE_SECONDS = 15
+MAX_RETRY_SECONDS = 10
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+# Paces exam-session creation per subject so that a hall starting at the bell
+# does not queue hundreds of writers on the database at once. Each worker
+# admits up to ADMISSION_RATE new sessions per second per subject (bursts of
+# ADMISSION_BURST); everyone else gets a waiting page that polls. Students
+# are let in roughly in the order they arrived. Sessions pre-created with an
+# exam window never wait. Each school has its own buckets.
+class AdmissionControl:
+    def __init__(self):
+        self.rate = 0
+        self.burst = 1
+        self._buckets = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rate = app.config.get("ADMISSION_RATE", self.rate)
+        self.burst = max(1, app.config.get("ADMISSION_BURST", self.burst))
+
+    def admit(self, subject_id, user_id):
+        # Returns (admitted, position, retry_after_seconds).
+        if not self.rate:
+            return True, 0, 0
+        now = time.monotonic()
+        subject_id = tenant_key(subject_id)
+        with self._lock:
+            bucket = self._buckets.get(subject_id)
+            if bucket is None:
+                bucket = self._buckets[subject_id] = TokenBucket(self.rate, self.burst, now)
+            waiting = self._waiting.setdefault(subject_id, {})
+            for uid in [uid for uid, (_, seen) in waiting.items() if now - seen > STALE_SECONDS]:
+                del waiting[uid]
+            first_seen = waiting[user_id][0] if user_id in waiting else now
+            ahead = sum(1 for uid, (first, _) in waiting.items() if first < first_seen and uid != user_id)
+            tokens = bucket.refill(now)
+            if tokens >= ahead + 1:
+                bucket.tokens -= 1
+                waiting.pop(user_id, None)
+                return True, 0, 0
+            waiting[user_id] = (first_seen, now)
+            retry = min(MAX_RETRY_SECONDS, max(1, (ahead + 1 - tokens) / self.rate))
+            return False, ahead + 1, retry
+
+    def release(self, subject_id, user_id):
+        if not self.rate:
+            return
+        with self._lock:
+            self._waiting.get(tenant_key(subject_id), {}).pop(user_id, None)
+
+
+admission = AdmissionControl()
+
+
+def open_exam_window(subject, class_name, now=None):
+    # Pre-creates one session per student of the class, all starting now,
+    # in a single bulk insert. Students who already have an open session of
+    # this subject keep it, and students who already sat it are left out:
+    # an untouched window session would be swept into a 0% latest attempt.
+    # Returns the number of sessions created.
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(minutes=subject.duration_minutes)
+    busy = (
+        db.session.query(ExamSession.student_id)
+        .filter(
+            ExamSession.subject_id == subject.id,
+            or_(ExamSession.completed_at.isnot(None), ExamSession.expires_at > now),
+        )
+    )
+    students = (
+        db.session.query(User.id, User.full_name)
+        .filter(User.role == UserRole.STUDENT.value, User.class_name == class_name, User.id.not_in(busy))
+        .all()
+    )
+    if not students:
+        return 0
+    rows = []
+    for sid, _ in students:
+        paper_seed, paper_questions = draw_paper(subject)
+        rows.append({
+            "subject_id": subject.id, "student_id": sid, "started_at": now, "expires_at": expires_at,
+            "paper_seed": paper_seed, "paper_questions": paper_questions,
+        })
+    db.session.execute(insert(ExamSession), rows)
+    db.session.commit()
+    names = dict(students)
+    created = (
+        db.session.query(ExamSession.id, ExamSession.student_id)
+        .filter(ExamSession.subject_id == subject.id, ExamSession.started_at == now)
+    )
+    for session_id, student_id in created:
+        if student_id in names:
+            event_bus.publish(subject.id, {
+                "type": "started",
+                "session_id": session_id,
+                "student": names[student_id],
+                "started_at": now,
+                "expires_at": expires_at,
+            })
+    return len(students)
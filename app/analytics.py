@@ -0,0 +1,157 @@
+from collections import namedtuple
+import numpy as np
+from sqlalchemy import func
+from .models import ExamSession, ExamResult, Question, Option
+from .archive import session_answers
+from .cache import Cache
+from .papers import unpack_ids
+from . import db
+
+# Distractors picked by fewer than this share of students are not doing their job.
+WEAK_DISTRACTOR_RATE = 0.05
+
+ItemAnalysis = namedtuple("ItemAnalysis", ["subject_id", "students", "kr20", "mean_score", "items"])
+ItemStats = namedtuple("ItemStats", ["question_id", "text", "difficulty", "discrimination", "blank_rate", "options"])
+OptionStats = namedtuple("OptionStats", ["option_id", "text", "is_key", "rate", "weak"])
+
+analysis_cache = Cache("item_analysis", maxsize=128)
+
+
+def _results_marker(subject_id):
+    # Changes whenever a session of the subject is graded or regraded.
+    count, latest = (
+        db.session.query(func.count(ExamResult.id), func.max(ExamResult.graded_at))
+        .filter(ExamResult.subject_id == subject_id)
+        .one()
+    )
+    return count, latest.isoformat() if latest else None
+
+
+def _latest_sessions(subject_id):
+    # Each student's most recent completed attempt, picked by completion
+    # time as on report cards.
+    ranked = (
+        db.session.query(
+            ExamSession.id.label("id"),
+            func.row_number().over(
+                partition_by=ExamSession.student_id,
+                order_by=(ExamSession.completed_at.desc(), ExamSession.id.desc()),
+            ).label("n"),
+        )
+        .filter(ExamSession.subject_id == subject_id, ExamSession.completed_at.isnot(None))
+        .subquery()
+    )
+    return db.session.query(ranked.c.id).filter(ranked.c.n == 1)
+
+
+def item_analysis(subject):
+    key = (subject.id, subject.version) + _results_marker(subject.id)
+    return analysis_cache.get_or_set(key, lambda: _compute(subject.id))
+
+
+def _compute(subject_id):
+    questions = db.session.query(Question.id, Question.text).filter_by(subject_id=subject_id).order_by(Question.id).all()
+    options = (
+        db.session.query(Option.id, Option.question_id, Option.text, Option.is_correct)
+        .join(Question, Question.id == Option.question_id)
+        .filter(Question.subject_id == subject_id)
+        .order_by(Option.question_id, Option.id)
+        .all()
+    )
+    sessions = (
+        db.session.query(ExamSession.id, ExamSession.paper_questions)
+        .filter(ExamSession.id.in_(_latest_sessions(subject_id)))
+        .order_by(ExamSession.id)
+        .all()
+    )
+    session_ids = [sid for sid, _ in sessions]
+    # One bulk read of every answer in the latest attempts, archived or not.
+    responses = [
+        (sid, qid, oid) for sid, answers in session_answers(session_ids).items() for qid, oid in answers.items()
+    ]
+
+    q_index = {qid: j for j, (qid, _) in enumerate(questions)}
+    s_index = {sid: i for i, sid in enumerate(session_ids)}
+    o_index = {oid: k for k, (oid, _, _, _) in enumerate(options)}
+    # The first correct option is the key, as in scoring.
+    key = np.full(len(questions), -1)
+    for k, (oid, qid, _, is_correct) in enumerate(options):
+        j = q_index[qid]
+        if is_correct and key[j] == -1:
+            key[j] = k
+
+    # Dense student x question matrix of chosen option positions (-1 = blank).
+    chosen = np.full((len(session_ids), len(questions)), -1)
+    if responses:
+        rows = np.array([
+            (s_index[sid], q_index[qid], o_index[oid])
+            for sid, qid, oid in responses
+            if sid in s_index and qid in q_index and oid in o_index
+        ], dtype=np.intp).reshape(-1, 3)
+        chosen[rows[:, 0], rows[:, 1]] = rows[:, 2]
+
+    # Which questions each student was given; with sampled papers every
+    # statistic is over the students who saw the item.
+    seen = np.ones(chosen.shape, dtype=bool)
+    for i, (_, blob) in enumerate(sessions):
+        if blob is not None:
+            seen[i] = False
+            seen[i, [q_index[qid] for qid in unpack_ids(blob) if qid in q_index]] = True
+    exposed = seen.sum(axis=0)
+    n = len(session_ids)
+    correct = ((chosen == key) & (key >= 0) & seen).astype(float)
+    totals = correct.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        difficulty = correct.sum(axis=0) / exposed
+
+        # Point-biserial of each item against the score on the other items.
+        rest = totals[:, None] - correct
+        item_dev = (correct - difficulty) * seen
+        rest_dev = (rest - (rest * seen).sum(axis=0) / exposed) * seen
+        denom = np.sqrt((item_dev ** 2).sum(axis=0) * (rest_dev ** 2).sum(axis=0))
+        discrimination = np.where(denom > 0, (item_dev * rest_dev).sum(axis=0) / denom, np.nan)
+
+        picked = np.bincount(chosen[(chosen >= 0) & seen], minlength=len(options))
+        picked = picked / np.maximum(exposed[[q_index[qid] for _, qid, _, _ in options]], 1) if options else picked
+        blank = np.where(exposed > 0, ((chosen == -1) & seen).sum(axis=0) / exposed, 0.0)
+
+    k = len(questions)
+    variance = totals.var() if n else 0.0
+    kr20 = None
+    # KR-20 assumes everyone sat the same items.
+    if k > 1 and variance > 0 and seen.all():
+        kr20 = float(k / (k - 1) * (1 - (difficulty * (1 - difficulty)).sum() / variance))
+
+    by_question = {}
+    for pos, (oid, qid, text, _) in enumerate(options):
+        is_key = key[q_index[qid]] == pos
+        rate = float(picked[pos])
+        by_question.setdefault(qid, []).append(
+            OptionStats(oid, text, bool(is_key), rate, bool(exposed[q_index[qid]] and not is_key and rate < WEAK_DISTRACTOR_RATE))
+        )
+    items = [
+        ItemStats(
+            qid, text, _number(difficulty[j]), _number(discrimination[j]), float(blank[j]), by_question.get(qid, []),
+        )
+        for j, (qid, text) in enumerate(questions)
+    ]
+    per_student = seen.sum(axis=1)
+    mean_score = float((totals / np.maximum(per_student, 1)).mean() * 100) if n and k else None
+    return ItemAnalysis(subject_id, n, kr20, mean_score, items)
+
+
+def _number(value):
+    return None if np.isnan(value) else float(value)
+
+
+def as_dict(analysis):
+    return {
+        "subject_id": analysis.subject_id,
+        "students": analysis.students,
+        "kr20": analysis.kr20,
+        "mean_score": analysis.mean_score,
+        "items": [
+            dict(item._asdict(), options=[o._asdict() for o in item.options])
+            for item in analysis.items
+        ],
+    }
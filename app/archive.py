@@ -0,0 +1,77 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from .models import ExamSession, Option, Response
+from .papers import pack_ids, unpack_ids
+from . import db
+
+CHUNK_SIZE = 500
+
+ArchiveStats = namedtuple("ArchiveStats", ["sessions", "responses", "packed_bytes"])
+
+
+def archive_sessions(min_age=timedelta(days=1), batch_size=CHUNK_SIZE, now=None):
+    # Moves the answers of sessions completed at least min_age ago out of the
+    # response table into each session's packed archived_answers, then
+    # deletes the rows. Completed sessions are never written again, and the
+    # age margin covers autosaves still buffered by a worker. Commits per batch.
+    cutoff = (now or datetime.utcnow()) - min_age
+    sessions = responses = packed = 0
+    while True:
+        ids = [
+            sid for (sid,) in db.session.query(ExamSession.id)
+            .filter(ExamSession.archived_answers.is_(None), ExamSession.completed_at.isnot(None), ExamSession.completed_at <= cutoff)
+            .order_by(ExamSession.completed_at)
+            .limit(batch_size)
+        ]
+        if not ids:
+            return ArchiveStats(sessions, responses, packed)
+        chosen = {sid: [] for sid in ids}
+        for sid, oid in (
+            db.session.query(Response.session_id, Response.selected_option_id)
+            .filter(Response.session_id.in_(ids))
+            .order_by(Response.session_id, Response.question_id)
+        ):
+            chosen[sid].append(oid)
+        table = ExamSession.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam("sid")).values(archived_answers=bindparam("blob")),
+            [{"sid": sid, "blob": pack_ids(oids)} for sid, oids in chosen.items()],
+        )
+        db.session.execute(Response.__table__.delete().where(Response.session_id.in_(ids)))
+        db.session.commit()
+        sessions += len(ids)
+        responses += sum(len(oids) for oids in chosen.values())
+        packed += 4 * sum(len(oids) for oids in chosen.values())
+
+
+def session_answers(session_ids):
+    # {session_id: {question_id: option_id}}, read from the response table
+    # or from the archive, whichever holds each session.
+    session_ids = list(dict.fromkeys(session_ids))
+    answers = {sid: {} for sid in session_ids}
+    archived = {}
+    for start in range(0, len(session_ids), CHUNK_SIZE):
+        chunk = session_ids[start:start + CHUNK_SIZE]
+        archived.update(
+            (sid, unpack_ids(blob)) for sid, blob in db.session.query(ExamSession.id, ExamSession.archived_answers)
+            .filter(ExamSession.id.in_(chunk), ExamSession.archived_answers.isnot(None))
+        )
+        live = [sid for sid in chunk if sid not in archived]
+        if live:
+            for sid, qid, oid in (
+                db.session.query(Response.session_id, Response.question_id, Response.selected_option_id)
+                .filter(Response.session_id.in_(live))
+            ):
+                answers[sid][qid] = oid
+    if archived:
+        # Each option belongs to one question, so the option ids are enough.
+        option_ids = list(set().union(*archived.values()))
+        question_of = {}
+        for start in range(0, len(option_ids), CHUNK_SIZE):
+            question_of.update(
+                db.session.query(Option.id, Option.question_id).filter(Option.id.in_(option_ids[start:start + CHUNK_SIZE]))
+            )
+        for sid, oids in archived.items():
+            answers[sid] = {question_of[oid]: oid for oid in oids if oid in question_of}
+    return answers
@@ -0,0 +1,160 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shlex
+import subprocess
+import tempfile
+from pathlib import Path
+from flask import abort, request, send_from_directory, url_for
+
+# Served as /assets/<name>.<hash>.<ext>; a new build gets new names, so
+# browsers may keep these for a year without revalidating.
+IMMUTABLE = "public, max-age=31536000, immutable"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# Built from app/frontend by the Tailwind CLI; every other asset is a
+# file under app/static taken as is.
+SOURCES = ["css/app.css", "js/exam.js", "js/exam_offline.js"]
+# Workers serve the manifest they started with until restarted, so the
+# files of this many recent builds are kept; older ones are pruned.
+KEEP_BUILDS = 3
+MANIFEST = "manifest.json"
+HISTORY = "builds.json"
+
+
+# Fingerprinted, precompressed static assets, listed in
+# app/static/dist/manifest.json by `flask build-assets`. Templates call
+# asset_url(name), which returns the built file when there is one and
+# otherwise the plain static file, or None for the stylesheet, in which
+# case base.html falls back to the Tailwind CDN.
+class Assets:
+    def __init__(self):
+        self.directory = None
+        self.manifest = {}
+        self._static = None
+
+    def init_app(self, app):
+        self.directory = Path(app.static_folder, "dist")
+        manifest = self.directory / MANIFEST
+        self.manifest = json.loads(manifest.read_text()) if manifest.exists() else {}
+        self._static = Path(app.static_folder)
+        app.add_url_rule("/assets/<path:filename>", "assets", self.send)
+        app.add_template_global(self.url, "asset_url")
+
+    def url(self, name):
+        if name in self.manifest:
+            return url_for("assets", filename=self.manifest[name])
+        if (self._static / name).is_file():
+            return url_for("static", filename=name)
+        return None
+
+    def send(self, filename):
+        if not (self.directory / filename).is_file() or filename in (MANIFEST, HISTORY):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in ENCODINGS:
+            if encoding in request.accept_encodings and (self.directory / (filename + suffix)).is_file():
+                response = send_from_directory(self.directory, filename + suffix, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(self.directory, filename, mimetype=mimetype)
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+assets = Assets()
+
+
+def _compile_css(app, command, out):
+    # Purged (only classes used by templates and scripts) and minified.
+    frontend = Path(app.root_path, "frontend")
+    subprocess.run(
+        shlex.split(command) + [
+            "-c", str(frontend / "tailwind.config.js"), "-i", str(frontend / "app.css"), "-o", str(out), "--minify",
+        ],
+        cwd=app.root_path, check=True, capture_output=True,
+    )
+
+
+def _compressors():
+    yield ".gz", lambda data: gzip.compress(data, 9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        return
+    yield ".br", lambda data: brotli.compress(data, quality=11)
+
+
+def _write(path, data):
+    # Readers see the old file or the new one, never a partial write.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _prune(dist, builds):
+    # Removes every built file no kept manifest refers to.
+    keep = {MANIFEST, HISTORY}
+    for manifest in builds:
+        for built in manifest.values():
+            keep.add(built)
+            keep.update(built + suffix for _, suffix in ENCODINGS)
+    removed = 0
+    for path in sorted(dist.rglob("*"), reverse=True):
+        name = path.relative_to(dist).as_posix()
+        if path.is_file() and name not in keep:
+            path.unlink()
+            removed += 1
+        elif path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+    return removed
+
+
+def build_assets(app, tailwind=None, log=print):
+    # Writes the new files next to those of earlier builds, swaps in the new
+    # manifest and returns it. Running workers keep linking to the files
+    # of the manifest they loaded, which survive the next KEEP_BUILDS builds.
+    dist = Path(app.static_folder, "dist")
+    dist.mkdir(parents=True, exist_ok=True)
+    compressors = list(_compressors())
+    if not any(suffix == ".br" for suffix, _ in compressors):
+        log("brotli is not installed; writing gzip copies only")
+    manifest = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for name in SOURCES:
+            source = Path(app.static_folder, name)
+            if name == "css/app.css":
+                source = Path(scratch, "app.css")
+                try:
+                    _compile_css(app, tailwind or app.config["TAILWIND_CLI"], source)
+                except (OSError, subprocess.CalledProcessError) as exc:
+                    log(f"Skipped {name}: the Tailwind CLI failed ({exc}); pages keep using the CDN")
+                    continue
+            data = source.read_bytes()
+            stem, ext = name.rsplit(".", 1)
+            built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}.{ext}"
+            _write(dist / built, data)
+            sizes = [f"{len(data)} bytes"]
+            for suffix, compress in compressors:
+                packed = compress(data)
+                _write(dist / (built + suffix), packed)
+                sizes.append(f"{suffix[1:]} {len(packed)}")
+            manifest[name] = built
+            log(f"{name} -> {built} ({', '.join(sizes)})")
+    try:
+        builds = json.loads((dist / HISTORY).read_text())
+    except (OSError, ValueError):
+        builds = []
+        if (dist / MANIFEST).exists():
+            builds.append(json.loads((dist / MANIFEST).read_text()))
+    builds = [manifest] + [b for b in builds if b != manifest][:KEEP_BUILDS - 1]
+    _write(dist / HISTORY, json.dumps(builds, indent=2, sort_keys=True).encode())
+    _write(dist / MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    removed = _prune(dist, builds)
+    if removed:
+        log(f"Removed {removed} file(s) of older builds")
+    return manifest
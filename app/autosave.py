@@ -0,0 +1,163 @@
+import threading
+import time
+from .models import ExamSession, Response
+from .storage import current_tenant
+from . import db
+
+CHUNK_SIZE = 500
+
+
+def _upsert_statement():
+    # Native upsert on the (session_id, question_id) unique index where the
+    # dialect supports it.
+    name = db.session.get_bind().dialect.name
+    if name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    stmt = insert(Response)
+    return stmt.on_conflict_do_update(
+        index_elements=[Response.session_id, Response.question_id],
+        set_={"selected_option_id": stmt.excluded.selected_option_id},
+    )
+
+
+def save_answers(pending):
+    # Batched upsert of {session_id: {question_id: option_id}} keyed on
+    # (session_id, question_id). Sessions that are already completed are skipped.
+    session_ids = list(pending)
+    open_ids = set()
+    for start in range(0, len(session_ids), CHUNK_SIZE):
+        chunk = session_ids[start:start + CHUNK_SIZE]
+        open_ids.update(
+            sid for (sid,) in db.session.query(ExamSession.id)
+            .filter(ExamSession.id.in_(chunk), ExamSession.completed_at.is_(None))
+        )
+    rows = [
+        {"session_id": sid, "question_id": qid, "selected_option_id": oid}
+        for sid in open_ids
+        for qid, oid in pending[sid].items()
+    ]
+    if not rows:
+        return 0
+    stmt = _upsert_statement()
+    if stmt is not None:
+        db.session.execute(stmt, rows)
+    else:
+        existing = {}
+        for start in range(0, len(session_ids), CHUNK_SIZE):
+            chunk = [sid for sid in session_ids[start:start + CHUNK_SIZE] if sid in open_ids]
+            for resp in Response.query.filter(Response.session_id.in_(chunk)):
+                existing[(resp.session_id, resp.question_id)] = resp
+        for row in rows:
+            resp = existing.get((row["session_id"], row["question_id"]))
+            if resp is None:
+                db.session.add(Response(**row))
+            else:
+                resp.selected_option_id = row["selected_option_id"]
+    db.session.commit()
+    return len(rows)
+
+
+# Coalesces autosave deltas per (session_id, question_id) so that a burst
+# of radio-button changes becomes one batched upsert. Pending answers are
+# flushed when AUTOSAVE_FLUSH_SIZE is reached, every AUTOSAVE_FLUSH_INTERVAL
+# seconds by a background thread, and for a session when it is submitted.
+# Sessions are kept per school and written to that school's database.
+class AnswerBuffer:
+    def __init__(self, flush_size=500, flush_interval=2.0):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+
+    def init_app(self, app):
+        self.flush_size = app.config.get("AUTOSAVE_FLUSH_SIZE", self.flush_size)
+        self.flush_interval = app.config.get("AUTOSAVE_FLUSH_INTERVAL", self.flush_interval)
+        self._app = app
+
+    def add(self, session_id, answers):
+        if not self.flush_interval:
+            return save_answers({session_id: dict(answers)})
+        with self._lock:
+            bucket = self._pending.setdefault((current_tenant(), session_id), {})
+            before = len(bucket)
+            bucket.update(answers)
+            self._count += len(bucket) - before
+            due = self._count >= self.flush_size
+        self._ensure_thread()
+        if due:
+            self.flush(everywhere=True)
+        return len(answers)
+
+    def peek(self, session_id):
+        with self._lock:
+            return dict(self._pending.get((current_tenant(), session_id), {}))
+
+    def _take(self, session_ids=None, everywhere=False):
+        tenant = current_tenant()
+        with self._lock:
+            if everywhere:
+                taken, self._pending = self._pending, {}
+            elif session_ids is None:
+                taken = {key: self._pending.pop(key) for key in list(self._pending) if key[0] == tenant}
+            else:
+                taken = {(tenant, sid): self._pending.pop((tenant, sid)) for sid in session_ids if (tenant, sid) in self._pending}
+            self._count -= sum(len(a) for a in taken.values())
+        return taken
+
+    def flush(self, session_ids=None, everywhere=False):
+        # The current school's sessions (or just session_ids); every
+        # school's with everywhere=True.
+        from .tenancy import tenancy
+
+        by_tenant = {}
+        for (tenant, sid), answers in self._take(session_ids, everywhere).items():
+            by_tenant.setdefault(tenant, {})[sid] = answers
+        saved = 0
+        for tenant, pending in by_tenant.items():
+            try:
+                with tenancy.activate(tenant):
+                    saved += save_answers(pending)
+            except Exception:
+                db.session.rollback()
+                self._restore(tenant, pending)
+                raise
+        return saved
+
+    def _restore(self, tenant, pending):
+        # Put the answers back unless a newer delta arrived meanwhile.
+        with self._lock:
+            for sid, answers in pending.items():
+                bucket = self._pending.setdefault((tenant, sid), {})
+                before = len(bucket)
+                for qid, oid in answers.items():
+                    bucket.setdefault(qid, oid)
+                self._count += len(bucket) - before
+
+    def _ensure_thread(self):
+        if self._thread is not None or self._app is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="autosave-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if not self._count:
+                continue
+            with self._app.app_context():
+                try:
+                    self.flush(everywhere=True)
+                except Exception:
+                    self._app.logger.exception("Autosave flush failed")
+
+
+answer_buffer = AnswerBuffer()
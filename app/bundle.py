@@ -0,0 +1,78 @@
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import or_, update
+from .models import ExamSession
+from . import db
+
+BUNDLE_FORMAT = 1
+# Client clocks drift; deltas stamped this early are still inside the window.
+CLOCK_SKEW_SECONDS = 60
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="exam-bundle")
+
+
+def bundle_token(session):
+    return _serializer().dumps([session.id, session.student_id])
+
+
+def valid_token(session, token):
+    # False when the token is missing, forged or belongs to another session.
+    try:
+        session_id, student_id = _serializer().loads(token or "")
+    except (BadSignature, TypeError, ValueError):
+        return False
+    return session_id == session.id and student_id == session.student_id
+
+
+def build_bundle(session, paper, saved, now=None):
+    # The whole paper in one compact document the exam page renders and
+    # keeps offline: questions as [id, text, time limit, [[option id, text]]].
+    now = now or datetime.utcnow()
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "session": session.id,
+        "token": bundle_token(session),
+        "subject": paper.name,
+        "remaining": max(0, int((session.expires_at - now).total_seconds())),
+        "seq": session.sync_seq or 0,
+        "questions": [
+            [q.id, q.text, q.time_limit_seconds or 0, [[o.id, o.text] for o in q.options]]
+            for q in paper.questions
+        ],
+        "answers": {str(qid): oid for qid, oid in saved.items()},
+    }
+    return json.dumps(bundle, separators=(",", ":"), ensure_ascii=False)
+
+
+def outside_window(session, now=None, grace=0):
+    # Why an answer may not be accepted for this session now, or None.
+    now = now or datetime.utcnow()
+    if session.completed_at is not None:
+        return "Session already submitted"
+    if session.started_at is not None and now < session.started_at - timedelta(seconds=CLOCK_SKEW_SECONDS):
+        return "Session has not started"
+    if session.expires_at is not None and now > session.expires_at + timedelta(seconds=grace):
+        return "Time is up"
+    return None
+
+
+def claim_seq(session_id, seq):
+    # True when seq is newer than the last delta applied to the session and
+    # it was recorded; a retry of an applied delta, or one overtaken by a
+    # newer delta, is acknowledged without being applied again.
+    result = db.session.execute(
+        update(ExamSession)
+        .where(
+            ExamSession.id == session_id,
+            ExamSession.completed_at.is_(None),
+            or_(ExamSession.sync_seq.is_(None), ExamSession.sync_seq < seq),
+        )
+        .values(sync_seq=seq)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
@@ -0,0 +1,138 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from .storage import tenant_key
+
+
+# Every Cache instance, so /metrics can report hit rates.
+caches = []
+
+
+# In-process LRU, optionally backed by a shared Redis (CACHE_REDIS_URL).
+# The local tier is always consulted first; shared values must be picklable.
+# With versioned=True, shared entries live under a per-key version that
+# delete() bumps, so a worker that read stale data just before another one
+# invalidated it writes to a version nobody reads any more. Keys are
+# namespaced by the active school (see tenancy.py).
+class Cache:
+    def __init__(self, name, maxsize=1024, ttl=None, shared_ttl=None, versioned=False):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared_ttl = shared_ttl
+        self.versioned = versioned
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared = None
+        caches.append(self)
+
+    def init_app(self, app):
+        # <NAME>_CACHE_TTL, e.g. USER_CACHE_TTL, overrides the local TTL and
+        # <NAME>_CACHE_SIZE the number of local entries.
+        self.ttl = app.config.get(f"{self.name.upper()}_CACHE_TTL", self.ttl)
+        self.maxsize = app.config.get(f"{self.name.upper()}_CACHE_SIZE", self.maxsize)
+        url = app.config.get("CACHE_REDIS_URL")
+        if url:
+            try:
+                import redis
+            except ImportError:
+                app.logger.warning("CACHE_REDIS_URL is set but redis is not installed; %s cache stays local", self.name)
+            else:
+                self._shared = redis.Redis.from_url(url)
+
+    def _base_key(self, key):
+        return f"cbtpro:{self.name}:{key!r}"
+
+    def _shared_key(self, key):
+        base = self._base_key(key)
+        if not self.versioned:
+            return base
+        version = self._shared.get(f"{base}:version")
+        return f"{base}:v{int(version or 0)}"
+
+    def get(self, key, default=None):
+        found, value, _ = self._lookup(tenant_key(key))
+        return value if found else default
+
+    def _lookup(self, key):
+        # (found, value, shared_key); shared_key is where a freshly built value goes.
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value, None
+                del self._data[key]
+        shared_key = None
+        if self._shared is not None:
+            try:
+                shared_key = self._shared_key(key)
+                raw = self._shared.get(shared_key)
+            except Exception:
+                raw = None
+            if raw is not None:
+                value = pickle.loads(raw)
+                self._store(key, value)
+                with self._lock:
+                    self.hits += 1
+                return True, value, shared_key
+        with self._lock:
+            self.misses += 1
+        return False, None, shared_key
+
+    def _store(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def set(self, key, value):
+        self._set(tenant_key(key), value)
+
+    def _set(self, key, value, shared_key=None):
+        self._store(key, value)
+        if self._shared is not None:
+            ttl = self.shared_ttl or self.ttl
+            try:
+                self._shared.set(shared_key or self._shared_key(key), pickle.dumps(value), ex=int(ttl) if ttl else None)
+            except Exception:
+                pass
+
+    def get_or_set(self, key, factory):
+        # A factory returning None is not cached.
+        key = tenant_key(key)
+        found, value, shared_key = self._lookup(key)
+        if not found:
+            value = factory()
+            if value is not None:
+                self._set(key, value, shared_key)
+        return value
+
+    def delete(self, key):
+        key = tenant_key(key)
+        with self._lock:
+            self._data.pop(key, None)
+        if self._shared is not None:
+            try:
+                if self.versioned:
+                    self._shared.incr(f"{self._base_key(key)}:version")
+                else:
+                    self._shared.delete(self._shared_key(key))
+            except Exception:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,381 @@
+import shutil
+import time
+from datetime import timedelta
+from functools import wraps
+import click
+from sqlalchemy import and_, distinct, func, select
+from sqlalchemy.engine import make_url
+from .models import Subject, Question, Option, ExamSession, Response, User, UserRole
+from .scoring import _answer_key
+from .scoring import regrade
+from .importer import FORMATS, detect_format, import_questions
+from .enrollment import enroll_students, credentials_csv
+from .pdf import pdf_renderer, request_class_archive
+from .sweeper import sweep_expired
+from .archive import archive_sessions
+from .admission import open_exam_window
+from .search import rebuild_index
+from .papers import draw_order
+from .gradebook import gradebook_rows, iter_csv, iter_xlsx
+from .assets import build_assets
+from .migrations import HEAD, MIGRATIONS, current_version, upgrade
+from .tenancy import Tenant, tenancy
+from . import storage
+from . import db
+
+
+def school_option(command):
+    # Adds --school: the command runs against that school's database
+    # instead of the primary one.
+    @click.option("--school", default=None, help="Run against this school's database (default: the primary).")
+    @wraps(command)
+    def wrapper(*args, school=None, **kwargs):
+        if school is not None and tenancy.registry.get(school) is None:
+            raise click.ClickException(f"No school {school!r} in {tenancy.registry.path}")
+        with tenancy.activate(school):
+            return command(*args, **kwargs)
+    return wrapper
+
+
+@click.command("regrade")
+@school_option
+@click.option("--subject-id", type=int, default=None, help="Only regrade sessions of this subject.")
+def regrade_command(subject_id):
+    """Recompute stored results for completed exam sessions."""
+    count = regrade(subject_id)
+    click.echo(f"Regraded {count} session(s).")
+
+
+@click.command("import-questions")
+@school_option
+@click.argument("subject_id", type=int)
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default=None, help="Defaults to the file extension.")
+def import_questions_command(subject_id, path, fmt):
+    """Bulk-import a CSV, JSON or Aiken question bank into a subject."""
+    subject = db.session.get(Subject, subject_id)
+    if subject is None:
+        raise click.ClickException(f"Subject {subject_id} not found")
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        report = import_questions(subject, stream, fmt or detect_format(path))
+    for error in report.errors:
+        click.echo(f"line {error.line}: {error.message}", err=True)
+    click.echo(f"Imported {report.imported} question(s), {report.failed} rejected.")
+
+
+@click.command("enroll-students")
+@school_option
+@click.argument("roster", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", type=int, default=None, help="Password-hashing processes (default: ENROLL_WORKERS or the CPU count).")
+@click.option("--class-name", default=None, help="Class for rows without a class_name.")
+@click.option("--credentials", type=click.Path(dir_okay=False, writable=True), default=None, help="Write the new logins to this CSV file.")
+def enroll_students_command(roster, workers, class_name, credentials):
+    """Create student accounts in bulk from a CSV roster."""
+    with open(roster, encoding="utf-8-sig", newline="") as stream:
+        report = enroll_students(stream, workers=workers, default_class=class_name)
+    for error in report.errors:
+        click.echo(f"line {error.line} {error.email}: {error.message}", err=True)
+    if credentials and report.credentials:
+        with open(credentials, "w", newline="") as out:
+            out.write(credentials_csv(report.credentials))
+    click.echo(
+        f"Enrolled {report.created} student(s), {report.duplicates} duplicate(s), {report.failed} rejected "
+        f"in {report.elapsed:.1f}s ({report.rate:.1f} students/s)."
+    )
+
+
+@click.command("export-report-cards")
+@school_option
+@click.argument("class_name")
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+def export_report_cards_command(class_name, output):
+    """Render every report card of a class in parallel into one zip."""
+    started = time.perf_counter()
+    while True:
+        state, digest = request_class_archive(class_name)
+        if state == "ready":
+            break
+        if state == "failed":
+            raise click.ClickException("Some report cards failed to render")
+        time.sleep(0.5)
+    shutil.copyfile(pdf_renderer.path_for(digest, "zip"), output)
+    click.echo(f"Wrote {output} in {time.perf_counter() - started:.1f}s.")
+
+
+@click.command("export-gradebook")
+@school_option
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option("--subject-id", type=int, multiple=True, help="Limit to these subjects (repeatable).")
+@click.option("--class-name", default=None)
+@click.option("--from", "date_from", type=click.DateTime(["%Y-%m-%d"]), default=None)
+@click.option("--to", "date_to", type=click.DateTime(["%Y-%m-%d"]), default=None)
+def export_gradebook_command(output, subject_id, class_name, date_from, date_to):
+    """Write every completed exam result to a CSV or .xlsx gradebook."""
+    rows = gradebook_rows(
+        list(subject_id) or None, class_name,
+        date_from.date() if date_from else None, date_to.date() if date_to else None,
+    )
+    if output.endswith(".xlsx"):
+        with open(output, "wb") as fh:
+            for chunk in iter_xlsx(rows):
+                fh.write(chunk)
+    else:
+        with open(output, "w", newline="", encoding="utf-8") as fh:
+            for chunk in iter_csv(rows):
+                fh.write(chunk)
+    click.echo(f"Wrote {output}.")
+
+
+@click.command("db-upgrade")
+@click.option("--to", "target", type=int, default=None, help="Stop at this version (default: latest).")
+def db_upgrade_command(target):
+    """Apply pending schema migrations."""
+    applied = upgrade(db.engine, target)
+    click.echo(f"Applied {applied}." if applied else "Already up to date.")
+
+
+@click.command("db-status")
+def db_status_command():
+    """Show the schema version and pending migrations."""
+    with db.engine.connect() as conn:
+        version = current_version(conn)
+    click.echo(f"Database at version {version}, code at version {HEAD}.")
+    for number, description, _ in MIGRATIONS:
+        mark = "x" if number <= version else " "
+        click.echo(f"  [{mark}] {number}: {description}")
+
+
+@click.command("explain-queries")
+def explain_queries_command():
+    """Print the query plans of the main student and report queries."""
+    student = User.query.filter_by(role=UserRole.STUDENT.value).first()
+    student_id = student.id if student else 1
+    class_name = student.class_name if student and student.class_name else "JSS 1"
+    subject_id = db.session.query(func.min(Subject.id)).scalar() or 1
+    session_id = db.session.query(func.max(ExamSession.id)).scalar() or 1
+    answer_key = _answer_key()
+    queries = {
+        "student.index subjects": (
+            db.select(Subject)
+            .where((Subject.class_name.is_(None)) | (Subject.class_name == class_name))
+            .order_by(Subject.created_at.desc())
+        ),
+        "start_exam open session": (
+            db.select(ExamSession)
+            .filter_by(subject_id=subject_id, student_id=student_id, completed_at=None)
+            .where(ExamSession.expires_at > func.current_timestamp())
+            .order_by(ExamSession.started_at.desc())
+        ),
+        "expiry sweep": (
+            db.select(ExamSession.id)
+            .where(ExamSession.completed_at.is_(None), ExamSession.expires_at <= func.current_timestamp())
+            .order_by(ExamSession.expires_at)
+            .limit(500)
+        ),
+        "report card latest sessions": (
+            db.select(ExamSession)
+            .where(ExamSession.student_id == student_id, ExamSession.completed_at.isnot(None))
+            .order_by(ExamSession.completed_at.desc())
+        ),
+        "take_exam saved answers": db.select(Response.question_id, Response.selected_option_id).filter_by(session_id=session_id),
+        "paper options": (
+            db.select(Option.id, Option.question_id, Option.text)
+            .join(Question, Question.id == Option.question_id)
+            .where(Question.subject_id == subject_id)
+        ),
+        "draw paper questions": (
+            db.select(Question.id)
+            .where(Question.subject_id == subject_id)
+            .order_by(draw_order(12345))
+            .limit(40)
+        ),
+        "score sessions": (
+            db.select(ExamSession.id, func.count(distinct(Question.id)), func.count(distinct(answer_key.c.question_id)))
+            .join(Question, Question.subject_id == ExamSession.subject_id)
+            .outerjoin(Response, and_(Response.session_id == ExamSession.id, Response.question_id == Question.id))
+            .outerjoin(answer_key, and_(answer_key.c.question_id == Question.id, answer_key.c.option_id == Response.selected_option_id))
+            .where(ExamSession.id.in_([session_id]))
+            .group_by(ExamSession.id)
+        ),
+    }
+    dialect = db.engine.dialect
+    prefix = "EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN "
+    with db.engine.connect() as conn:
+        for name, stmt in queries.items():
+            sql = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+            click.echo(f"== {name}")
+            for row in conn.exec_driver_sql(prefix + sql):
+                click.echo("   " + " | ".join(str(col) for col in row))
+
+
+@click.command("storage-report")
+def storage_report_command():
+    """Show the effective database profile, pools and SQLite pragmas."""
+    from flask import current_app
+
+    engines = dict(db.engines)
+    for line in storage.report(current_app, engines):
+        click.echo(line)
+    for key, engine in engines.items():
+        if engine.dialect.name == "sqlite":
+            pragmas = storage.effective_pragmas(engine)
+            click.echo(f"  {key or 'primary'} pragmas: " + ", ".join(f"{k}={v}" for k, v in pragmas.items()))
+
+
+@click.command("sweep-sessions")
+@school_option
+@click.option("--grace", type=int, default=0, help="Only sweep sessions expired at least this many seconds ago.")
+def sweep_sessions_command(grace):
+    """Auto-submit every exam session past its deadline."""
+    count = sweep_expired(grace=grace)
+    click.echo(f"Auto-submitted {count} expired session(s).")
+
+
+@click.command("archive-responses")
+@school_option
+@click.option("--min-age-hours", type=float, default=24, help="Only sessions completed at least this long ago.")
+@click.option("--batch-size", type=int, default=500)
+def archive_responses_command(min_age_hours, batch_size):
+    """Pack the answers of completed exam sessions out of the response table."""
+    stats = archive_sessions(timedelta(hours=min_age_hours), batch_size)
+    click.echo(f"Archived {stats.sessions} session(s): {stats.responses} response row(s) packed into {stats.packed_bytes} bytes.")
+
+
+@click.command("open-exam-window")
+@school_option
+@click.argument("subject_id", type=int)
+@click.argument("class_name")
+def open_exam_window_command(subject_id, class_name):
+    """Start an exam session now for every student of a class."""
+    subject = db.session.get(Subject, subject_id)
+    if subject is None:
+        raise click.ClickException(f"Subject {subject_id} not found")
+    count = open_exam_window(subject, class_name)
+    click.echo(f"Started {count} session(s) for {class_name}.")
+
+
+@click.command("rebuild-search")
+@school_option
+def rebuild_search_command():
+    """Rebuild the full-text search index from the question bank."""
+    count = rebuild_index()
+    db.session.commit()
+    click.echo(f"Indexed {count} document(s).")
+
+
+@click.command("build-assets")
+@click.option("--tailwind", default=None, help="Tailwind CLI command (default: TAILWIND_CLI).")
+def build_assets_command(tailwind):
+    """Build fingerprinted, precompressed CSS and JS into app/static/dist."""
+    from flask import current_app
+
+    manifest = build_assets(current_app, tailwind, log=click.echo)
+    click.echo(f"Wrote {len(manifest)} asset(s); restart the app to serve them.")
+
+
+@click.group("tenants")
+def tenants_group():
+    """Manage the schools that have their own database."""
+
+
+def _school_engines(slugs):
+    # (label, engine) for the primary database and every school, or only the
+    # named schools; school engines are closed once the caller moves on.
+    if not slugs:
+        yield "primary", db.engine
+        slugs = [t.slug for t in tenancy.registry.all()]
+    for slug in slugs:
+        try:
+            engine = tenancy.create_engine(slug)
+        except KeyError:
+            raise click.ClickException(f"No school {slug!r} in {tenancy.registry.path}")
+        try:
+            yield slug, engine
+        finally:
+            engine.dispose()
+
+
+@tenants_group.command("list")
+def tenants_list_command():
+    """List registered schools, their hosts and databases."""
+    loaded = tenancy.loaded()
+    for t in tenancy.registry.all():
+        url = make_url(t.database_url).render_as_string(hide_password=True)
+        hosts = ", ".join(t.hosts) or "-"
+        click.echo(f"{t.slug}: {t.name} [{url}] hosts: {hosts}" + (" (engine open)" if t.slug in loaded else ""))
+
+
+@tenants_group.command("add")
+@click.argument("slug")
+@click.argument("database_url")
+@click.option("--name", default=None, help="Display name (default: the slug).")
+@click.option("--host", "hosts", multiple=True, help="Host name that selects this school (repeatable).")
+def tenants_add_command(slug, database_url, name, hosts):
+    """Register a school (or update it) and migrate its database."""
+    try:
+        tenancy.registry.add(Tenant(slug, name or slug, database_url, tuple(h.lower() for h in hosts)))
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    for _, engine in _school_engines([slug]):
+        applied = upgrade(engine)
+    click.echo(f"Registered {slug}; applied {applied}." if applied else f"Registered {slug}; schema up to date.")
+
+
+@tenants_group.command("remove")
+@click.argument("slug")
+def tenants_remove_command(slug):
+    """Unregister a school; its database is left as it is."""
+    if tenancy.registry.get(slug) is None:
+        raise click.ClickException(f"No school {slug!r}")
+    tenancy.registry.remove(slug)
+    click.echo(f"Removed {slug}.")
+
+
+@tenants_group.command("upgrade")
+@click.argument("slugs", nargs=-1)
+@click.option("--to", "target", type=int, default=None, help="Stop at this version (default: latest).")
+def tenants_upgrade_command(slugs, target):
+    """Apply pending migrations to every school's database (and the primary), or the named schools."""
+    for label, engine in _school_engines(slugs):
+        applied = upgrade(engine, target)
+        click.echo(f"{label}: applied {applied}." if applied else f"{label}: up to date.")
+
+
+@tenants_group.command("stats")
+@click.argument("slugs", nargs=-1)
+def tenants_stats_command(slugs):
+    """Show the schema version and row counts of every school's database."""
+    counts = {
+        "students": select(func.count()).select_from(User).where(User.role == UserRole.STUDENT.value),
+        "subjects": select(func.count()).select_from(Subject),
+        "questions": select(func.count()).select_from(Question),
+        "open sessions": select(func.count()).select_from(ExamSession).where(ExamSession.completed_at.is_(None)),
+        "completed sessions": select(func.count()).select_from(ExamSession).where(ExamSession.completed_at.isnot(None)),
+        "response rows": select(func.count()).select_from(Response),
+    }
+    for label, engine in _school_engines(slugs):
+        with engine.connect() as conn:
+            version = current_version(conn)
+            if version < HEAD:
+                click.echo(f"{label}: schema version {version}, code at {HEAD}; run `flask tenants upgrade`")
+                continue
+            values = ", ".join(f"{name} {conn.execute(stmt).scalar()}" for name, stmt in counts.items())
+        click.echo(f"{label}: version {version}, {values}")
+
+
+def register_commands(app):
+    app.cli.add_command(regrade_command)
+    app.cli.add_command(import_questions_command)
+    app.cli.add_command(enroll_students_command)
+    app.cli.add_command(export_report_cards_command)
+    app.cli.add_command(export_gradebook_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_status_command)
+    app.cli.add_command(explain_queries_command)
+    app.cli.add_command(storage_report_command)
+    app.cli.add_command(sweep_sessions_command)
+    app.cli.add_command(archive_responses_command)
+    app.cli.add_command(open_exam_window_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(tenants_group)
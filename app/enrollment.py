@@ -0,0 +1,161 @@
+import csv
+import io
+import os
+import secrets
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from email_validator import validate_email, EmailNotValidError
+from .models import User, UserRole
+from . import db
+
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 200
+
+RosterError = namedtuple("RosterError", ["line", "email", "message"])
+Credential = namedtuple("Credential", ["full_name", "email", "class_name", "password"])
+
+
+class EnrollmentReport:
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+        self.credentials = []
+        self.elapsed = 0.0
+
+    def add_error(self, line, email, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RosterError(line, email, message))
+
+    @property
+    def rate(self):
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+
+def read_roster(stream):
+    # Columns: name (or full_name), email, class_name, and an optional password.
+    reader = csv.DictReader(stream)
+    fields = {(f or "").strip().lower(): f for f in reader.fieldnames or []}
+    name_field = fields.get("full_name") or fields.get("name")
+    if not name_field or "email" not in fields:
+        yield reader.line_num, None
+        return
+    for row in reader:
+        yield reader.line_num, {
+            "full_name": (row.get(name_field) or "").strip(),
+            "email": (row.get(fields["email"]) or "").strip().lower(),
+            "class_name": (row.get(fields.get("class_name", "")) or "").strip() or None,
+            "password": (row.get(fields.get("password", "")) or "").strip(),
+        }
+
+
+# Password hashing is deliberately slow, so it is spread across a process
+# pool. The pool is started on first use and shared by every enrollment in
+# the process, so a roster upload does not fork a fresh set of workers.
+class PasswordHasher:
+    def __init__(self):
+        self.workers = os.cpu_count()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get("ENROLL_WORKERS") or self.workers
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+
+password_hasher = PasswordHasher()
+
+
+def _insert_batch(batch, pool, report):
+    emails = [row["email"] for _, row in batch]
+    taken = {email for (email,) in db.session.query(User.email).filter(User.email.in_(emails))}
+    fresh = []
+    for line, row in batch:
+        if row["email"] in taken:
+            report.duplicates += 1
+            report.add_error(line, row["email"], "Email already registered")
+        else:
+            fresh.append(row)
+    if not fresh:
+        return
+    hashes = pool.map(generate_password_hash, [row["password"] for row in fresh], chunksize=8)
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {
+            "full_name": row["full_name"],
+            "email": row["email"],
+            "class_name": row["class_name"],
+            "password_hash": password_hash,
+            "role": UserRole.STUDENT.value,
+            "created_at": now,
+        }
+        for row, password_hash in zip(fresh, hashes)
+    ])
+    db.session.commit()
+    report.created += len(fresh)
+    report.credentials.extend(Credential(r["full_name"], r["email"], r["class_name"], r["password"]) for r in fresh)
+
+
+def enroll_students(stream, workers=None, batch_size=BATCH_SIZE, default_class=None):
+    # Rows missing a password get a generated one, returned in
+    # report.credentials so they can be handed out. Passwords are hashed in
+    # the shared pool unless a number of workers is asked for.
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return _enroll(stream, pool, batch_size, default_class)
+    return _enroll(stream, password_hasher._get_pool(), batch_size, default_class)
+
+
+def _enroll(stream, pool, batch_size, default_class):
+    report = EnrollmentReport()
+    started = time.perf_counter()
+    seen = set()
+    batch = []
+    for line, row in read_roster(stream):
+        if row is None:
+            report.add_error(line, "", "Roster header must include name and email columns")
+            break
+        if len(row["full_name"]) < 3:
+            report.add_error(line, row["email"], "Name is missing or too short")
+            continue
+        try:
+            validate_email(row["email"], check_deliverability=False)
+        except EmailNotValidError as exc:
+            report.add_error(line, row["email"], str(exc))
+            continue
+        if row["email"] in seen:
+            report.duplicates += 1
+            report.add_error(line, row["email"], "Email appears more than once in the roster")
+            continue
+        seen.add(row["email"])
+        if len(row["password"]) < 6:
+            row["password"] = secrets.token_urlsafe(6)
+        row["class_name"] = row["class_name"] or default_class
+        batch.append((line, row))
+        if len(batch) >= batch_size:
+            _insert_batch(batch, pool, report)
+            batch = []
+    if batch:
+        _insert_batch(batch, pool, report)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def credentials_csv(credentials):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["full_name", "email", "class_name", "password"])
+    writer.writerows(credentials)
+    return out.getvalue()
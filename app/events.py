@@ -0,0 +1,157 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from .storage import tenant_key
+
+# Events buffered per watcher; a watcher that falls this far behind loses the oldest.
+QUEUE_SIZE = 1000
+REDIS_PREFIX = "cbtpro:events:"
+# Backoff between attempts to re-subscribe after Redis goes away.
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 30
+
+
+class Subscription:
+    def __init__(self, bus, channel):
+        self.bus = bus
+        self.channel = channel
+        self.queue = queue.Queue(QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+
+# In-process publish/subscribe for live exam monitoring. Exam routes publish
+# to a channel per subject and each SSE watcher reads from its own queue, so
+# watching costs no database queries. With CACHE_REDIS_URL set, events go
+# through Redis pub/sub so watchers on any worker see every event; one
+# listener thread per process fans them out locally. Channels are per
+# school, so subject 5 of one school never reaches another's watchers.
+class EventBus:
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._listener = None
+        self._app = None
+
+    def init_app(self, app):
+        self._app = app
+        url = app.config.get("CACHE_REDIS_URL")
+        if url:
+            try:
+                import redis
+            except ImportError:
+                app.logger.warning("CACHE_REDIS_URL is set but redis is not installed; live events stay per worker")
+            else:
+                self._redis = redis.Redis.from_url(url)
+
+    def subscribe(self, channel):
+        sub = Subscription(self, tenant_key(channel))
+        with self._lock:
+            self._subscribers.setdefault(sub.channel, set()).add(sub)
+        if self._redis is not None:
+            self._ensure_listener()
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.channel]
+
+    def watchers(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(tenant_key(channel), ()))
+
+    def publish(self, channel, event):
+        channel = tenant_key(channel)
+        if self._redis is not None:
+            try:
+                self._redis.publish(f"{REDIS_PREFIX}{channel}", dumps(event))
+                return
+            except Exception:
+                self._app.logger.exception("Publishing a live event to Redis failed")
+        self._deliver(channel, event)
+
+    def _deliver(self, channel, event):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        for sub in subs:
+            sub.put(event)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="event-listener", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # Runs for the life of the process: a lost connection is retried with
+        # backoff, and events published while it was down are missed.
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{REDIS_PREFIX}*")
+                for message in pubsub.listen():
+                    delay = RECONNECT_MIN_SECONDS
+                    channel = message["channel"].decode()[len(REDIS_PREFIX):]
+                    try:
+                        event = json.loads(message["data"])
+                    except ValueError:
+                        self._app.logger.warning("Dropped a malformed live event on %s", channel)
+                        continue
+                    self._deliver(int(channel) if channel.isdigit() else channel, event)
+            except Exception:
+                self._app.logger.exception("Live event listener lost Redis; reconnecting in %ss", delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    # Naive datetimes in this app are UTC.
+    return json.dumps(value, default=_default)
+
+
+def format_sse(event, name=None):
+    lines = [f"event: {name}"] if name else []
+    lines.append("data: " + dumps(event))
+    return "\n".join(lines) + "\n\n"
+
+
+event_bus = EventBus()
@@ -1,54 +1,99 @@
-from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, TextAreaField, IntegerField, BooleanField, SelectField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, NumberRange, Optional
-
-
-CLASS_CHOICES = [(f"Primary {i}", f"Primary {i}") for i in range(1, 7)] \
-    + [(f"JSS {i}", f"JSS {i}") for i in range(1, 4)] \
-    + [(f"SS {i}", f"SS {i}") for i in range(1, 4)]
-ALL_CLASS_CHOICES = [("", "All classes")] + CLASS_CHOICES
-
-
-class RegisterForm(FlaskForm):
-    full_name = StringField("Full Name", validators=[DataRequired(), Length(min=3, max=120)])
-    email = StringField("Email", validators=[DataRequired(), Email()])
-    password = PasswordField("Password", validators=[DataRequired(), Length(min=6)])
-    confirm = PasswordField("Confirm Password", validators=[DataRequired(), EqualTo("password")])
-    role = SelectField("Role", choices=[("student", "Student"), ("teacher", "Teacher")], validators=[DataRequired()])
-    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
-    submit = SubmitField("Create Account")
-
-
-class LoginForm(FlaskForm):
-    email = StringField("Email", validators=[DataRequired(), Email()])
-    password = PasswordField("Password", validators=[DataRequired()])
-    submit = SubmitField("Login")
-
-
-class SubjectForm(FlaskForm):
-    name = StringField("Subject Name", validators=[DataRequired(), Length(min=2, max=120)])
-    description = TextAreaField("Description")
-    duration_minutes = IntegerField("Duration (minutes)", validators=[DataRequired(), NumberRange(min=5, max=300)])
-    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
-    submit = SubmitField("Save Subject")
-
-
-class QuestionForm(FlaskForm):
-    text = TextAreaField("Question Text", validators=[DataRequired(), Length(min=3)])
-    time_limit_seconds = IntegerField("Per-question time (seconds)", validators=[Optional(), NumberRange(min=10, max=900)])
-    submit = SubmitField("Save Question")
-
-
-class OptionForm(FlaskForm):
-    text = StringField("Option Text", validators=[DataRequired(), Length(min=1)])
-    is_correct = BooleanField("Is Correct")
-    submit = SubmitField("Add Option")
-
-
-class DeleteForm(FlaskForm):
-    submit = SubmitField("Delete")
-
-
-class ProfileForm(FlaskForm):
-    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
-    submit = SubmitField("Save Settings")
+from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, SubmitField, TextAreaField, IntegerField, BooleanField, SelectField, DateField
+from wtforms.validators import DataRequired, Email, Length, EqualTo, NumberRange, Optional, ValidationError
+from .papers import parse_quotas
+
+
+CLASS_CHOICES = [(f"Primary {i}", f"Primary {i}") for i in range(1, 7)] \
+    + [(f"JSS {i}", f"JSS {i}") for i in range(1, 4)] \
+    + [(f"SS {i}", f"SS {i}") for i in range(1, 4)]
+ALL_CLASS_CHOICES = [("", "All classes")] + CLASS_CHOICES
+
+
+class RegisterForm(FlaskForm):
+    full_name = StringField("Full Name", validators=[DataRequired(), Length(min=3, max=120)])
+    email = StringField("Email", validators=[DataRequired(), Email()])
+    password = PasswordField("Password", validators=[DataRequired(), Length(min=6)])
+    confirm = PasswordField("Confirm Password", validators=[DataRequired(), EqualTo("password")])
+    role = SelectField("Role", choices=[("student", "Student"), ("teacher", "Teacher")], validators=[DataRequired()])
+    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
+    submit = SubmitField("Create Account")
+
+
+class LoginForm(FlaskForm):
+    email = StringField("Email", validators=[DataRequired(), Email()])
+    password = PasswordField("Password", validators=[DataRequired()])
+    submit = SubmitField("Login")
+
+
+class SubjectForm(FlaskForm):
+    name = StringField("Subject Name", validators=[DataRequired(), Length(min=2, max=120)])
+    description = TextAreaField("Description")
+    duration_minutes = IntegerField("Duration (minutes)", validators=[DataRequired(), NumberRange(min=5, max=300)])
+    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
+    questions_per_paper = IntegerField("Questions per paper", validators=[Optional(), NumberRange(min=1, max=500)])
+    topic_quotas = TextAreaField("Topic quotas", validators=[Optional()])
+    shuffle_options = BooleanField("Shuffle options")
+    submit = SubmitField("Save Subject")
+
+    def validate_topic_quotas(self, field):
+        try:
+            parse_quotas(field.data)
+        except ValueError as exc:
+            raise ValidationError(str(exc))
+
+
+class QuestionForm(FlaskForm):
+    text = TextAreaField("Question Text", validators=[DataRequired(), Length(min=3)])
+    time_limit_seconds = IntegerField("Per-question time (seconds)", validators=[Optional(), NumberRange(min=10, max=900)])
+    topic = StringField("Topic", validators=[Optional(), Length(max=64)])
+    submit = SubmitField("Save Question")
+
+
+class OptionForm(FlaskForm):
+    text = StringField("Option Text", validators=[DataRequired(), Length(min=1)])
+    is_correct = BooleanField("Is Correct")
+    submit = SubmitField("Add Option")
+
+
+class QuestionImportForm(FlaskForm):
+    file = FileField("Question bank file", validators=[FileRequired(), FileAllowed(["csv", "json", "jsonl", "txt"], "CSV, JSON or Aiken (.txt) files only")])
+    format = SelectField("Format", choices=[("", "Detect from file name"), ("csv", "CSV"), ("json", "JSON"), ("aiken", "Aiken")], validators=[Optional()])
+    submit = SubmitField("Import Questions")
+
+
+class RosterUploadForm(FlaskForm):
+    file = FileField("Class roster (CSV)", validators=[FileRequired(), FileAllowed(["csv"], "CSV files only")])
+    class_name = SelectField("Default class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
+    submit = SubmitField("Enroll Students")
+
+
+class GradebookExportForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    subject_id = SelectField("Subject", coerce=int, choices=[(0, "All my subjects")], validators=[Optional()])
+    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
+    date_from = DateField("From", validators=[Optional()])
+    date_to = DateField("To", validators=[Optional()])
+    format = SelectField("Format", choices=[("csv", "CSV"), ("xlsx", "Excel (.xlsx)")])
+    submit = SubmitField("Export")
+
+    def validate_date_to(self, field):
+        if field.data and self.date_from.data and field.data < self.date_from.data:
+            raise ValidationError("End date is before the start date")
+
+
+class ExamWindowForm(FlaskForm):
+    class_name = SelectField("Class", choices=CLASS_CHOICES, validators=[DataRequired()])
+    submit = SubmitField("Open Exam Window")
+
+
+class DeleteForm(FlaskForm):
+    submit = SubmitField("Delete")
+
+
+class ProfileForm(FlaskForm):
+    class_name = SelectField("Class", choices=ALL_CLASS_CHOICES, validators=[Optional()])
+    submit = SubmitField("Save Settings")
@@ -0,0 +1,16 @@
+// Used by `flask build-assets`, which runs the Tailwind CLI from the app
+// directory; keep the theme in step with the CDN fallback in base.html.
+module.exports = {
+	content: ['./templates/**/*.html', './static/js/**/*.js'],
+	darkMode: 'class',
+	theme: {
+		extend: {
+			colors: {
+				brand: {
+					DEFAULT: '#0ea5e9',
+					dark: '#0284c7'
+				}
+			}
+		}
+	}
+};
@@ -0,0 +1,134 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime, time, timedelta
+from sqlalchemy import select
+from .models import ExamSession, ExamResult, Subject, User
+from .scoring import record_results
+from . import db
+
+BATCH_SIZE = 1000
+COLUMNS = [
+    "student", "email", "class_name", "subject", "correct", "total", "percentage", "grade",
+    "started_at", "completed_at", "session_id",
+]
+
+
+def _filters(subject_ids=None, class_name=None, date_from=None, date_to=None):
+    conditions = [ExamSession.completed_at.isnot(None)]
+    if subject_ids is not None:
+        conditions.append(ExamSession.subject_id.in_(subject_ids))
+    if class_name:
+        conditions.append(User.class_name == class_name)
+    if date_from:
+        conditions.append(ExamSession.completed_at >= datetime.combine(date_from, time.min))
+    if date_to:
+        conditions.append(ExamSession.completed_at < datetime.combine(date_to + timedelta(days=1), time.min))
+    return conditions
+
+
+def _grade_missing(conditions):
+    # Sessions completed before results were stored are graded once, in batches.
+    while True:
+        ids = db.session.scalars(
+            select(ExamSession.id)
+            .join(User, User.id == ExamSession.student_id)
+            .outerjoin(ExamResult, ExamResult.session_id == ExamSession.id)
+            .where(ExamResult.id.is_(None), *conditions)
+            .limit(500)
+        ).all()
+        if not ids:
+            return
+        record_results(ids)
+        db.session.commit()
+
+
+def gradebook_rows(subject_ids=None, class_name=None, date_from=None, date_to=None):
+    # Returns an iterator of one tuple per completed session, fetched
+    # BATCH_SIZE rows at a time over a server-side cursor, so memory stays
+    # flat however large the export.
+    conditions = _filters(subject_ids, class_name, date_from, date_to)
+    _grade_missing(conditions)
+    return _stream((
+        select(
+            User.full_name, User.email, User.class_name, Subject.name,
+            ExamResult.correct, ExamResult.total, ExamResult.percentage, ExamResult.grade,
+            ExamSession.started_at, ExamSession.completed_at, ExamSession.id,
+        )
+        .join(User, User.id == ExamSession.student_id)
+        .join(Subject, Subject.id == ExamSession.subject_id)
+        .join(ExamResult, ExamResult.session_id == ExamSession.id)
+        .where(*conditions)
+        .order_by(Subject.name, User.class_name, User.full_name, ExamSession.completed_at)
+        .execution_options(yield_per=BATCH_SIZE, stream_results=True)
+    ))
+
+
+def _stream(stmt):
+    for partition in db.session.execute(stmt).partitions():
+        yield from partition
+
+
+def _cells(row):
+    student, email, class_name, subject, correct, total, percentage, grade, started_at, completed_at, session_id = row
+    return [
+        student, email, class_name or "", subject, correct, total, round(percentage, 2), grade,
+        started_at.isoformat(sep=" ", timespec="seconds") if started_at else "",
+        completed_at.isoformat(sep=" ", timespec="seconds") if completed_at else "",
+        session_id,
+    ]
+
+
+def iter_csv(rows):
+    # Yields the CSV in chunks of BATCH_SIZE rows; the header goes out first so
+    # the download starts before the first query returns.
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    yield out.getvalue()
+    out.seek(0)
+    out.truncate()
+    count = 0
+    for row in rows:
+        writer.writerow(_cells(row))
+        count += 1
+        if count % BATCH_SIZE == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+def iter_xlsx(rows, chunk_size=64 * 1024):
+    # openpyxl's write-only workbook keeps memory flat, but a .xlsx is a zip
+    # whose index is written last, so it is built in a temp file and streamed
+    # once complete.
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Gradebook")
+    sheet.append(COLUMNS)
+    for row in rows:
+        sheet.append(_cells(row))
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, "rb") as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
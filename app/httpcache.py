@@ -0,0 +1,76 @@
+import hashlib
+from functools import wraps
+from pathlib import Path
+from flask import current_app, request, session
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from .cache import Cache
+
+# Rendered page fragments keyed by the data versions they were built from,
+# so a stale entry is never read, only aged out.
+fragment_cache = Cache("fragment", maxsize=512)
+
+
+def _release_digest(app):
+    # Templates and the asset manifest: a deploy that changes either
+    # changes every ETag.
+    digest = hashlib.sha1()
+    paths = sorted(Path(app.root_path, app.template_folder).rglob("*.html"))
+    paths.append(Path(app.static_folder, "dist", "manifest.json"))
+    for path in paths:
+        if path.is_file():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+# Conditional GETs for pages whose content is a function of a few stored
+# versions. A view declares a validator that returns (version parts,
+# last_modified) from a cheap query, or None when the page must not be
+# cached; the ETag is a hash of those parts, the viewer and the release
+# (templates and assets), and a matching If-None-Match (or If-Modified-Since)
+# gets a 304 without the view running.
+class HttpCache:
+    def __init__(self):
+        self.enabled = True
+        self.release = ""
+
+    def init_app(self, app):
+        self.enabled = app.config.get("HTTP_CACHE", self.enabled)
+        self.release = _release_digest(app)
+        fragment_cache.init_app(app)
+
+    def etag(self, parts):
+        viewer = current_user.get_id() if current_user.is_authenticated else None
+        return hashlib.sha1(repr((self.release, viewer, parts)).encode()).hexdigest()[:32]
+
+    def _headers(self, response, etag, last_modified):
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers["Cache-Control"] = ("private" if current_user.is_authenticated else "public") + ", no-cache"
+        response.vary.add("Cookie")
+        return response
+
+    def conditional(self, validator):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # A pending flash message belongs in the page body.
+                if not self.enabled or "_flashes" in session:
+                    return view(*args, **kwargs)
+                found = validator(**kwargs)
+                if found is None:
+                    return view(*args, **kwargs)
+                parts, last_modified = found
+                etag = self.etag(parts)
+                if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                    return self._headers(current_app.response_class(status=304), etag, last_modified)
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                return self._headers(response, etag, last_modified)
+            return wrapper
+        return decorator
+
+
+http_cache = HttpCache()
@@ -0,0 +1,232 @@
+import csv
+import json
+import re
+from collections import namedtuple
+from sqlalchemy import insert
+from .models import Question, Option
+from .papers import bump_version
+from .search import index_questions
+from .scoring import regrade
+from . import db
+
+FORMATS = ("csv", "json", "aiken")
+BATCH_SIZE = 500
+# Only the first errors are kept so a badly broken file cannot exhaust memory.
+MAX_REPORTED_ERRORS = 200
+
+ParsedQuestion = namedtuple("ParsedQuestion", ["line", "text", "time_limit_seconds", "options", "topic"])
+RowError = namedtuple("RowError", ["line", "message"])
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RowError(line, message))
+
+
+def detect_format(filename):
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if ext == "csv":
+        return "csv"
+    if ext in ("json", "jsonl"):
+        return "json"
+    return "aiken"
+
+
+def _letter_index(value):
+    value = str(value).strip().upper()
+    if len(value) == 1 and "A" <= value <= "Z":
+        return ord(value) - ord("A")
+    return None
+
+
+def _build(line, text, options, answer, time_limit, topic=None):
+    # Returns a ParsedQuestion, or a RowError describing why the row is invalid.
+    text = (text or "").strip()
+    if len(text) < 3:
+        return RowError(line, "Question text is missing or too short")
+    options = [(str(t).strip(), bool(c)) for t, c in options if str(t).strip()]
+    if answer is not None:
+        index = _letter_index(answer)
+        if index is None or index >= len(options):
+            return RowError(line, f"Answer {answer!r} does not match an option")
+        options = [(t, i == index) for i, (t, _) in enumerate(options)]
+    if len(options) < 2:
+        return RowError(line, "A question needs at least two options")
+    correct = sum(1 for _, c in options if c)
+    if correct != 1:
+        return RowError(line, f"Expected exactly one correct option, found {correct}")
+    if time_limit in (None, ""):
+        time_limit = None
+    else:
+        try:
+            time_limit = int(time_limit)
+        except (TypeError, ValueError):
+            return RowError(line, "time_limit_seconds must be a whole number")
+        if not 10 <= time_limit <= 900:
+            return RowError(line, "time_limit_seconds must be between 10 and 900")
+    return ParsedQuestion(line, text, time_limit, options, (str(topic).strip()[:64] or None) if topic else None)
+
+
+def iter_csv(stream):
+    # Header: question, A, B, C, ... (one column per option letter), answer, time_limit_seconds, topic
+    reader = csv.DictReader(stream)
+    fields = {(f or "").strip().lower(): f for f in reader.fieldnames or []}
+    letters = sorted(f for f in (reader.fieldnames or []) if _letter_index(f) is not None and len(f.strip()) == 1)
+    if "question" not in fields or "answer" not in fields:
+        yield RowError(1, "CSV header must include question and answer columns")
+        return
+    for row in reader:
+        answer = (row.get(fields["answer"]) or "").strip()
+        if not answer:
+            yield RowError(reader.line_num, "Answer is missing")
+            continue
+        options = [(row.get(letter) or "", False) for letter in letters]
+        yield _build(
+            reader.line_num,
+            row.get(fields["question"]),
+            options,
+            answer,
+            row.get(fields.get("time_limit_seconds", ""), None),
+            row.get(fields.get("topic", ""), None),
+        )
+
+
+def _iter_json_values(stream, chunk_size=64 * 1024, max_value_size=16 * 1024 * 1024):
+    # Decodes a top-level JSON array (or JSON Lines) one element at a time.
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if not started and pos < len(buf) and buf[pos] == "[":
+            started = True
+            pos += 1
+            continue
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos >= len(buf) and eof:
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof or len(buf) - pos > max_value_size:
+                raise
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        started = True
+        yield value
+        pos = end
+
+
+def iter_json(stream):
+    # [{"question": "...", "options": ["...", "..."], "answer": "B", "time_limit_seconds": 30, "topic": "..."}, ...]
+    # Options may also be {"text": "...", "is_correct": true} objects.
+    number = 0
+    try:
+        for item in _iter_json_values(stream):
+            number += 1
+            if not isinstance(item, dict):
+                yield RowError(number, "Each entry must be an object")
+                continue
+            options = []
+            for opt in item.get("options") or []:
+                if isinstance(opt, dict):
+                    options.append((opt.get("text", ""), opt.get("is_correct", False)))
+                else:
+                    options.append((opt, False))
+            yield _build(
+                number, item.get("question") or item.get("text"), options, item.get("answer"),
+                item.get("time_limit_seconds"), item.get("topic"),
+            )
+    except json.JSONDecodeError as exc:
+        yield RowError(number + 1, f"Invalid JSON, import stopped here: {exc.msg}")
+
+
+AIKEN_OPTION = re.compile(r"^([A-Z])[.)]\s+(.*)$")
+AIKEN_ANSWER = re.compile(r"^ANSWER:\s*([A-Z])\s*$", re.IGNORECASE)
+
+
+def iter_aiken(stream):
+    text_lines, options, start = [], [], None
+    for number, raw in enumerate(stream, start=1):
+        line = raw.strip()
+        if not line:
+            continue
+        if start is None:
+            start = number
+        answer = AIKEN_ANSWER.match(line)
+        option = AIKEN_OPTION.match(line)
+        if answer:
+            yield _build(start, " ".join(text_lines), options, answer.group(1), None)
+            text_lines, options, start = [], [], None
+        elif option and text_lines:
+            options.append((option.group(2), False))
+        elif options:
+            yield RowError(start, "Expected ANSWER: line after the options")
+            text_lines, options, start = [line], [], number
+        else:
+            text_lines.append(line)
+    if start is not None:
+        yield RowError(start, "Question is missing its ANSWER: line")
+
+
+PARSERS = {"csv": iter_csv, "json": iter_json, "aiken": iter_aiken}
+
+
+def _insert_batch(subject_id, batch):
+    questions = [
+        Question(subject_id=subject_id, text=p.text, time_limit_seconds=p.time_limit_seconds, topic=p.topic)
+        for p in batch
+    ]
+    db.session.add_all(questions)
+    db.session.flush()
+    db.session.execute(insert(Option), [
+        {"question_id": q.id, "text": text, "is_correct": is_correct}
+        for q, p in zip(questions, batch)
+        for text, is_correct in p.options
+    ])
+    index_questions([q.id for q in questions])
+    for q in questions:
+        db.session.expunge(q)
+
+
+def import_questions(subject, stream, fmt, batch_size=BATCH_SIZE):
+    # Streams a text file into `subject` in one transaction; invalid rows
+    # are reported and skipped rather than aborting the import.
+    report = ImportReport()
+    batch = []
+    try:
+        for item in PARSERS[fmt](stream):
+            if isinstance(item, RowError):
+                report.add_error(item.line, item.message)
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size:
+                _insert_batch(subject.id, batch)
+                report.imported += len(batch)
+                batch = []
+        if batch:
+            _insert_batch(subject.id, batch)
+            report.imported += len(batch)
+        if report.imported:
+            bump_version(subject)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if report.imported:
+        regrade(subject.id)
+    return report
@@ -1,36 +1,60 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
-from flask_login import login_required, current_user
-from .models import Subject
-from .forms import ProfileForm
-from . import db
-
-main_bp = Blueprint("main", __name__)
-
-
-@main_bp.route("/")
-def home():
-    subjects = Subject.query.order_by(Subject.created_at.desc()).limit(4).all()
-    return render_template("home.html", subjects=subjects)
-
-
-@main_bp.route("/dashboard")
-@login_required
-def dashboard():
-    return render_template("dashboard.html", user=current_user)
-
-
-@main_bp.route("/settings", methods=["GET", "POST"])
-@login_required
-def settings():
-    form = ProfileForm(class_name=current_user.class_name or "")
-    if form.validate_on_submit():
-        current_user.class_name = form.class_name.data or None
-        db.session.commit()
-        flash("Settings saved", "success")
-        return redirect(url_for("main.settings"))
-    return render_template("settings.html", form=form)
-
-
-@main_bp.route("/contact")
-def contact():
-    return render_template("contact.html")
+from flask import Blueprint, g, render_template, redirect, url_for, flash
+from flask_login import login_required, current_user
+from markupsafe import Markup
+from sqlalchemy.orm import joinedload
+from .models import Subject, User
+from .forms import ProfileForm
+from .httpcache import fragment_cache, http_cache
+from . import db
+
+main_bp = Blueprint("main", __name__)
+
+
+def _recent_subjects():
+    # (id, version, teacher name) of the newest subjects shown on the home
+    # page; the name is part of the key because the page shows it.
+    if "recent_subjects" not in g:
+        g.recent_subjects = tuple(
+            tuple(row) for row in db.session.query(Subject.id, Subject.version, User.full_name)
+            .outerjoin(User, User.id == Subject.teacher_id)
+            .order_by(Subject.created_at.desc())
+            .limit(4)
+        )
+    return g.recent_subjects
+
+
+@main_bp.route("/")
+@http_cache.conditional(lambda: (_recent_subjects(), None))
+def home():
+    recent = _recent_subjects()
+    subjects = fragment_cache.get_or_set(("home", recent), lambda: render_template(
+        "_recent_subjects.html",
+        subjects=Subject.query.options(joinedload(Subject.teacher))
+        .filter(Subject.id.in_([sid for sid, _, _ in recent]))
+        .order_by(Subject.created_at.desc())
+        .all(),
+    ))
+    return render_template("home.html", recent_subjects=Markup(subjects))
+
+
+@main_bp.route("/dashboard")
+@login_required
+def dashboard():
+    return render_template("dashboard.html", user=current_user)
+
+
+@main_bp.route("/settings", methods=["GET", "POST"])
+@login_required
+def settings():
+    form = ProfileForm(class_name=current_user.class_name or "")
+    if form.validate_on_submit():
+        current_user.class_name = form.class_name.data or None
+        db.session.commit()
+        flash("Settings saved", "success")
+        return redirect(url_for("main.settings"))
+    return render_template("settings.html", form=form)
+
+
+@main_bp.route("/contact")
+def contact():
+    return render_template("contact.html")
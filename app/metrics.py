@@ -0,0 +1,213 @@
+import hmac
+import ipaddress
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, abort, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from .cache import caches
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        # Callers hold the Metrics lock.
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, label_names):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            base = _labels(label_names, labels)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{base},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Per-process request instrumentation. Engine events count queries and DB
+# time into the request's g, template signals time rendering, and the totals
+# are folded into histograms labelled by endpoint when the request ends.
+# Each gunicorn worker keeps its own numbers; scrape every worker or run one.
+class Metrics:
+    LABELS = ("endpoint", "method")
+
+    def __init__(self):
+        self.enabled = False
+        self.query_budget = 0
+        self.token = None
+        self.networks = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.duration = Histogram("cbtpro_request_duration_seconds", "Request wall time.", DURATION_BUCKETS)
+        self.db_time = Histogram("cbtpro_request_db_seconds", "Time spent executing SQL per request.", DURATION_BUCKETS)
+        self.render_time = Histogram("cbtpro_request_render_seconds", "Time spent rendering templates per request.", DURATION_BUCKETS)
+        self.queries = Histogram("cbtpro_request_queries", "SQL statements executed per request.", QUERY_BUCKETS)
+        self.responses = {}
+        self.over_budget = {}
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        if not self.enabled:
+            return
+        self.query_budget = app.config.get("METRICS_QUERY_BUDGET", 0)
+        self.token = app.config.get("METRICS_TOKEN") or None
+        self.networks = [ipaddress.ip_network(n.strip(), strict=False) for n in app.config.get("METRICS_NETWORKS") or [] if n.strip()]
+        from . import db
+
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines:
+            self.watch(engine)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_after_render, app)
+        app.before_request(_start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule("/metrics", "metrics", self._view)
+
+    def watch(self, engine):
+        # Also called for each school's engine as tenancy creates it.
+        if not self.enabled:
+            return
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _on_error)
+
+    def _finish_request(self, response):
+        stats = g.pop("_metrics", None)
+        if stats is None or request.endpoint == "metrics":
+            return response
+        elapsed = time.perf_counter() - stats["started"]
+        labels = (request.endpoint or "unmatched", request.method)
+        with self._lock:
+            self.duration.observe(labels, elapsed)
+            self.db_time.observe(labels, stats["db_time"])
+            self.render_time.observe(labels, stats["render_time"])
+            self.queries.observe(labels, stats["queries"])
+            key = labels + (str(response.status_code),)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            over = self.query_budget and stats["queries"] > self.query_budget
+            if over:
+                self.over_budget[labels] = self.over_budget.get(labels, 0) + 1
+        if over:
+            current_app.logger.warning(
+                "%s %s ran %d queries (budget %d); likely N+1", request.method, request.path,
+                stats["queries"], self.query_budget,
+            )
+        response.headers["Server-Timing"] = (
+            f"db;dur={stats['db_time'] * 1000:.1f};desc=\"{stats['queries']} queries\", "
+            f"render;dur={stats['render_time'] * 1000:.1f}, total;dur={elapsed * 1000:.1f}"
+        )
+        return response
+
+    def _trusted(self):
+        try:
+            address = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks)
+
+    def _view(self):
+        # Scrapers need an address in METRICS_NETWORKS or the token; to
+        # everyone else, and with neither configured, there is no endpoint.
+        if not self._trusted():
+            if not self.token:
+                abort(404)
+            supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not hmac.compare_digest(supplied, self.token):
+                abort(403)
+        return Response("\n".join(self.render()) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for histogram in (self.duration, self.db_time, self.render_time, self.queries):
+                lines.extend(histogram.render(self.LABELS))
+            lines += ["# HELP cbtpro_responses_total Responses by status code.", "# TYPE cbtpro_responses_total counter"]
+            for key, count in sorted(self.responses.items()):
+                lines.append(f"cbtpro_responses_total{{{_labels(self.LABELS + ('status',), key)}}} {count}")
+            lines += [
+                "# HELP cbtpro_query_budget_exceeded_total Requests over METRICS_QUERY_BUDGET (likely N+1).",
+                "# TYPE cbtpro_query_budget_exceeded_total counter",
+            ]
+            for labels, count in sorted(self.over_budget.items()):
+                lines.append(f"cbtpro_query_budget_exceeded_total{{{_labels(self.LABELS, labels)}}} {count}")
+        lines += [
+            "# HELP cbtpro_cache_hits_total Cache lookups served from cache.",
+            "# TYPE cbtpro_cache_hits_total counter",
+        ]
+        cache_stats = [(cache.name, cache.stats()) for cache in caches]
+        lines += [f'cbtpro_cache_hits_total{{cache="{name}"}} {s["hits"]}' for name, s in cache_stats]
+        lines += ["# HELP cbtpro_cache_misses_total Cache lookups that missed.", "# TYPE cbtpro_cache_misses_total counter"]
+        lines += [f'cbtpro_cache_misses_total{{cache="{name}"}} {s["misses"]}' for name, s in cache_stats]
+        lines += ["# HELP cbtpro_cache_entries Entries held in the local cache tier.", "# TYPE cbtpro_cache_entries gauge"]
+        lines += [f'cbtpro_cache_entries{{cache="{name}"}} {s["size"]}' for name, s in cache_stats]
+        lines += [
+            "# HELP cbtpro_process_start_time_seconds When this worker started collecting.",
+            "# TYPE cbtpro_process_start_time_seconds gauge",
+            f"cbtpro_process_start_time_seconds {self.started:.0f}",
+        ]
+        return lines
+
+
+def _start_request():
+    g._metrics = {"started": time.perf_counter(), "queries": 0, "db_time": 0.0, "render_time": 0.0}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["_metrics_started"].pop()
+    if has_request_context():
+        stats = g.get("_metrics")
+        if stats is not None:
+            stats["queries"] += 1
+            stats["db_time"] += time.perf_counter() - started
+
+
+def _on_error(context):
+    if context.connection is not None:
+        started = context.connection.info.get("_metrics_started")
+        if started:
+            started.pop()
+
+
+def _before_render(sender, template, context, **extra):
+    stats = g.get("_metrics")
+    if stats is not None:
+        stats.setdefault("_render_started", []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stats = g.get("_metrics")
+    if stats is not None and stats.get("_render_started"):
+        stats["render_time"] += time.perf_counter() - stats["_render_started"].pop()
+
+
+metrics = Metrics()
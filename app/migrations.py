@@ -0,0 +1,189 @@
+import time
+from datetime import timedelta
+from sqlalchemy import Column, Integer, MetaData, Table, bindparam, inspect, select, func, text
+from sqlalchemy.exc import OperationalError
+from . import db
+
+# Single-row table recording the schema version the database is at.
+version_table = Table("schema_version", MetaData(), Column("version", Integer, nullable=False))
+
+MIGRATIONS = []
+# Postgres advisory lock held while migrating, so workers booting together
+# apply each migration once.
+LOCK_KEY = 0x63627470
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+@migration(1, "Create tables and add columns that used to be patched in at startup")
+def baseline(conn):
+    db.metadata.create_all(conn)
+    inspector = inspect(conn)
+    columns = {
+        "question": [("time_limit_seconds", "INTEGER")],
+        "user": [("class_name", "VARCHAR(64)")],
+        "subject": [("class_name", "VARCHAR(64)"), ("version", "INTEGER NOT NULL DEFAULT 1")],
+    }
+    for table, wanted in columns.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for name, ddl in wanted:
+            if name not in existing:
+                quoted = conn.dialect.identifier_preparer.quote(table)
+                conn.execute(text(f"ALTER TABLE {quoted} ADD COLUMN {name} {ddl}"))
+
+
+@migration(2, "Hot-path indexes and one response per (session, question)")
+def hot_path_indexes(conn):
+    from .models import Response, ExamSession, Question, Option, Subject
+
+    # Keep the most recent answer where the old per-question upsert raced.
+    latest = select(func.max(Response.id)).group_by(Response.session_id, Response.question_id)
+    conn.execute(Response.__table__.delete().where(Response.id.not_in(latest.scalar_subquery())))
+    names = {
+        "uq_response_session_question", "ix_exam_session_student_subject_completed",
+        "ix_question_subject", "ix_option_question_correct", "ix_subject_class_created",
+    }
+    for model in (Response, ExamSession, Question, Option, Subject):
+        for index in model.__table__.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+
+@migration(3, "Store each exam session's deadline for server-side expiry")
+def session_expiry(conn):
+    from .models import ExamSession, Subject
+
+    if "expires_at" not in {c["name"] for c in inspect(conn).get_columns("exam_session")}:
+        conn.execute(text("ALTER TABLE exam_session ADD COLUMN expires_at TIMESTAMP"))
+    rows = conn.execute(
+        select(ExamSession.id, ExamSession.started_at, Subject.duration_minutes)
+        .join(Subject, Subject.id == ExamSession.subject_id)
+        .where(ExamSession.expires_at.is_(None), ExamSession.started_at.isnot(None))
+    ).all()
+    table = ExamSession.__table__
+    stmt = table.update().where(table.c.id == bindparam("sid")).values(expires_at=bindparam("deadline"))
+    for start in range(0, len(rows), 500):
+        conn.execute(stmt, [
+            {"sid": sid, "deadline": started_at + timedelta(minutes=minutes)}
+            for sid, started_at, minutes in rows[start:start + 500]
+        ])
+    next(i for i in table.indexes if i.name == "ix_exam_session_open_expires").create(conn, checkfirst=True)
+
+
+@migration(4, "Full-text search index over subjects, questions and options")
+def search_index(conn):
+    from .search import create_index
+
+    # Filled by migration 5, once questions have topics.
+    create_index(conn)
+
+
+@migration(5, "Paper rules per subject, question topics and per-session sampled papers")
+def sampled_papers(conn):
+    from .models import Subject, Question, ExamSession
+    from .search import rebuild_index
+
+    for model, names in (
+        (Subject, ["questions_per_paper", "topic_quotas", "shuffle_options"]),
+        (Question, ["topic"]),
+        (ExamSession, ["paper_questions", "paper_seed"]),
+    ):
+        table = model.__table__
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        for name in names:
+            if name not in existing:
+                ddl = table.c[name].type.compile(dialect=conn.dialect)
+                if name == "shuffle_options":
+                    ddl += " NOT NULL DEFAULT FALSE"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {ddl}"))
+    next(i for i in Question.__table__.indexes if i.name == "ix_question_subject_topic").create(conn, checkfirst=True)
+    rebuild_index(conn)
+
+
+@migration(6, "Last applied offline answer delta per exam session")
+def offline_sync(conn):
+    if "sync_seq" not in {c["name"] for c in inspect(conn).get_columns("exam_session")}:
+        conn.execute(text("ALTER TABLE exam_session ADD COLUMN sync_seq INTEGER"))
+
+
+@migration(7, "Packed answers for archived exam sessions")
+def archived_answers(conn):
+    from .models import ExamSession
+
+    table = ExamSession.__table__
+    if "archived_answers" not in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        ddl = table.c.archived_answers.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE exam_session ADD COLUMN archived_answers {ddl}"))
+    next(i for i in table.indexes if i.name == "ix_exam_session_unarchived").create(conn, checkfirst=True)
+
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(version_table.c.version)).scalar() or 0
+
+
+def _lock(conn):
+    # Held until the upgrade's transaction ends; whoever waited re-reads the
+    # version and finds the migrations applied.
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+    elif conn.dialect.name == "sqlite":
+        # A migration can outlast busy_timeout; keep waiting for the writer.
+        while True:
+            try:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                return
+            except OperationalError as exc:
+                if "locked" not in str(exc):
+                    raise
+                time.sleep(0.5)
+
+
+def upgrade(engine, target=None):
+    # Applies pending migrations in one transaction; returns the versions
+    # applied. Concurrent upgrades of one database run one after another.
+    target = HEAD if target is None else target
+    applied = []
+    with engine.begin() as conn:
+        _lock(conn)
+        version_table.create(conn, checkfirst=True)
+        version = current_version(conn)
+        for number, _, fn in MIGRATIONS:
+            if version < number <= target:
+                fn(conn)
+                applied.append(number)
+        if applied:
+            conn.execute(version_table.delete())
+            conn.execute(version_table.insert().values(version=applied[-1]))
+    return applied
+
+
+def ensure_schema(app, engine=None, school=None):
+    # One cheap query when the database is already at HEAD.
+    engine = engine or db.engine
+    where = f" to school {school}" if school else ""
+    with engine.connect() as conn:
+        try:
+            version = conn.execute(select(version_table.c.version)).scalar() or 0
+        except Exception:
+            conn.rollback()
+            version = 0
+    if version >= HEAD:
+        return
+    if app.config.get("AUTO_MIGRATE", True):
+        applied = upgrade(engine)
+        if applied:
+            app.logger.info("Applied schema migrations %s%s", applied, where)
+    else:
+        command = f"flask tenants upgrade {school}" if school else "flask db-upgrade"
+        app.logger.warning("Database%s is at schema version %s but the code expects %s; run `%s`", where.replace(" to", " of"), version, HEAD, command)
@@ -1,104 +1,209 @@
-from datetime import datetime
-from enum import Enum
-from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from . import db, login_manager
-
-
-class UserRole(str, Enum):
-    TEACHER = "teacher"
-    STUDENT = "student"
-
-
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    full_name = db.Column(db.String(120), nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
-    role = db.Column(db.String(20), nullable=False, default=UserRole.STUDENT.value)
-    class_name = db.Column(db.String(64))  # e.g., JSS1, SS2, etc.
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    subjects = db.relationship("Subject", backref="teacher", lazy=True)
-
-    def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
-
-    def is_teacher(self) -> bool:
-        return self.role == UserRole.TEACHER.value
-
-    def is_student(self) -> bool:
-        return self.role == UserRole.STUDENT.value
-
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-
-class Subject(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
-    description = db.Column(db.Text)
-    duration_minutes = db.Column(db.Integer, nullable=False, default=30)
-    class_name = db.Column(db.String(64))  # Class this subject applies to
-    teacher_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    questions = db.relationship("Question", backref="subject", cascade="all,delete-orphan", lazy=True)
-
-
-class Question(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
-    text = db.Column(db.Text, nullable=False)
-    time_limit_seconds = db.Column(db.Integer, nullable=True)  # Optional per-question time limit
-
-    options = db.relationship("Option", backref="question", cascade="all,delete-orphan", lazy=True)
-
-
-class Option(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    question_id = db.Column(db.Integer, db.ForeignKey("question.id"), nullable=False)
-    text = db.Column(db.Text, nullable=False)
-    is_correct = db.Column(db.Boolean, default=False)
-
-
-class ExamSession(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
-    student_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    started_at = db.Column(db.DateTime, default=datetime.utcnow)
-    completed_at = db.Column(db.DateTime)
-
-    responses = db.relationship("Response", backref="session", cascade="all,delete-orphan", lazy=True)
-
-
-class Response(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.Integer, db.ForeignKey("exam_session.id"), nullable=False)
-    question_id = db.Column(db.Integer, db.ForeignKey("question.id"), nullable=False)
-    selected_option_id = db.Column(db.Integer, db.ForeignKey("option.id"), nullable=False)
-
-
-def nigeria_grade(score_percentage: float) -> str:
-    if score_percentage >= 75:
-        return "A1"
-    if score_percentage >= 70:
-        return "B2"
-    if score_percentage >= 65:
-        return "B3"
-    if score_percentage >= 60:
-        return "C4"
-    if score_percentage >= 55:
-        return "C5"
-    if score_percentage >= 50:
-        return "C6"
-    if score_percentage >= 45:
-        return "D7"
-    if score_percentage >= 40:
-        return "E8"
-    return "F9"
+from datetime import datetime
+from enum import Enum
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from werkzeug.security import generate_password_hash, check_password_hash
+from .cache import Cache
+from . import db, login_manager
+
+
+class UserRole(str, Enum):
+    TEACHER = "teacher"
+    STUDENT = "student"
+
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    full_name = db.Column(db.String(120), nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
+    role = db.Column(db.String(20), nullable=False, default=UserRole.STUDENT.value)
+    class_name = db.Column(db.String(64))  # e.g., JSS1, SS2, etc.
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    subjects = db.relationship("Subject", backref="teacher", lazy=True)
+
+    def set_password(self, password: str) -> None:
+        self.password_hash = generate_password_hash(password)
+
+    def check_password(self, password: str) -> bool:
+        return check_password_hash(self.password_hash, password)
+
+    def is_teacher(self) -> bool:
+        return self.role == UserRole.TEACHER.value
+
+    def is_student(self) -> bool:
+        return self.role == UserRole.STUDENT.value
+
+
+# Column values of logged-in users, so that loading current_user is not a
+# query on every request. Kept briefly per worker and, with CACHE_REDIS_URL,
+# under versioned keys in Redis; invalidated whenever a user row changes.
+# The password hash is never cached: it is loaded from the database on the
+# rare occasion it is read.
+user_cache = Cache("user", maxsize=4096, ttl=30, shared_ttl=600, versioned=True)
+UNCACHED_COLUMNS = {"password_hash"}
+
+
+def _user_data(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    return {
+        column.key: getattr(user, column.key)
+        for column in User.__table__.columns
+        if column.key not in UNCACHED_COLUMNS
+    }
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    data = user_cache.get_or_set(int(user_id), lambda: _user_data(int(user_id)))
+    if data is None:
+        return None
+    # Attach a detached copy to the session without a SELECT.
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    object_session(target).info.setdefault("changed_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_users(session):
+    for user_id in session.info.pop("changed_users", ()):
+        user_cache.delete(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_users(session):
+    session.info.pop("changed_users", None)
+
+
+class Subject(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    description = db.Column(db.Text)
+    duration_minutes = db.Column(db.Integer, nullable=False, default=30)
+    class_name = db.Column(db.String(64))  # Class this subject applies to
+    teacher_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every paper edit
+    # Paper rules: each session draws this many questions from the bank (all
+    # when unset), with at least the given count per topic, e.g. {"Algebra": 10}
+    questions_per_paper = db.Column(db.Integer)
+    topic_quotas = db.Column(db.JSON)
+    shuffle_options = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (db.Index("ix_subject_class_created", "class_name", "created_at"),)
+
+    questions = db.relationship("Question", backref="subject", cascade="all,delete-orphan", lazy=True)
+
+
+class Question(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    time_limit_seconds = db.Column(db.Integer, nullable=True)  # Optional per-question time limit
+    topic = db.Column(db.String(64))
+
+    __table_args__ = (
+        db.Index("ix_question_subject", "subject_id"),
+        db.Index("ix_question_subject_topic", "subject_id", "topic"),
+    )
+
+    options = db.relationship("Option", backref="question", cascade="all,delete-orphan", lazy=True)
+
+
+class Option(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey("question.id"), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    is_correct = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (db.Index("ix_option_question_correct", "question_id", "is_correct"),)
+
+
+class ExamSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    # started_at + the subject's duration; answers after this are not accepted.
+    expires_at = db.Column(db.DateTime)
+    # The questions drawn for this session, packed as little-endian uint32 ids
+    # in paper order (NULL: the whole bank), and the seed for option order.
+    paper_questions = db.Column(db.LargeBinary)
+    paper_seed = db.Column(db.Integer)
+    # Sequence number of the last offline answer delta applied, so that a
+    # retried or overtaken delta is not applied twice.
+    sync_seq = db.Column(db.Integer)
+    # Once a completed session is archived its answers move here from the
+    # response table: selected option ids as little-endian uint32, ordered
+    # by question id.
+    archived_answers = db.Column(db.LargeBinary)
+
+    __table_args__ = (
+        db.Index("ix_exam_session_student_subject_completed", "student_id", "subject_id", "completed_at"),
+        # Partial index over open sessions only, for the expiry sweeper.
+        db.Index(
+            "ix_exam_session_open_expires", "expires_at",
+            sqlite_where=db.text("completed_at IS NULL"), postgresql_where=db.text("completed_at IS NULL"),
+        ),
+        # Completed sessions still waiting to be archived.
+        db.Index(
+            "ix_exam_session_unarchived", "completed_at",
+            sqlite_where=db.text("archived_answers IS NULL AND completed_at IS NOT NULL"),
+            postgresql_where=db.text("archived_answers IS NULL AND completed_at IS NOT NULL"),
+        ),
+    )
+
+    responses = db.relationship("Response", backref="session", cascade="all,delete-orphan", lazy=True)
+    result = db.relationship("ExamResult", backref="session", cascade="all,delete-orphan", uselist=False, lazy=True)
+
+
+class Response(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey("exam_session.id"), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey("question.id"), nullable=False)
+    selected_option_id = db.Column(db.Integer, db.ForeignKey("option.id"), nullable=False)
+
+    __table_args__ = (db.Index("uq_response_session_question", "session_id", "question_id", unique=True),)
+
+
+class ExamResult(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey("exam_session.id"), nullable=False, unique=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False, index=True)
+    student_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    percentage = db.Column(db.Float, nullable=False, default=0)
+    grade = db.Column(db.String(4), nullable=False)  # nigeria_grade(percentage)
+    graded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def nigeria_grade(score_percentage: float) -> str:
+    if score_percentage >= 75:
+        return "A1"
+    if score_percentage >= 70:
+        return "B2"
+    if score_percentage >= 65:
+        return "B3"
+    if score_percentage >= 60:
+        return "C4"
+    if score_percentage >= 55:
+        return "C5"
+    if score_percentage >= 50:
+        return "C6"
+    if score_percentage >= 45:
+        return "D7"
+    if score_percentage >= 40:
+        return "E8"
+    return "F9"
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from .models import ExamSession, ExamResult, Response, Question, User
+from .autosave import answer_buffer
+from .events import format_sse
+from . import db
+
+CHUNK_SIZE = 500
+# Submitted sessions stay on the board for this long.
+RECENT = timedelta(hours=12)
+
+
+def _paper_size(subject):
+    bank = db.session.query(Question.id).filter_by(subject_id=subject.id).count()
+    drawn = max(subject.questions_per_paper or 0, sum((subject.topic_quotas or {}).values()))
+    return min(drawn, bank) if drawn else bank
+
+
+def monitor_snapshot(subject):
+    # The state the live view starts from; later changes arrive as events.
+    now = datetime.utcnow()
+    rows = (
+        db.session.query(ExamSession, User.full_name, ExamResult.percentage)
+        .join(User, User.id == ExamSession.student_id)
+        .outerjoin(ExamResult, ExamResult.session_id == ExamSession.id)
+        .filter(ExamSession.subject_id == subject.id)
+        .filter(ExamSession.completed_at.is_(None) | (ExamSession.completed_at >= now - RECENT))
+        .order_by(ExamSession.started_at)
+        .all()
+    )
+    open_ids = [sess.id for sess, _, _ in rows if sess.completed_at is None]
+    answered = {sid: set() for sid in open_ids}
+    for start in range(0, len(open_ids), CHUNK_SIZE):
+        chunk = open_ids[start:start + CHUNK_SIZE]
+        for sid, qid in db.session.query(Response.session_id, Response.question_id).filter(Response.session_id.in_(chunk)):
+            answered[sid].add(qid)
+    for sid in open_ids:
+        answered[sid].update(answer_buffer.peek(sid))
+    sessions = [
+        {
+            "session_id": sess.id,
+            "student": name,
+            "started_at": sess.started_at,
+            "expires_at": sess.expires_at,
+            "completed_at": sess.completed_at,
+            "percentage": percentage,
+            "auto": sess.completed_at is not None and sess.completed_at == sess.expires_at,
+            "questions": sorted(answered.get(sess.id, ())),
+        }
+        for sess, name, percentage in rows
+    ]
+    return {
+        "now": now,
+        "questions": _paper_size(subject),
+        "sessions": sessions,
+    }
+
+
+def event_stream(subscription, heartbeat=15):
+    # Generator for an SSE response. It holds no database connection; the
+    # heartbeat keeps proxies from closing the stream and carries the server
+    # clock for the countdowns. The view subscribes while the request (and
+    # so its school) is still active; the generator runs after it has ended.
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if event is None:
+                yield format_sse({"now": datetime.utcnow()}, "tick")
+            else:
+                yield format_sse(event)
+    finally:
+        subscription.close()
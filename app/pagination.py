@@ -0,0 +1,45 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import tuple_
+
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    # Returns None for a missing or malformed cursor, which means the first page.
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(values) != len(columns):
+            return None
+        return [
+            datetime.fromisoformat(v) if v is not None and col.type.python_type is datetime else v
+            for col, v in zip(columns, values)
+        ]
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+def keyset_page(query, columns, cursor=None, per_page=24, descending=False):
+    # Keyset ("seek") pagination: each page starts after the last row of the
+    # previous one through an index range, so page 500 costs the same as
+    # page 1. The last column must be unique (the primary key).
+    after = decode_cursor(cursor, columns)
+    if after is not None:
+        key = tuple_(*columns)
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+    if len(rows) <= per_page:
+        return Page(items, None)
+    last = items[-1]
+    return Page(items, encode_cursor([getattr(last, c.key) for c in columns]))
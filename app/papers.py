@@ -0,0 +1,172 @@
+import random
+import struct
+from collections import namedtuple
+from sqlalchemy import BigInteger, cast
+from .models import Question, Option
+from .cache import Cache
+from . import db
+
+Paper = namedtuple("Paper", ["subject_id", "version", "name", "duration_minutes", "questions"])
+PaperQuestion = namedtuple("PaperQuestion", ["id", "text", "time_limit_seconds", "options"])
+PaperOption = namedtuple("PaperOption", ["id", "text"])
+
+# Keyed by (subject_id, version); a bumped version simply misses and the old entry ages out.
+paper_cache = Cache("paper", maxsize=256)
+# Sampled papers, keyed by (session_id, version); only the drawn questions are loaded.
+session_paper_cache = Cache("session_paper", maxsize=4096)
+
+# Questions are drawn in SQL by a seeded pseudo-random key: an affine map
+# of the id modulo a prime, squared. Each seed orders the bank differently,
+# and papers overlap about as much as independent samples would.
+DRAW_MODULUS = 2147483647
+
+
+def _build_paper(subject):
+    options = {}
+    for oid, qid, text in (
+        db.session.query(Option.id, Option.question_id, Option.text)
+        .join(Question, Question.id == Option.question_id)
+        .filter(Question.subject_id == subject.id)
+        .order_by(Option.id)
+    ):
+        options.setdefault(qid, []).append(PaperOption(oid, text))
+    questions = tuple(
+        PaperQuestion(qid, text, time_limit, tuple(options.get(qid, ())))
+        for qid, text, time_limit in (
+            db.session.query(Question.id, Question.text, Question.time_limit_seconds)
+            .filter_by(subject_id=subject.id)
+            .order_by(Question.id)
+        )
+    )
+    return Paper(subject.id, subject.version, subject.name, subject.duration_minutes, questions)
+
+
+def get_paper(subject):
+    return paper_cache.get_or_set((subject.id, subject.version), lambda: _build_paper(subject))
+
+
+def pack_ids(ids):
+    return struct.pack(f"<{len(ids)}I", *ids)
+
+
+def unpack_ids(blob):
+    return list(struct.unpack(f"<{len(blob) // 4}I", blob))
+
+
+def draw_order(seed):
+    # Every intermediate stays below 2**63.
+    rng = random.Random(seed)
+    a, b, c = rng.randrange(1, DRAW_MODULUS), rng.randrange(DRAW_MODULUS), rng.randrange(DRAW_MODULUS)
+    x = (cast(Question.id, BigInteger) * a + b) % DRAW_MODULUS
+    return (x * x + c) % DRAW_MODULUS
+
+
+def _draw(subject_id, seed, count, topic=None, exclude=()):
+    # A seeded pseudo-random order computed by the database, so the bank
+    # never has to be loaded to pick a few questions from it.
+    query = db.session.query(Question.id).filter(Question.subject_id == subject_id)
+    if topic is not None:
+        query = query.filter(Question.topic == topic)
+    if exclude:
+        query = query.filter(Question.id.not_in(exclude))
+    return [qid for (qid,) in query.order_by(draw_order(seed)).limit(count)]
+
+
+def draw_paper(subject, seed=None):
+    # (paper_seed, paper_questions) for a new session under the subject's
+    # paper rules; (None, None) when every student sits the whole bank.
+    if not subject.questions_per_paper and not subject.topic_quotas and not subject.shuffle_options:
+        return None, None
+    seed = random.SystemRandom().randrange(2 ** 31) if seed is None else seed
+    if not subject.questions_per_paper and not subject.topic_quotas:
+        return seed, None
+    ids = []
+    for topic, count in sorted((subject.topic_quotas or {}).items()):
+        ids += _draw(subject.id, seed, count, topic=topic, exclude=ids)
+    if subject.questions_per_paper and len(ids) < subject.questions_per_paper:
+        ids += _draw(subject.id, seed, subject.questions_per_paper - len(ids), exclude=ids)
+    random.Random(seed).shuffle(ids)
+    return seed, pack_ids(ids)
+
+
+def _build_session_paper(subject, ids):
+    options = {}
+    for oid, qid, text in (
+        db.session.query(Option.id, Option.question_id, Option.text)
+        .filter(Option.question_id.in_(ids))
+        .order_by(Option.id)
+    ):
+        options.setdefault(qid, []).append(PaperOption(oid, text))
+    found = {
+        qid: PaperQuestion(qid, text, time_limit, tuple(options.get(qid, ())))
+        for qid, text, time_limit in (
+            db.session.query(Question.id, Question.text, Question.time_limit_seconds).filter(Question.id.in_(ids))
+        )
+    }
+    # Questions deleted from the bank since the draw are dropped.
+    questions = tuple(found[qid] for qid in ids if qid in found)
+    return Paper(subject.id, subject.version, subject.name, subject.duration_minutes, questions)
+
+
+def _shuffle_options(questions, seed):
+    shuffled = []
+    for q in questions:
+        options = list(q.options)
+        random.Random(seed * 1000003 + q.id).shuffle(options)
+        shuffled.append(q._replace(options=tuple(options)))
+    return tuple(shuffled)
+
+
+def session_paper(session, subject):
+    # The paper this session sees: its drawn questions (or the whole bank),
+    # with options in the session's own order when the subject shuffles them.
+    if session.paper_questions is None:
+        paper = get_paper(subject)
+    else:
+        paper = session_paper_cache.get_or_set(
+            (session.id, subject.version),
+            lambda: _build_session_paper(subject, unpack_ids(session.paper_questions)),
+        )
+    if subject.shuffle_options and session.paper_seed is not None:
+        paper = paper._replace(questions=_shuffle_options(paper.questions, session.paper_seed))
+    return paper
+
+
+def session_question_ids(session):
+    # None when the session sits the whole bank.
+    return None if session.paper_questions is None else unpack_ids(session.paper_questions)
+
+
+def parse_quotas(text):
+    # "Topic: count" per line -> {"Topic": count}; raises ValueError on bad lines.
+    quotas = {}
+    for number, line in enumerate((text or "").splitlines(), start=1):
+        if not line.strip():
+            continue
+        topic, sep, count = line.rpartition(":")
+        if not sep or not topic.strip() or not count.strip().isdigit() or int(count) < 1:
+            raise ValueError(f"Line {number}: expected \"Topic: count\"")
+        quotas[topic.strip()[:64]] = int(count)
+    return quotas or None
+
+
+def format_quotas(quotas):
+    return "\n".join(f"{topic}: {count}" for topic, count in sorted((quotas or {}).items()))
+
+
+def bump_version(subject):
+    subject.version = (subject.version or 0) + 1
+
+
+def valid_answers(paper, answers):
+    # Keeps only (question_id, option_id) pairs that belong to this paper.
+    allowed = {q.id: {o.id for o in q.options} for q in paper.questions}
+    valid = {}
+    for qid, oid in answers.items():
+        try:
+            qid, oid = int(qid), int(oid)
+        except (TypeError, ValueError):
+            continue
+        if oid in allowed.get(qid, ()):
+            valid[qid] = oid
+    return valid
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from flask import render_template
+from .models import User, UserRole
+from .scoring import report_cards
+
+# Bump when report_card_pdf.html changes so cached files are not reused.
+TEMPLATE_VERSION = 2
+# A .pending marker older than this is treated as an abandoned render.
+PENDING_TIMEOUT = 300
+
+
+def _render_pdf(html, path):
+    # Runs in a worker process. Writes atomically so readers never see half a file.
+    from xhtml2pdf import pisa
+
+    pdf = BytesIO()
+    status = pisa.CreatePDF(src=html, dest=pdf)
+    if status.err:
+        return False
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(pdf.getvalue())
+    os.replace(tmp, path)
+    return True
+
+
+def _position(position):
+    return [position.label, position.size] if position else None
+
+
+def card_digest(student, card):
+    rows, overall, overall_grade, overall_position = card
+    payload = {
+        "v": TEMPLATE_VERSION,
+        "student": [student.id, student.full_name, student.class_name],
+        "rows": [
+            [r["subject"].name, r["session"].id, r["total"], r["correct"], round(r["percentage"], 4), r["grade"],
+             r["session"].completed_at.isoformat() if r["session"].completed_at else None,
+             _position(r["position"])]
+            for r in rows
+        ],
+        "overall": [round(overall, 4), overall_grade, _position(overall_position)],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+# Renders report cards in a process pool, off the request path. Files are
+# content-addressed (<sha256 of the results>.pdf) under PDF_CACHE_DIR, so a
+# repeat download of unchanged results is a plain file read. A .pending
+# marker lets other gunicorn workers see that a render is in progress.
+class PdfRenderer:
+    def __init__(self):
+        self.cache_dir = None
+        self.workers = 2
+        self._pool = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.cache_dir = app.config.get("PDF_CACHE_DIR") or os.path.join(app.instance_path, "pdf_cache")
+        self.workers = app.config.get("PDF_WORKERS", self.workers)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, digest, ext="pdf"):
+        return os.path.join(self.cache_dir, f"{digest}.{ext}")
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def status(self, digest):
+        if os.path.exists(self.path_for(digest)):
+            return "ready"
+        with self._lock:
+            future = self._futures.get(digest)
+        if future is not None:
+            if not future.done():
+                return "pending"
+            with self._lock:
+                self._futures.pop(digest, None)
+            if future.exception() is not None or not future.result():
+                return "failed"
+        marker = self.path_for(digest, "pending")
+        try:
+            if time.time() - os.path.getmtime(marker) < PENDING_TIMEOUT:
+                return "pending"
+        except OSError:
+            pass
+        return "missing"
+
+    def submit(self, digest, html):
+        marker = self.path_for(digest, "pending")
+        with open(marker, "w"):
+            pass
+        future = self._get_pool().submit(_render_pdf, html, self.path_for(digest))
+        future.add_done_callback(lambda f: _remove(marker))
+        with self._lock:
+            self._futures[digest] = future
+        return future
+
+    def ensure(self, digest, render_html):
+        # render_html is only called on a cache miss.
+        state = self.status(digest)
+        if state == "missing":
+            self.submit(digest, render_html())
+            return "pending"
+        return state
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+pdf_renderer = PdfRenderer()
+
+
+def render_card_html(student, card):
+    rows, overall, overall_grade, overall_position = card
+    return render_template(
+        "student/report_card_pdf.html",
+        user=student,
+        rows=rows,
+        overall=overall,
+        overall_grade=overall_grade,
+        overall_position=overall_position,
+        generated_at=datetime.utcnow(),
+    )
+
+
+def request_report_card(student):
+    # Returns (state, digest); state is ready, pending or failed.
+    card = report_cards([student.id])[student.id]
+    digest = card_digest(student, card)
+    return pdf_renderer.ensure(digest, lambda: render_card_html(student, card)), digest
+
+
+def class_students(class_name):
+    return (
+        User.query
+        .filter_by(role=UserRole.STUDENT.value, class_name=class_name)
+        .order_by(User.full_name, User.id)
+        .all()
+    )
+
+
+def request_class_archive(class_name):
+    # Queues every missing PDF of the class in parallel; once all are ready
+    # they are zipped into an archive addressed by the member digests.
+    students = class_students(class_name)
+    cards = report_cards([s.id for s in students])
+    members = []
+    states = set()
+    for student in students:
+        card = cards[student.id]
+        digest = card_digest(student, card)
+        states.add(pdf_renderer.ensure(digest, lambda s=student, c=card: render_card_html(s, c)))
+        members.append((student, digest))
+    archive_digest = hashlib.sha256(
+        json.dumps([class_name] + [d for _, d in members]).encode()
+    ).hexdigest()
+    if "failed" in states:
+        return "failed", archive_digest
+    if "pending" in states:
+        return "pending", archive_digest
+    path = pdf_renderer.path_for(archive_digest, "zip")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as archive:
+            for student, digest in members:
+                name = f"{student.full_name} ({student.id}).pdf".replace("/", "-")
+                archive.write(pdf_renderer.path_for(digest), name)
+        os.replace(tmp, path)
+    return "ready", archive_digest
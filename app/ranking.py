@@ -0,0 +1,171 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+from .models import ExamSession, ExamResult, User
+from .storage import current_tenant
+from . import db
+
+CHUNK_SIZE = 500
+
+# rank uses standard competition ranking: two students tied for 3rd are both
+# "3rd=" and the next one is 5th.
+Position = namedtuple("Position", ["rank", "size", "tied", "label"])
+
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        suffix = "th"
+    else:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def _key(score):
+    # Rounded so that float noise in averages does not break ties.
+    return -round(score, 4)
+
+
+class Board:
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})
+        self._ordered = sorted(_key(s) for s in self.scores.values())
+
+    def set(self, student_id, score):
+        old = self.scores.get(student_id)
+        if old is not None:
+            del self._ordered[bisect_left(self._ordered, _key(old))]
+        self.scores[student_id] = score
+        insort(self._ordered, _key(score))
+
+    def position(self, student_id):
+        score = self.scores.get(student_id)
+        if score is None:
+            return None
+        lo = bisect_left(self._ordered, _key(score))
+        tied = bisect_right(self._ordered, _key(score)) - lo > 1
+        return Position(lo + 1, len(self._ordered), tied, ordinal(lo + 1) + ("=" if tied else ""))
+
+
+# Positions of every student of one class, per subject and overall (the mean
+# of the latest percentage in each subject, as on the report card).
+class ClassRanking:
+    def __init__(self, rows):
+        self.latest = {}
+        for student_id, subject_id, completed_at, percentage in rows:
+            self._keep(student_id, subject_id, completed_at, percentage)
+        by_subject = {}
+        for student_id, per_subject in self.latest.items():
+            for subject_id, (_, percentage) in per_subject.items():
+                by_subject.setdefault(subject_id, {})[student_id] = percentage
+        self.subjects = {subject_id: Board(scores) for subject_id, scores in by_subject.items()}
+        self.overall = Board({student_id: self._overall(student_id) for student_id in self.latest})
+
+    def _keep(self, student_id, subject_id, completed_at, percentage):
+        per_subject = self.latest.setdefault(student_id, {})
+        current = per_subject.get(subject_id)
+        if current is not None and current[0] > completed_at:
+            return False
+        per_subject[subject_id] = (completed_at, percentage)
+        return True
+
+    def _overall(self, student_id):
+        values = [percentage for _, percentage in self.latest[student_id].values()]
+        return sum(values) / len(values)
+
+    def update(self, student_id, subject_id, completed_at, percentage):
+        if self._keep(student_id, subject_id, completed_at, percentage):
+            self.subjects.setdefault(subject_id, Board()).set(student_id, percentage)
+            self.overall.set(student_id, self._overall(student_id))
+
+    def positions(self, student_id):
+        subjects = {}
+        for subject_id, board in self.subjects.items():
+            position = board.position(student_id)
+            if position is not None:
+                subjects[subject_id] = position
+        return subjects, self.overall.position(student_id)
+
+
+def _result_rows(class_names=None):
+    query = (
+        db.session.query(User.class_name, ExamSession.student_id, ExamSession.subject_id, ExamSession.completed_at, ExamResult.percentage)
+        .join(ExamResult, ExamResult.session_id == ExamSession.id)
+        .join(User, User.id == ExamSession.student_id)
+        .filter(ExamSession.completed_at.isnot(None), User.class_name.isnot(None))
+    )
+    if class_names is not None:
+        query = query.filter(User.class_name.in_(class_names))
+    grouped = {name: [] for name in class_names or []}
+    for class_name, *row in query:
+        grouped.setdefault(class_name, []).append(row)
+    return grouped
+
+
+# Per-process class rankings. A class is loaded in bulk from stored results the
+# first time it is asked for and again once RANKING_TTL seconds have passed;
+# in between, record_results() keeps loaded classes current incrementally.
+# Other workers see a submission once their copy of the class expires.
+# Each school's classes are indexed separately.
+class RankingIndex:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._schools = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get("RANKING_TTL", self.ttl)
+
+    def _index(self):
+        # (classes, student_class) of the current school; callers hold the lock.
+        return self._schools.setdefault(current_tenant(), ({}, {}))
+
+    def rebuild(self, class_names=None):
+        grouped = _result_rows(class_names)
+        built = time.monotonic()
+        with self._lock:
+            if class_names is None:
+                self._schools.pop(current_tenant(), None)
+            classes, student_class = self._index()
+            for class_name, rows in grouped.items():
+                classes[class_name] = (built, ClassRanking(rows))
+                student_class.update((row[0], class_name) for row in rows)
+        return len(grouped)
+
+    def _ranking(self, class_name):
+        with self._lock:
+            entry = self._index()[0].get(class_name)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.rebuild([class_name])
+            with self._lock:
+                entry = self._index()[0][class_name]
+        return entry[1]
+
+    def positions(self, student_id, class_name):
+        # ({subject_id: Position}, overall Position or None)
+        if not class_name:
+            return {}, None
+        ranking = self._ranking(class_name)
+        with self._lock:
+            return ranking.positions(student_id)
+
+    def record(self, entries):
+        # entries: (student_id, subject_id, completed_at, percentage) for freshly
+        # graded sessions. Only classes already in memory are touched.
+        with self._lock:
+            classes, student_class = self._index()
+            if not classes:
+                return
+            unknown = [e[0] for e in entries if e[0] not in student_class]
+        for start in range(0, len(unknown), CHUNK_SIZE):
+            rows = db.session.query(User.id, User.class_name).filter(User.id.in_(unknown[start:start + CHUNK_SIZE]))
+            with self._lock:
+                student_class.update(rows)
+        with self._lock:
+            for student_id, subject_id, completed_at, percentage in entries:
+                entry = classes.get(student_class.get(student_id))
+                if entry is not None:
+                    entry[1].update(student_id, subject_id, completed_at, percentage)
+
+
+rankings = RankingIndex()
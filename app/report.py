@@ -1,36 +1,55 @@
-from flask import Blueprint, render_template
-from flask_login import login_required, current_user
-from .models import ExamSession, Question, Option, Response, nigeria_grade
-
-report_bp = Blueprint("report", __name__)
-
-
-@report_bp.route("/session/<int:session_id>")
-@login_required
-def session_report(session_id):
-    session = ExamSession.query.get_or_404(session_id)
-    if session.student_id != current_user.id and not current_user.is_teacher():
-        return render_template("errors/403.html"), 403
-
-    questions = Question.query.filter_by(subject_id=session.subject_id).all()
-    total = len(questions)
-    correct = 0
-    details = []
-
-    for q in questions:
-        resp = Response.query.filter_by(session_id=session.id, question_id=q.id).first()
-        selected = Option.query.get(resp.selected_option_id) if resp else None
-        correct_option = Option.query.filter_by(question_id=q.id, is_correct=True).first()
-        is_correct = selected and selected.id == (correct_option.id if correct_option else None)
-        correct += 1 if is_correct else 0
-        details.append({
-            "question": q,
-            "selected": selected,
-            "correct_option": correct_option,
-            "is_correct": is_correct,
-        })
-
-    percentage = (correct / total * 100) if total else 0
-    grade = nigeria_grade(percentage)
-
-    return render_template("report/session.html", session=session, details=details, total=total, correct=correct, percentage=percentage, grade=grade)
+from flask import Blueprint, render_template
+from flask_login import login_required, current_user
+from markupsafe import Markup
+from .models import ExamSession, ExamResult, Subject, nigeria_grade
+from .scoring import session_details
+from .storage import read_replica
+from .httpcache import fragment_cache, http_cache
+from . import db
+
+report_bp = Blueprint("report", __name__)
+
+
+def _report_version(session_id):
+    # A completed session's report only changes when it is regraded or the
+    # subject's paper is edited; in-progress reports are not cached. Text
+    # edits bump the version without a regrade and no time records them, so
+    # there is no Last-Modified and only the ETag validates.
+    row = (
+        db.session.query(ExamSession.student_id, ExamSession.completed_at, Subject.version, ExamResult.graded_at)
+        .join(Subject, Subject.id == ExamSession.subject_id)
+        .outerjoin(ExamResult, ExamResult.session_id == ExamSession.id)
+        .filter(ExamSession.id == session_id)
+        .first()
+    )
+    if row is None or row.completed_at is None:
+        return None
+    if row.student_id != current_user.id and not current_user.is_teacher():
+        return None
+    return (session_id, row.version, row.graded_at), None
+
+
+@report_bp.route("/session/<int:session_id>")
+@login_required
+@read_replica
+@http_cache.conditional(_report_version)
+def session_report(session_id):
+    session = ExamSession.query.get_or_404(session_id)
+    if session.student_id != current_user.id and not current_user.is_teacher():
+        return render_template("errors/403.html"), 403
+
+    result = session.result if session.completed_at else None
+    if result is not None:
+        total, correct, percentage, grade = result.total, result.correct, result.percentage, result.grade
+        version = db.session.query(Subject.version).filter_by(id=session.subject_id).scalar()
+        details = fragment_cache.get_or_set(
+            ("report", session.id, version, result.graded_at),
+            lambda: render_template("report/_details.html", details=session_details(session)[0]),
+        )
+    else:
+        details, score = session_details(session)
+        total, correct, percentage = score.total, score.correct, score.percentage
+        grade = nigeria_grade(percentage)
+        details = render_template("report/_details.html", details=details)
+
+    return render_template("report/session.html", session=session, details=Markup(details), total=total, correct=correct, percentage=percentage, grade=grade)
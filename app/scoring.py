@@ -0,0 +1,257 @@
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import and_, desc, distinct, func
+from sqlalchemy.orm import selectinload
+from .models import Subject, Question, Option, ExamSession, Response, ExamResult, User, nigeria_grade
+from .ranking import rankings
+from .papers import session_question_ids, unpack_ids
+from .archive import session_answers
+from . import db
+
+Score = namedtuple("Score", ["correct", "total", "percentage"])
+
+# Keep IN (...) lists under SQLite's bound-parameter limit.
+CHUNK_SIZE = 500
+
+
+def percentage_of(correct, total):
+    return (correct / total * 100) if total else 0
+
+
+def _answer_key():
+    # The lowest-id correct option per question is the one `.first()` used to pick.
+    return (
+        db.select(Option.question_id, func.min(Option.id).label("option_id"))
+        .where(Option.is_correct.is_(True))
+        .group_by(Option.question_id)
+        .subquery()
+    )
+
+
+def _archived_correct(archived, answer_key):
+    # {session_id: question ids answered correctly} for archived sessions,
+    # whose answers are packed option ids: a hit on the key is a correct answer.
+    option_ids = list({oid for _, oids in archived.values() for oid in oids})
+    key_hits = {}
+    for start in range(0, len(option_ids), CHUNK_SIZE):
+        key_hits.update(
+            (oid, (qid, subject_id)) for oid, qid, subject_id in db.session.execute(
+                db.select(answer_key.c.option_id, answer_key.c.question_id, Question.subject_id)
+                .join(Question, Question.id == answer_key.c.question_id)
+                .where(answer_key.c.option_id.in_(option_ids[start:start + CHUNK_SIZE]))
+            )
+        )
+    return {
+        sid: {key_hits[oid][0] for oid in oids if oid in key_hits and key_hits[oid][1] == subject_id}
+        for sid, (subject_id, oids) in archived.items()
+    }
+
+
+def score_sessions(session_ids):
+    session_ids = list(dict.fromkeys(session_ids))
+    scores = {sid: Score(0, 0, 0) for sid in session_ids}
+    answer_key = _answer_key()
+    for start in range(0, len(session_ids), CHUNK_SIZE):
+        chunk = session_ids[start:start + CHUNK_SIZE]
+        drawn = {}
+        archived = {}
+        for sid, subject_id, paper, packed in db.session.query(
+            ExamSession.id, ExamSession.subject_id, ExamSession.paper_questions, ExamSession.archived_answers
+        ).filter(ExamSession.id.in_(chunk), (ExamSession.paper_questions.isnot(None)) | (ExamSession.archived_answers.isnot(None))):
+            if paper is not None:
+                drawn[sid] = set(unpack_ids(paper))
+            if packed is not None:
+                archived[sid] = (subject_id, unpack_ids(packed))
+        whole_bank = [sid for sid in chunk if sid not in drawn and sid not in archived]
+        if whole_bank:
+            stmt = (
+                db.select(
+                    ExamSession.id,
+                    func.count(distinct(Question.id)),
+                    func.count(distinct(answer_key.c.question_id)),
+                )
+                .join(Question, Question.subject_id == ExamSession.subject_id)
+                .outerjoin(Response, and_(Response.session_id == ExamSession.id, Response.question_id == Question.id))
+                .outerjoin(answer_key, and_(answer_key.c.question_id == Question.id, answer_key.c.option_id == Response.selected_option_id))
+                .where(ExamSession.id.in_(whole_bank))
+                .group_by(ExamSession.id)
+            )
+            for sid, total, correct in db.session.execute(stmt):
+                scores[sid] = Score(correct, total, percentage_of(correct, total))
+        correct = _archived_correct(archived, answer_key) if archived else {}
+        live_drawn = [sid for sid in drawn if sid not in archived]
+        if live_drawn:
+            correct.update((sid, set()) for sid in live_drawn)
+            for sid, qid in db.session.execute(
+                db.select(Response.session_id, Response.question_id)
+                .join(answer_key, and_(answer_key.c.question_id == Response.question_id, answer_key.c.option_id == Response.selected_option_id))
+                .where(Response.session_id.in_(live_drawn))
+            ):
+                correct[sid].add(qid)
+        if drawn:
+            # Sampled papers: only the drawn questions count, whatever else is in
+            # the bank, and not those deleted from it since the draw.
+            wanted = list(set().union(*drawn.values()))
+            existing = set()
+            for offset in range(0, len(wanted), CHUNK_SIZE):
+                existing.update(db.session.scalars(db.select(Question.id).where(Question.id.in_(wanted[offset:offset + CHUNK_SIZE]))))
+            for sid, ids in drawn.items():
+                total = len(ids & existing)
+                hits = len(correct[sid] & ids)
+                scores[sid] = Score(hits, total, percentage_of(hits, total))
+        archived_bank = [sid for sid in archived if sid not in drawn]
+        if archived_bank:
+            bank_size = dict(
+                db.session.query(Question.subject_id, func.count(Question.id))
+                .filter(Question.subject_id.in_({archived[sid][0] for sid in archived_bank}))
+                .group_by(Question.subject_id)
+            )
+            for sid in archived_bank:
+                total = bank_size.get(archived[sid][0], 0)
+                hits = len(correct[sid])
+                scores[sid] = Score(hits, total, percentage_of(hits, total))
+    return scores
+
+
+def score_session(session_id):
+    return score_sessions([session_id])[session_id]
+
+
+def session_details(session):
+    questions = Question.query.options(selectinload(Question.options))
+    drawn = session_question_ids(session)
+    if drawn is None:
+        questions = questions.filter_by(subject_id=session.subject_id).order_by(Question.id).all()
+    else:
+        found = {q.id: q for q in questions.filter(Question.id.in_(drawn))}
+        questions = [found[qid] for qid in drawn if qid in found]
+    selected_ids = session_answers([session.id])[session.id]
+
+    options = {o.id: o for q in questions for o in q.options}
+    missing = set(selected_ids.values()) - set(options)
+    if missing:
+        options.update({o.id: o for o in Option.query.filter(Option.id.in_(missing))})
+
+    details = []
+    correct = 0
+    for q in questions:
+        selected = options.get(selected_ids.get(q.id))
+        correct_option = min((o for o in q.options if o.is_correct), key=lambda o: o.id, default=None)
+        is_correct = bool(selected and correct_option and selected.id == correct_option.id)
+        correct += 1 if is_correct else 0
+        details.append({
+            "question": q,
+            "selected": selected,
+            "correct_option": correct_option,
+            "is_correct": is_correct,
+        })
+    total = len(questions)
+    return details, Score(correct, total, percentage_of(correct, total))
+
+
+def record_results(session_ids):
+    # Upserts ExamResult rows for the given sessions; the caller commits.
+    scores = score_sessions(session_ids)
+    sessions = {}
+    results = {}
+    ids = list(scores)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        sessions.update({s.id: s for s in ExamSession.query.filter(ExamSession.id.in_(chunk))})
+        results.update({r.session_id: r for r in ExamResult.query.filter(ExamResult.session_id.in_(chunk))})
+    now = datetime.utcnow()
+    for sid, score in scores.items():
+        sess = sessions.get(sid)
+        if sess is None:
+            continue
+        result = results.get(sid)
+        if result is None:
+            result = ExamResult(session_id=sid)
+            db.session.add(result)
+            results[sid] = result
+        result.subject_id = sess.subject_id
+        result.student_id = sess.student_id
+        result.correct = score.correct
+        result.total = score.total
+        result.percentage = score.percentage
+        result.grade = nigeria_grade(score.percentage)
+        result.graded_at = now
+    rankings.record([
+        (sess.student_id, sess.subject_id, sess.completed_at, results[sid].percentage)
+        for sid, sess in sessions.items()
+        if sid in results and sess.completed_at is not None
+    ])
+    return results
+
+
+def regrade(subject_id=None, batch_size=CHUNK_SIZE):
+    query = db.session.query(ExamSession.id).filter(ExamSession.completed_at.isnot(None)).order_by(ExamSession.id)
+    if subject_id is not None:
+        query = query.filter(ExamSession.subject_id == subject_id)
+    session_ids = [sid for (sid,) in query]
+    for start in range(0, len(session_ids), batch_size):
+        record_results(session_ids[start:start + batch_size])
+        db.session.commit()
+    return len(session_ids)
+
+
+def latest_completed_sessions(student_ids):
+    # {student_id: {subject_id: (session, result)}} for the latest completed
+    # session of each subject.
+    student_ids = list(dict.fromkeys(student_ids))
+    latest = {sid: {} for sid in student_ids}
+    for start in range(0, len(student_ids), CHUNK_SIZE):
+        rows = (
+            db.session.query(ExamSession, ExamResult)
+            .outerjoin(ExamResult, ExamResult.session_id == ExamSession.id)
+            .filter(ExamSession.student_id.in_(student_ids[start:start + CHUNK_SIZE]))
+            .filter(ExamSession.completed_at.isnot(None))
+            .order_by(desc(ExamSession.completed_at), desc(ExamSession.id))
+        )
+        for sess, result in rows:
+            latest[sess.student_id].setdefault(sess.subject_id, (sess, result))
+    missing = [sess.id for per_subject in latest.values() for sess, result in per_subject.values() if result is None]
+    if missing:
+        # Sessions completed before results were materialized are graded once, here.
+        results = record_results(missing)
+        db.session.commit()
+        for per_subject in latest.values():
+            for subject_id, (sess, result) in per_subject.items():
+                per_subject[subject_id] = (sess, result or results.get(sess.id))
+    return latest
+
+
+def report_cards(student_ids):
+    # {student_id: (rows, overall, overall_grade, overall_position)} with
+    # subjects loaded once; positions are within the student's class.
+    latest = latest_completed_sessions(student_ids)
+    subject_ids = {subject_id for per_subject in latest.values() for subject_id in per_subject}
+    subjects = Subject.query.filter(Subject.id.in_(subject_ids)).order_by(Subject.id).all() if subject_ids else []
+    ids = list(latest)
+    classes = {}
+    for start in range(0, len(ids), CHUNK_SIZE):
+        classes.update(db.session.query(User.id, User.class_name).filter(User.id.in_(ids[start:start + CHUNK_SIZE])))
+    cards = {}
+    for student_id, per_subject in latest.items():
+        positions, overall_position = rankings.positions(student_id, classes.get(student_id))
+        rows = []
+        for s in subjects:
+            if s.id not in per_subject:
+                continue
+            sess, result = per_subject[s.id]
+            rows.append({
+                "subject": s,
+                "session": sess,
+                "total": result.total,
+                "correct": result.correct,
+                "percentage": result.percentage,
+                "grade": result.grade,
+                "position": positions.get(s.id),
+            })
+        overall = sum(r["percentage"] for r in rows) / len(rows) if rows else 0
+        cards[student_id] = (rows, overall, nigeria_grade(overall), overall_position)
+    return cards
+
+
+def report_card_rows(student_id):
+    return report_cards([student_id])[student_id]
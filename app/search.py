@@ -0,0 +1,229 @@
+import re
+from collections import namedtuple
+from sqlalchemy import and_, bindparam, func, or_, select, text
+from .models import Subject, Question, Option
+from . import db
+
+CHUNK_SIZE = 500
+SEARCH_LIMIT = 50
+# Only the newest matches are ranked by relevance, so a word found in every
+# question costs about the same as a rare one.
+RANK_CANDIDATES = 1000
+
+Hit = namedtuple("Hit", ["kind", "ref_id", "subject_id"])
+
+# Two indexes: subjects (name and description) and questions (the question
+# text and its options' text). On SQLite they are FTS5 tables keyed by
+# rowid, with each question's subject as an indexed "s<id>" token so a
+# subject-scoped search is an index intersection; on Postgres, tables with
+# a stored tsvector and a GIN index. Teacher edits and imports refresh the
+# affected documents in the same transaction. Other databases (MySQL) get
+# no index and search with LIKE over the subject and question tables.
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_subject USING fts5("
+    "body, tokenize = 'porter unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_question USING fts5("
+    "body, scope, subject_id UNINDEXED, tokenize = 'porter unicode61 remove_diacritics 2')",
+]
+POSTGRES_DDL = [
+    "CREATE TABLE IF NOT EXISTS search_subject ("
+    "doc_id INTEGER PRIMARY KEY, body TEXT NOT NULL, "
+    "tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', body)) STORED)",
+    "CREATE INDEX IF NOT EXISTS ix_search_subject_tsv ON search_subject USING GIN (tsv)",
+    "CREATE TABLE IF NOT EXISTS search_question ("
+    "doc_id INTEGER PRIMARY KEY, subject_id INTEGER NOT NULL, body TEXT NOT NULL, "
+    "tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', body)) STORED)",
+    "CREATE INDEX IF NOT EXISTS ix_search_question_tsv ON search_question USING GIN (tsv)",
+    "CREATE INDEX IF NOT EXISTS ix_search_question_subject ON search_question (subject_id)",
+]
+
+
+def _dialect(conn):
+    bind = conn if hasattr(conn, "dialect") else conn.get_bind()
+    return bind.dialect.name
+
+
+INDEX_DDL = {"sqlite": SQLITE_DDL, "postgresql": POSTGRES_DDL}
+
+
+def _indexed(conn):
+    return _dialect(conn) in INDEX_DDL
+
+
+def _key(conn):
+    return "rowid" if _dialect(conn) == "sqlite" else "doc_id"
+
+
+def create_index(conn):
+    for statement in INDEX_DDL.get(_dialect(conn), ()):
+        conn.execute(text(statement))
+
+
+def _remove(conn, table, doc_ids):
+    if not _indexed(conn):
+        return
+    key = _key(conn)
+    for start in range(0, len(doc_ids), CHUNK_SIZE):
+        conn.execute(
+            text(f"DELETE FROM {table} WHERE {key} IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": doc_ids[start:start + CHUNK_SIZE]},
+        )
+
+
+def index_subjects(subject_ids, conn=None):
+    conn = conn or db.session
+    if not _indexed(conn):
+        return
+    key = _key(conn)
+    subject_ids = list(subject_ids)
+    for start in range(0, len(subject_ids), CHUNK_SIZE):
+        chunk = subject_ids[start:start + CHUNK_SIZE]
+        _remove(conn, "search_subject", chunk)
+        docs = [
+            {"doc_id": sid, "body": f"{name}\n{description or ''}"}
+            for sid, name, description in conn.execute(
+                select(Subject.id, Subject.name, Subject.description).where(Subject.id.in_(chunk))
+            )
+        ]
+        if docs:
+            conn.execute(text(f"INSERT INTO search_subject ({key}, body) VALUES (:doc_id, :body)"), docs)
+
+
+def index_questions(question_ids, conn=None):
+    conn = conn or db.session
+    if not _indexed(conn):
+        return
+    if _dialect(conn) == "sqlite":
+        insert = text("INSERT INTO search_question (rowid, body, scope, subject_id) VALUES (:doc_id, :body, :scope, :subject_id)")
+    else:
+        insert = text("INSERT INTO search_question (doc_id, body, subject_id) VALUES (:doc_id, :body, :subject_id)")
+    question_ids = list(question_ids)
+    for start in range(0, len(question_ids), CHUNK_SIZE):
+        chunk = question_ids[start:start + CHUNK_SIZE]
+        _remove(conn, "search_question", chunk)
+        options = {}
+        for qid, option_text in conn.execute(
+            select(Option.question_id, Option.text).where(Option.question_id.in_(chunk)).order_by(Option.id)
+        ):
+            options.setdefault(qid, []).append(option_text)
+        docs = [
+            {
+                "doc_id": qid, "subject_id": sid, "scope": f"s{sid}",
+                "body": "\n".join([question_text, topic or ""] + options.get(qid, [])),
+            }
+            for qid, sid, question_text, topic in conn.execute(
+                select(Question.id, Question.subject_id, Question.text, Question.topic).where(Question.id.in_(chunk))
+            )
+        ]
+        if docs:
+            conn.execute(insert, docs)
+
+
+def unindex_questions(question_ids, conn=None):
+    _remove(conn or db.session, "search_question", list(question_ids))
+
+
+def unindex_subject(subject_id, conn=None):
+    conn = conn or db.session
+    if not _indexed(conn):
+        return
+    _remove(conn, "search_subject", [subject_id])
+    _remove(conn, "search_question", list(conn.execute(select(Question.id).where(Question.subject_id == subject_id)).scalars()))
+
+
+def rebuild_index(conn=None):
+    # Re-creates every document; returns how many were written.
+    conn = conn or db.session
+    if not _indexed(conn):
+        return 0
+    conn.execute(text("DELETE FROM search_subject"))
+    conn.execute(text("DELETE FROM search_question"))
+    subject_ids = list(conn.execute(select(Subject.id)).scalars())
+    question_ids = list(conn.execute(select(Question.id)).scalars())
+    index_subjects(subject_ids, conn)
+    index_questions(question_ids, conn)
+    return len(subject_ids) + len(question_ids)
+
+
+def _fts_query(query):
+    # User input never reaches the FTS5 query parser: every word is quoted
+    # and all must match. Stemming covers plurals and verb forms; prefix
+    # queries are left out because they cannot walk the index newest-first.
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{w}"' for w in words)
+
+
+def search(query, kind=None, subject_ids=None, limit=SEARCH_LIMIT):
+    # Best matches first; with no kind, matching subjects come before questions.
+    # subject_ids (ids, or a query of Subject.id) restricts the scope.
+    if subject_ids is not None:
+        subject_ids = [sid if isinstance(sid, int) else sid[0] for sid in subject_ids]
+        if not subject_ids:
+            return []
+    if kind is None:
+        subjects = search(query, "subject", subject_ids, limit)
+        return subjects + search(query, "question", subject_ids, limit - len(subjects))
+    if not _indexed(db.session):
+        return _like_search(query, kind, subject_ids, limit)
+    table = f"search_{kind}"
+    params = {"candidates": RANK_CANDIDATES, "limit": limit}
+    if _dialect(db.session) == "sqlite":
+        terms = _fts_query(query)
+        if terms is None:
+            return []
+        if kind == "question" and subject_ids is not None:
+            terms = "{body}: (" + terms + ") AND scope: (" + " OR ".join(f"s{sid}" for sid in subject_ids) + ")"
+            subject_ids = None
+        conditions = [f"{table} MATCH :q"]
+        params["q"] = terms
+        key, score = "rowid", "rank"
+    else:
+        conditions = ["tsv @@ websearch_to_tsquery('english', :q)"]
+        params["q"] = query
+        key, score = "doc_id", "-ts_rank(tsv, websearch_to_tsquery('english', :q))"
+    subject_column = key if kind == "subject" else "subject_id"
+    if subject_ids is not None:
+        conditions.append(f"{subject_column} IN :subject_ids")
+        params["subject_ids"] = subject_ids
+    stmt = text(
+        f"SELECT doc_id, subject_id FROM ("
+        f"SELECT {key} AS doc_id, {subject_column} AS subject_id, {score} AS score FROM {table} "
+        f"WHERE {' AND '.join(conditions)} ORDER BY {key} DESC LIMIT :candidates"
+        f") AS candidates ORDER BY score LIMIT :limit"
+    )
+    if "subject_ids" in params:
+        stmt = stmt.bindparams(bindparam("subject_ids", expanding=True))
+    return [Hit(kind, doc_id, subject_id) for doc_id, subject_id in db.session.execute(stmt, params)]
+
+
+def _like_search(query, kind, subject_ids, limit):
+    # Without a full-text index: every word must appear somewhere in the
+    # document, newest first. Scans the tables, so only fit for small banks.
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return []
+
+    def contains(column, word):
+        return func.lower(column).like(f"%{word}%")
+
+    if kind == "subject":
+        stmt = select(Subject.id, Subject.id).where(and_(*[
+            or_(contains(Subject.name, w), contains(Subject.description, w)) for w in words
+        ]))
+        if subject_ids is not None:
+            stmt = stmt.where(Subject.id.in_(subject_ids))
+        stmt = stmt.order_by(Subject.id.desc())
+    else:
+        stmt = select(Question.id, Question.subject_id).where(and_(*[
+            or_(
+                contains(Question.text, w), contains(Question.topic, w),
+                Question.id.in_(select(Option.question_id).where(contains(Option.text, w))),
+            )
+            for w in words
+        ]))
+        if subject_ids is not None:
+            stmt = stmt.where(Question.subject_id.in_(subject_ids))
+        stmt = stmt.order_by(Question.id.desc())
+    return [Hit(kind, doc_id, subject_id) for doc_id, subject_id in db.session.execute(stmt.limit(limit))]
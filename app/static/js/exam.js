@@ -0,0 +1,142 @@
+document.addEventListener('DOMContentLoaded', function() {
+	// Use server-provided remaining seconds to avoid clock skew
+	let remaining = parseInt(document.getElementById('exam-form').getAttribute('data-remaining'), 10) || 0;
+	let subjectExpired = false;
+	function setAllDisabled(disabled) {
+		document.querySelectorAll('.answer-input').forEach(i => i.disabled = disabled);
+		document.getElementById('prev-btn').disabled = true;
+	}
+	function updateSubjectTimer() {
+		if (remaining <= 0) {
+			if (!subjectExpired) {
+				subjectExpired = true;
+				document.getElementById('timeup-banner').classList.remove('hidden');
+				setAllDisabled(true);
+				document.getElementById('next-btn').classList.add('hidden');
+				document.getElementById('submit-btn').classList.remove('hidden');
+			}
+			remaining = 0;
+		} else {
+			remaining -= 1;
+		}
+		const minutes = Math.floor(remaining / 60);
+		const seconds = remaining % 60;
+		document.getElementById('timer').textContent = `${String(minutes).padStart(2,'0')}:${String(seconds).padStart(2,'0')}`;
+	}
+	updateSubjectTimer();
+	setInterval(updateSubjectTimer, 1000);
+
+	// Per-question strict enforcement without auto-submit on last
+	const cards = Array.from(document.querySelectorAll('.question-card'));
+	const locked = new Set();
+	const remainingPerQ = {};
+	cards.forEach(card => {
+		const qid = card.getAttribute('data-qid');
+		const secs = parseInt(card.getAttribute('data-qtime'), 10) || 0;
+		if (secs > 0) remainingPerQ[qid] = secs;
+	});
+	let idx = 0;
+	let qInterval = null;
+
+	function showIndex(newIdx) {
+		if (newIdx < 0 || newIdx >= cards.length) return;
+		cards.forEach((c,i) => {
+			if (i === newIdx) c.classList.remove('hidden'); else c.classList.add('hidden');
+		});
+		document.getElementById('current-index').value = String(newIdx);
+		document.getElementById('pos').textContent = String(newIdx + 1);
+		document.getElementById('prev-btn').disabled = newIdx === 0;
+		const nextBtn = document.getElementById('next-btn');
+		const submitBtn = document.getElementById('submit-btn');
+		if (newIdx === cards.length - 1) {
+			nextBtn.classList.add('hidden');
+			submitBtn.classList.remove('hidden');
+		} else {
+			nextBtn.classList.remove('hidden');
+			submitBtn.classList.add('hidden');
+		}
+		startPerQuestionTimer(cards[newIdx]);
+	}
+
+	function disableInputs(card) {
+		card.querySelectorAll('input[type="radio"]').forEach(i => i.disabled = true);
+	}
+
+	function startPerQuestionTimer(card) {
+		if (qInterval) clearInterval(qInterval);
+		const qid = card.getAttribute('data-qid');
+		const timeElem = document.getElementById(`q-timer-${qid}`);
+		if (!timeElem) return; // no per-question timer
+		if (locked.has(qid)) {
+			disableInputs(card);
+			return;
+		}
+		if (!(qid in remainingPerQ)) return; // infinity
+		qInterval = setInterval(() => {
+			if (!(qid in remainingPerQ)) return;
+			remainingPerQ[qid] = Math.max(remainingPerQ[qid] - 1, 0);
+			const mins = Math.floor(remainingPerQ[qid] / 60);
+			const secs = remainingPerQ[qid] % 60;
+			timeElem.textContent = `${String(mins)}:${String(secs).padStart(2,'0')}`;
+			if (remainingPerQ[qid] <= 5) {
+				timeElem.parentElement.classList.add('bg-red-50','text-red-700','border-red-200');
+			}
+			if (remainingPerQ[qid] === 0) {
+				locked.add(qid);
+				disableInputs(card);
+				clearInterval(qInterval);
+				if (idx < cards.length - 1) {
+					goNext();
+				}
+			}
+		}, 1000);
+	}
+
+	function goNext() {
+		idx = Math.min(idx + 1, cards.length - 1);
+		showIndex(idx);
+	}
+	function goPrev() {
+		idx = Math.max(idx - 1, 0);
+		showIndex(idx);
+	}
+	document.getElementById('next-btn').addEventListener('click', goNext);
+	document.getElementById('prev-btn').addEventListener('click', goPrev);
+
+	// Autosave: queue each change and send small batches in the background
+	const autosaveUrl = document.getElementById('exam-form').getAttribute('data-autosave-url');
+	let pendingAnswers = {};
+	let saveTimer = null;
+	function sendAnswers() {
+		saveTimer = null;
+		const batch = pendingAnswers;
+		if (Object.keys(batch).length === 0) return;
+		pendingAnswers = {};
+		fetch(autosaveUrl, {
+			method: 'POST',
+			headers: {'Content-Type': 'application/json'},
+			body: JSON.stringify({answers: batch}),
+			keepalive: true,
+		}).then(res => {
+			if (!res.ok && res.status !== 409) throw new Error(res.statusText);
+		}).catch(() => {
+			// Keep newer selections, retry the rest later
+			pendingAnswers = Object.assign(batch, pendingAnswers);
+			scheduleSave(5000);
+		});
+	}
+	function scheduleSave(delay) {
+		if (!saveTimer) saveTimer = setTimeout(sendAnswers, delay);
+	}
+	document.querySelectorAll('.answer-input').forEach(input => {
+		input.addEventListener('change', () => {
+			const qid = input.name.replace('question_', '');
+			pendingAnswers[qid] = input.value;
+			scheduleSave(800);
+		});
+	});
+	window.addEventListener('pagehide', sendAnswers);
+
+	// init explicit
+	showIndex(0);
+});
@@ -0,0 +1,273 @@
+document.addEventListener('DOMContentLoaded', function() {
+	// The paper is downloaded once and kept, with the answers, in
+	// localStorage so a reload or a dropped connection loses nothing.
+	// Answers go up as small numbered deltas, one in flight at a time and
+	// resent unchanged until acknowledged, then as one final manifest.
+	const SYNC_INTERVAL = 30000;
+	const SYNC_BATCH = 10;
+	const MAX_BACKOFF = 120000;
+	const root = document.getElementById('offline-exam');
+	const urls = {bundle: root.dataset.bundleUrl, sync: root.dataset.syncUrl, submit: root.dataset.submitUrl};
+	const prefix = 'exam-' + root.dataset.session + '-';
+	function load(key) {
+		try { return JSON.parse(localStorage.getItem(prefix + key)); } catch (e) { return null; }
+	}
+	function store(key, value) {
+		try { localStorage.setItem(prefix + key, JSON.stringify(value)); } catch (e) { /* storage full or disabled */ }
+	}
+	function forget() {
+		['bundle', 'state'].forEach(key => { try { localStorage.removeItem(prefix + key); } catch (e) { /* ignore */ } });
+	}
+	function post(url, body) {
+		return fetch(url, {
+			method: 'POST',
+			headers: {'Content-Type': 'application/json', 'Accept': 'application/json'},
+			credentials: 'same-origin',
+			body: JSON.stringify(body),
+		});
+	}
+	function jittered(ms) {
+		return ms * (0.75 + Math.random() * 0.5);
+	}
+
+	let bundle = load('bundle');
+	let state = load('state');
+	let syncing = false;
+	let deltasClosed = false;
+	let backoff = SYNC_INTERVAL;
+	let syncTimer = null;
+	const status = document.getElementById('sync-status');
+
+	function persist() {
+		store('state', state);
+		updateStatus();
+	}
+	function updateStatus() {
+		if (!state) return;
+		if (state.submitting) {
+			status.textContent = navigator.onLine ? 'Submitting…' : 'Offline — your answers are kept on this device and will be submitted when the connection returns.';
+			return;
+		}
+		const waiting = Object.keys(state.pending).length + (state.inflight ? Object.keys(state.inflight.answers).length : 0);
+		if (!navigator.onLine) {
+			status.textContent = 'Offline — your answers are kept on this device.';
+		} else if (waiting) {
+			status.textContent = waiting + ' answer(s) waiting to sync.';
+		} else {
+			status.textContent = 'All answers synced.';
+		}
+	}
+
+	function scheduleSync(delay) {
+		if (syncTimer) clearTimeout(syncTimer);
+		syncTimer = setTimeout(sync, jittered(delay));
+	}
+	function sync() {
+		syncTimer = null;
+		if (syncing || deltasClosed || state.submitting) return;
+		if (!state.inflight) {
+			if (Object.keys(state.pending).length === 0) {
+				scheduleSync(SYNC_INTERVAL);
+				return;
+			}
+			state.seq += 1;
+			state.inflight = {seq: state.seq, answers: state.pending};
+			state.pending = {};
+			persist();
+		}
+		syncing = true;
+		post(urls.sync, {token: bundle.token, seq: state.inflight.seq, answers: state.inflight.answers})
+			.then(res => {
+				if (res.status >= 500) throw new Error(res.statusText);
+				// A 4xx (time up, already submitted) will not change on retry;
+				// the final manifest carries every answer anyway.
+				if (!res.ok) deltasClosed = true;
+				state.inflight = null;
+				backoff = SYNC_INTERVAL;
+				persist();
+			})
+			.catch(() => {
+				backoff = Math.min(backoff * 2, MAX_BACKOFF);
+				updateStatus();
+			})
+			.finally(() => {
+				syncing = false;
+				if (!deltasClosed) scheduleSync(backoff);
+			});
+	}
+
+	function submitManifest() {
+		if (!state.submitting) {
+			state.submitting = true;
+			persist();
+		}
+		if (syncTimer) clearTimeout(syncTimer);
+		document.querySelectorAll('.answer-input').forEach(i => i.disabled = true);
+		document.getElementById('submit-btn').disabled = true;
+		post(urls.submit, {token: bundle.token, seq: state.seq, answers: state.answers, count: Object.keys(state.answers).length})
+			.then(res => {
+				if (res.status >= 500 || res.status === 400) throw new Error(res.statusText);
+				return res.json();
+			})
+			.then(data => {
+				if (data.url) {
+					forget();
+					window.location.href = data.url;
+				} else {
+					status.textContent = data.error || 'This exam could not be submitted.';
+				}
+			})
+			.catch(() => {
+				backoff = Math.min(backoff * 2, MAX_BACKOFF);
+				updateStatus();
+				setTimeout(submitManifest, jittered(Math.min(backoff, 15000)));
+			});
+	}
+
+	function render() {
+		const wrapper = document.getElementById('questions-wrapper');
+		bundle.questions.forEach((q, index) => {
+			const [qid, text, seconds, options] = q;
+			const card = document.createElement('div');
+			card.className = 'bg-white border rounded p-4 question-card' + (index ? ' hidden' : '');
+			card.dataset.qid = qid;
+			const head = document.createElement('div');
+			head.className = 'flex items-start justify-between gap-3';
+			const title = document.createElement('div');
+			title.className = 'font-semibold';
+			title.textContent = 'Q' + (index + 1) + '. ' + text;
+			const badge = document.createElement('div');
+			badge.className = 'text-xs px-2 py-1 rounded-full border ' + (seconds ? 'bg-amber-50 text-amber-700' : 'bg-gray-50 text-gray-600');
+			badge.innerHTML = '<span>Time</span> <span class="ml-1 font-mono"></span>';
+			badge.lastChild.id = 'q-timer-' + qid;
+			badge.lastChild.textContent = seconds ? formatClock(state.qremaining[qid] ?? seconds) : '∞';
+			head.append(title, badge);
+			const list = document.createElement('div');
+			list.className = 'mt-3 space-y-2';
+			options.forEach(([oid, label]) => {
+				const row = document.createElement('label');
+				row.className = 'flex items-center gap-2';
+				const input = document.createElement('input');
+				input.type = 'radio';
+				input.name = 'question_' + qid;
+				input.value = oid;
+				input.className = 'h-4 w-4 answer-input';
+				input.checked = String(state.answers[qid]) === String(oid);
+				input.disabled = state.locked.includes(String(qid));
+				input.addEventListener('change', () => {
+					state.answers[qid] = oid;
+					state.pending[qid] = oid;
+					persist();
+					if (Object.keys(state.pending).length >= SYNC_BATCH) scheduleSync(0);
+				});
+				const span = document.createElement('span');
+				span.textContent = label;
+				row.append(input, span);
+				list.append(row);
+			});
+			card.append(head, list);
+			wrapper.append(card);
+		});
+		document.getElementById('count').textContent = String(bundle.questions.length);
+		if (!bundle.questions.length) wrapper.textContent = 'No questions defined for this subject yet.';
+	}
+
+	function formatClock(total) {
+		return String(Math.floor(total / 60)) + ':' + String(total % 60).padStart(2, '0');
+	}
+
+	function start() {
+		render();
+		const cards = Array.from(document.querySelectorAll('.question-card'));
+		const limits = {};
+		bundle.questions.forEach(q => { if (q[2]) limits[q[0]] = q[2]; });
+		let idx = 0;
+		let qInterval = null;
+
+		function updateSubjectTimer() {
+			const remaining = Math.max(0, Math.round((state.deadline - Date.now()) / 1000));
+			document.getElementById('timer').textContent = String(Math.floor(remaining / 60)).padStart(2, '0') + ':' + String(remaining % 60).padStart(2, '0');
+			if (remaining === 0 && !state.submitting) {
+				document.getElementById('timeup-banner').classList.remove('hidden');
+				submitManifest();
+			}
+		}
+		function disableInputs(card) {
+			card.querySelectorAll('input[type="radio"]').forEach(i => i.disabled = true);
+		}
+		function startPerQuestionTimer(card) {
+			if (qInterval) clearInterval(qInterval);
+			const qid = card.dataset.qid;
+			if (state.locked.includes(qid)) {
+				disableInputs(card);
+				return;
+			}
+			if (!(qid in limits)) return;
+			const timeElem = document.getElementById('q-timer-' + qid);
+			qInterval = setInterval(() => {
+				const left = Math.max((state.qremaining[qid] ?? limits[qid]) - 1, 0);
+				state.qremaining[qid] = left;
+				store('state', state);
+				timeElem.textContent = formatClock(left);
+				if (left <= 5) timeElem.parentElement.classList.add('bg-red-50', 'text-red-700', 'border-red-200');
+				if (left === 0) {
+					state.locked.push(qid);
+					persist();
+					disableInputs(card);
+					clearInterval(qInterval);
+					if (idx < cards.length - 1) showIndex(idx + 1);
+				}
+			}, 1000);
+		}
+		function showIndex(newIdx) {
+			if (newIdx < 0 || newIdx >= cards.length) return;
+			idx = newIdx;
+			cards.forEach((c, i) => c.classList.toggle('hidden', i !== newIdx));
+			document.getElementById('pos').textContent = String(newIdx + 1);
+			document.getElementById('prev-btn').disabled = newIdx === 0;
+			const last = newIdx === cards.length - 1;
+			document.getElementById('next-btn').classList.toggle('hidden', last);
+			document.getElementById('submit-btn').classList.toggle('hidden', !last);
+			startPerQuestionTimer(cards[newIdx]);
+		}
+		document.getElementById('next-btn').addEventListener('click', () => showIndex(idx + 1));
+		document.getElementById('prev-btn').addEventListener('click', () => showIndex(idx - 1));
+		document.getElementById('submit-btn').addEventListener('click', submitManifest);
+		window.addEventListener('online', () => { updateStatus(); if (!state.submitting) scheduleSync(0); });
+		window.addEventListener('offline', updateStatus);
+
+		if (cards.length) showIndex(0); else document.getElementById('submit-btn').classList.remove('hidden');
+		updateSubjectTimer();
+		setInterval(updateSubjectTimer, 1000);
+		updateStatus();
+		if (state.submitting) submitManifest(); else scheduleSync(SYNC_INTERVAL);
+	}
+
+	function fetchBundle(delay) {
+		fetch(urls.bundle, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+			.then(res => res.json().then(data => ({res, data})))
+			.then(({res, data}) => {
+				if (res.status === 409 && data.url) {
+					forget();
+					window.location.href = data.url;
+					return;
+				}
+				if (!res.ok) throw new Error(data.error || res.statusText);
+				bundle = data;
+				// The deadline is kept relative to this device's clock.
+				state = {
+					answers: data.answers, pending: {}, inflight: null, seq: data.seq,
+					deadline: Date.now() + data.remaining * 1000, locked: [], qremaining: {}, submitting: false,
+				};
+				store('bundle', bundle);
+				persist();
+				start();
+			})
+			.catch(() => {
+				status.textContent = 'Could not load the paper; retrying…';
+				setTimeout(() => fetchBundle(Math.min(delay * 2, 30000)), jittered(delay));
+			});
+	}
+
+	if (bundle && state && bundle.format === 1) start(); else fetchBundle(2000);
+});
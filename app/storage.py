@@ -0,0 +1,162 @@
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+
+READ_BIND = "read"
+
+
+def current_tenant():
+    # Slug of the school whose database this context uses; None for the primary.
+    return g.get("tenant") if has_app_context() else None
+
+
+def tenant_key(key):
+    # Namespaces per-process state (caches, buffers, channels) by school, so
+    # equal ids from two schools' databases never share an entry.
+    tenant = current_tenant()
+    return key if tenant is None else f"{tenant}:{key!r}"
+
+
+class RoutingSession(Session):
+    # Sends everything to the current school's engine when a tenant is
+    # active (see tenancy.py). Otherwise plain SELECTs go to the read-only
+    # engine inside views marked with @read_replica; flushes and every other
+    # statement use the primary.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get("_tenant_engine")
+            if engine is not None:
+                return engine
+        if (
+            bind is None
+            and not self._flushing
+            and isinstance(clause, Select)
+            and has_app_context()
+            and g.get("_read_replica")
+        ):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._read_replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g._read_replica = False
+    return wrapper
+
+
+def _is_sqlite(url):
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _is_memory(url):
+    database = make_url(url).database
+    return not database or database == ":memory:" or "mode=memory" in str(url)
+
+
+def engine_options(config, url, profile=None, base=None):
+    # Engine options for a database of the given (or detected) profile.
+    profile = profile or ("sqlite" if _is_sqlite(url) else "server")
+    options = dict(base or {})
+    if profile == "sqlite":
+        connect_args = dict(options.get("connect_args") or {})
+        connect_args.setdefault("timeout", config["SQLITE_BUSY_TIMEOUT_MS"] / 1000)
+        options["connect_args"] = connect_args
+    elif profile == "server":
+        options.setdefault("pool_size", config["DB_POOL_SIZE"])
+        options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+        options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+        options.setdefault("pool_recycle", config["DB_POOL_RECYCLE"])
+        options.setdefault("pool_pre_ping", True)
+    else:
+        raise ValueError(f"Unknown DB_PROFILE {profile!r}; use 'sqlite' or 'server'")
+    return options
+
+
+def configure(app):
+    # Fills in engine options for the selected profile; call before db.init_app.
+    config = app.config
+    url = config["SQLALCHEMY_DATABASE_URI"]
+    profile = config.get("DB_PROFILE") or ("sqlite" if _is_sqlite(url) else "server")
+    config["DB_PROFILE"] = profile
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(config, url, profile, config.get("SQLALCHEMY_ENGINE_OPTIONS"))
+
+    read_url = config.get("DATABASE_READ_URL")
+    if not read_url and config.get("REPORTS_READ_ONLY") and profile == "sqlite" and not _is_memory(url):
+        read_url = f"sqlite:///file:{make_url(url).database}?mode=ro&uri=true"
+    if read_url:
+        binds = dict(config.get("SQLALCHEMY_BINDS") or {})
+        binds[READ_BIND] = read_url
+        config["SQLALCHEMY_BINDS"] = binds
+
+
+def sqlite_pragmas(config, read_only=False, memory=False):
+    pragmas = {
+        "busy_timeout": int(config["SQLITE_BUSY_TIMEOUT_MS"]),
+        "synchronous": config["SQLITE_SYNCHRONOUS"],
+        "cache_size": -int(config["SQLITE_CACHE_SIZE_KB"]),
+        "temp_store": "MEMORY",
+    }
+    if not read_only and not memory:
+        # WAL lets report readers run while an exam submission is writing.
+        pragmas = {"journal_mode": "WAL", **pragmas}
+    return pragmas
+
+
+def install_pragmas(engine, config, read_only=False):
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(config, read_only=read_only, memory=_is_memory(engine.url))
+
+    def on_connect(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+def init_app(app):
+    # Registers per-connection pragmas on every SQLite engine.
+    from . import db
+
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        install_pragmas(engine, app.config, read_only=key == READ_BIND)
+    for line in report(app, engines):
+        app.logger.info(line)
+
+
+def report(app, engines):
+    lines = [f"Storage profile: {app.config['DB_PROFILE']}"]
+    for key, engine in engines.items():
+        name = key or "primary"
+        pool = engine.pool
+        details = [type(pool).__name__]
+        if hasattr(pool, "size"):
+            details.append(f"size={pool.size()}")
+        if getattr(pool, "_max_overflow", None) is not None:
+            details.append(f"max_overflow={pool._max_overflow}")
+        if getattr(pool, "_recycle", -1) > 0:
+            details.append(f"recycle={pool._recycle}s")
+        if getattr(pool, "_pre_ping", False):
+            details.append("pre_ping")
+        lines.append(f"  {name}: {engine.url.render_as_string(hide_password=True)} [{', '.join(details)}]")
+    return lines
+
+
+def effective_pragmas(engine):
+    names = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "temp_store")
+    with engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in names}
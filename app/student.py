@@ -1,145 +1,292 @@
-from datetime import datetime, timedelta
-from flask import Blueprint, render_template, redirect, url_for, flash, request, make_response
-from flask_login import login_required, current_user
-from .models import Subject, Question, Option, ExamSession, Response, nigeria_grade
-from . import db
-from sqlalchemy import desc
-from xhtml2pdf import pisa
-from io import BytesIO
-
-student_bp = Blueprint("student", __name__)
-
-
-@student_bp.route("/")
-@login_required
-def index():
-    if current_user.class_name:
-        subjects = Subject.query.filter((Subject.class_name == None) | (Subject.class_name == current_user.class_name)).order_by(Subject.created_at.desc()).all()  # noqa: E711
-    else:
-        subjects = Subject.query.order_by(Subject.created_at.desc()).all()
-    return render_template("student/index.html", subjects=subjects)
-
-
-@student_bp.route("/report-card")
-@login_required
-def report_card():
-    # Latest completed session per subject for current user
-    subjects = Subject.query.all()
-    rows = []
-    total_scores = []
-    for s in subjects:
-        sess = (
-            ExamSession.query
-            .filter_by(subject_id=s.id, student_id=current_user.id)
-            .filter(ExamSession.completed_at.isnot(None))
-            .order_by(desc(ExamSession.completed_at))
-            .first()
-        )
-        if not sess:
-            continue
-        questions = Question.query.filter_by(subject_id=s.id).all()
-        total = len(questions)
-        correct = 0
-        for q in questions:
-            resp = Response.query.filter_by(session_id=sess.id, question_id=q.id).first()
-            sel = Option.query.get(resp.selected_option_id) if resp else None
-            ans = Option.query.filter_by(question_id=q.id, is_correct=True).first()
-            if sel and ans and sel.id == ans.id:
-                correct += 1
-        percentage = (correct / total * 100) if total else 0
-        grade = nigeria_grade(percentage)
-        rows.append({
-            "subject": s,
-            "session": sess,
-            "total": total,
-            "correct": correct,
-            "percentage": percentage,
-            "grade": grade,
-        })
-        total_scores.append(percentage)
-    overall = sum(total_scores) / len(total_scores) if total_scores else 0
-    overall_grade = nigeria_grade(overall)
-    return render_template("student/report_card.html", rows=rows, overall=overall, overall_grade=overall_grade)
-
-
-@student_bp.route("/report-card.pdf")
-@login_required
-def report_card_pdf():
-    html = render_template("student/report_card_pdf.html", user=current_user)
-    pdf = BytesIO()
-    pisa_status = pisa.CreatePDF(src=html, dest=pdf)
-    if pisa_status.err:
-        flash("Failed to generate PDF", "error")
-        return redirect(url_for("student.report_card"))
-    response = make_response(pdf.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'attachment; filename=report_card.pdf'
-    return response
-
-
-@student_bp.route("/subjects/<int:subject_id>/start")
-@login_required
-def start_exam(subject_id):
-    subject = Subject.query.get_or_404(subject_id)
-    existing = ExamSession.query.filter_by(subject_id=subject.id, student_id=current_user.id, completed_at=None).order_by(ExamSession.started_at.desc()).first()
-    now = datetime.utcnow()
-    new_session_needed = True
-    if existing:
-        end_time = existing.started_at + timedelta(minutes=subject.duration_minutes)
-        if end_time > now:
-            session = existing
-            new_session_needed = False
-    if new_session_needed:
-        session = ExamSession(subject_id=subject.id, student_id=current_user.id, started_at=now)
-        db.session.add(session)
-        db.session.commit()
-    return redirect(url_for("student.take_exam", session_id=session.id))
-
-
-@student_bp.route("/sessions/<int:session_id>", methods=["GET", "POST"])
-@login_required
-def take_exam(session_id):
-    session = ExamSession.query.get_or_404(session_id)
-    if session.student_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("student.index"))
-    subject = Subject.query.get(session.subject_id)
-    questions = Question.query.filter_by(subject_id=subject.id).all()
-
-    if request.method == "POST":
-        for q in questions:
-            key = f"question_{q.id}"
-            selected_option_id = request.form.get(key)
-            if not selected_option_id:
-                continue
-            existing_resp = Response.query.filter_by(session_id=session.id, question_id=q.id).first()
-            if existing_resp:
-                existing_resp.selected_option_id = int(selected_option_id)
-            else:
-                db.session.add(Response(session_id=session.id, question_id=q.id, selected_option_id=int(selected_option_id)))
-        session.completed_at = datetime.utcnow()
-        db.session.commit()
-        flash("Exam submitted", "success")
-        return redirect(url_for("report.session_report", session_id=session.id))
-
-    # Compute remaining seconds server-side to avoid client clock skew
-    now = datetime.utcnow()
-    end_time = session.started_at + timedelta(minutes=subject.duration_minutes)
-    remaining_seconds = max(0, int((end_time - now).total_seconds()))
-
-    # If session expired but no answers yet, reset start time and recompute
-    if remaining_seconds == 0:
-        has_answers = db.session.query(Response.id).filter_by(session_id=session.id).first() is not None
-        if not has_answers:
-            session.started_at = now
-            db.session.commit()
-            end_time = session.started_at + timedelta(minutes=subject.duration_minutes)
-            remaining_seconds = max(0, int((end_time - datetime.utcnow()).total_seconds()))
-
-    return render_template(
-        "student/take_exam.html",
-        subject=subject,
-        questions=questions,
-        session=session,
-        end_remaining=remaining_seconds,
-    )
+import math
+from datetime import datetime, timedelta
+from flask import Blueprint, abort, current_app, render_template, redirect, url_for, flash, request, jsonify, send_file, make_response
+from flask_login import login_required, current_user
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
+from .models import Subject, ExamSession, Response
+from .scoring import report_card_rows, record_results
+from .papers import draw_paper, session_paper, valid_answers
+from .autosave import answer_buffer, save_answers
+from .pdf import pdf_renderer, request_report_card
+from .storage import read_replica
+from .sweeper import deadline_passed, finalize_sessions
+from .events import event_bus
+from .admission import admission
+from .search import search
+from .pagination import Page, keyset_page
+from .bundle import build_bundle, claim_seq, outside_window, valid_token
+from . import db
+
+student_bp = Blueprint("student", __name__)
+
+SUBJECTS_PER_PAGE = 24
+
+
+@student_bp.route("/")
+@login_required
+def index():
+    subjects = Subject.query
+    if current_user.class_name:
+        subjects = subjects.filter((Subject.class_name == None) | (Subject.class_name == current_user.class_name))  # noqa: E711
+    query = request.args.get("q", "").strip()
+    if query:
+        ids = [hit.ref_id for hit in search(query, kind="subject", subject_ids=subjects.with_entities(Subject.id))]
+        rank = {sid: n for n, sid in enumerate(ids)}
+        found = subjects.options(joinedload(Subject.teacher)).filter(Subject.id.in_(ids))
+        page = Page(sorted(found, key=lambda s: rank[s.id]), None)
+    else:
+        page = keyset_page(
+            subjects.options(joinedload(Subject.teacher)),
+            [Subject.created_at, Subject.id],
+            request.args.get("after"),
+            per_page=SUBJECTS_PER_PAGE,
+            descending=True,
+        )
+    return render_template("student/index.html", subjects=page.items, next_cursor=page.next_cursor, query=query)
+
+
+@student_bp.route("/report-card")
+@login_required
+@read_replica
+def report_card():
+    rows, overall, overall_grade, overall_position = report_card_rows(current_user.id)
+    return render_template(
+        "student/report_card.html",
+        rows=rows,
+        overall=overall,
+        overall_grade=overall_grade,
+        overall_position=overall_position,
+    )
+
+
+@student_bp.route("/report-card.pdf")
+@login_required
+def report_card_pdf():
+    state, digest = request_report_card(current_user)
+    if state == "failed":
+        flash("Failed to generate PDF", "error")
+        return redirect(url_for("student.report_card"))
+    if state == "pending":
+        return render_template("pdf_pending.html", back_url=url_for("student.report_card")), 202
+    return send_file(pdf_renderer.path_for(digest), mimetype="application/pdf", as_attachment=True, download_name="report_card.pdf")
+
+
+@student_bp.route("/subjects/<int:subject_id>/start")
+@login_required
+def start_exam(subject_id):
+    # Sessions opened by the teacher's exam window already exist, so most
+    # students only need this one indexed read.
+    now = datetime.utcnow()
+    session_id = (
+        db.session.query(ExamSession.id)
+        .filter_by(subject_id=subject_id, student_id=current_user.id, completed_at=None)
+        .filter(ExamSession.expires_at > now)
+        .order_by(ExamSession.started_at.desc())
+        .limit(1)
+        .scalar()
+    )
+    wants_json = request.accept_mimetypes.best == "application/json"
+    if session_id is None:
+        subject = Subject.query.get_or_404(subject_id)
+        admitted, position, retry_after = admission.admit(subject.id, current_user.id)
+        if not admitted:
+            retry_after = math.ceil(retry_after)
+            if wants_json:
+                response = jsonify(ready=False, position=position, retry_after=retry_after)
+            else:
+                response = make_response(render_template("student/waiting.html", subject=subject, position=position, retry_after=retry_after))
+            response.headers["Retry-After"] = str(retry_after)
+            response.headers["Cache-Control"] = "no-store"
+            return response
+        student_name = current_user.full_name
+        paper_seed, paper_questions = draw_paper(subject)
+        session = ExamSession(
+            subject_id=subject.id,
+            student_id=current_user.id,
+            started_at=now,
+            expires_at=now + timedelta(minutes=subject.duration_minutes),
+            paper_seed=paper_seed,
+            paper_questions=paper_questions,
+        )
+        db.session.add(session)
+        db.session.commit()
+        session_id = session.id
+        event_bus.publish(subject.id, {
+            "type": "started",
+            "session_id": session.id,
+            "student": student_name,
+            "started_at": session.started_at,
+            "expires_at": session.expires_at,
+        })
+    else:
+        admission.release(subject_id, current_user.id)
+    url = url_for("student.take_exam", session_id=session_id)
+    if wants_json:
+        return jsonify(ready=True, url=url)
+    return redirect(url)
+
+
+def _submit(session, answers):
+    # Saves the final answers, closes and grades the session. Returns the
+    # result, or None when another submit of the same session got there first.
+    answer_buffer.flush([session.id])
+    if answers:
+        save_answers({session.id: answers})
+    closed = db.session.execute(
+        update(ExamSession)
+        .where(ExamSession.id == session.id, ExamSession.completed_at.is_(None))
+        .values(completed_at=datetime.utcnow())
+        .execution_options(synchronize_session="fetch")
+    ).rowcount
+    if not closed:
+        db.session.rollback()
+        return None
+    result = record_results([session.id]).get(session.id)
+    db.session.commit()
+    event_bus.publish(session.subject_id, {
+        "type": "submitted",
+        "session_id": session.id,
+        "percentage": result.percentage if result else None,
+        "auto": False,
+    })
+    return result
+
+
+def _offline_session(session_id):
+    # The bundle, delta and manifest endpoints only exist with OFFLINE_EXAMS on.
+    if not current_app.config["OFFLINE_EXAMS"]:
+        abort(404)
+    session = ExamSession.query.get_or_404(session_id)
+    if session.student_id != current_user.id:
+        abort(403)
+    return session
+
+
+@student_bp.route("/sessions/<int:session_id>", methods=["GET", "POST"])
+@login_required
+def take_exam(session_id):
+    session = ExamSession.query.get_or_404(session_id)
+    if session.student_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("student.index"))
+    if session.completed_at is not None:
+        return redirect(url_for("report.session_report", session_id=session.id))
+    subject = Subject.query.get(session.subject_id)
+
+    if request.method == "POST":
+        if deadline_passed(session, grace=current_app.config["EXAM_SUBMIT_GRACE_SECONDS"]):
+            finalize_sessions([session.id])
+            flash("Time was up; only answers saved before the deadline were counted", "error")
+            return redirect(url_for("report.session_report", session_id=session.id))
+        # Autosaved answers are already stored; the form only fills any gaps.
+        _submit(session, valid_answers(session_paper(session, subject), {
+            key[len("question_"):]: value for key, value in request.form.items() if key.startswith("question_")
+        }))
+        flash("Exam submitted", "success")
+        return redirect(url_for("report.session_report", session_id=session.id))
+
+    now = datetime.utcnow()
+    if deadline_passed(session, now):
+        finalize_sessions([session.id])
+        flash("Time is up; your saved answers were submitted", "info")
+        return redirect(url_for("report.session_report", session_id=session.id))
+    if current_app.config["OFFLINE_EXAMS"] and request.args.get("mode") != "online":
+        # The page is a shell; the paper arrives once as a bundle.
+        return render_template("student/take_exam_offline.html", subject=subject, session=session)
+    questions = session_paper(session, subject).questions
+    # Compute remaining seconds server-side to avoid client clock skew
+    remaining_seconds = max(0, int((session.expires_at - now).total_seconds()))
+
+    saved = dict(db.session.query(Response.question_id, Response.selected_option_id).filter_by(session_id=session.id))
+    saved.update(answer_buffer.peek(session.id))
+
+    return render_template(
+        "student/take_exam.html",
+        subject=subject,
+        questions=questions,
+        session=session,
+        saved=saved,
+        end_remaining=remaining_seconds,
+    )
+
+
+@student_bp.route("/sessions/<int:session_id>/answers", methods=["POST"])
+@login_required
+def autosave(session_id):
+    session = ExamSession.query.get_or_404(session_id)
+    if session.student_id != current_user.id:
+        return jsonify(error="Not authorized"), 403
+    if session.completed_at is not None:
+        return jsonify(error="Session already submitted"), 409
+    if deadline_passed(session, grace=current_app.config["EXAM_SUBMIT_GRACE_SECONDS"]):
+        return jsonify(error="Time is up"), 409
+    subject = Subject.query.get(session.subject_id)
+    payload = request.get_json(silent=True) or {}
+    answers = valid_answers(session_paper(session, subject), payload.get("answers") or {})
+    if answers:
+        answer_buffer.add(session.id, answers)
+        event_bus.publish(subject.id, {"type": "answered", "session_id": session.id, "questions": list(answers)})
+    return jsonify(saved=len(answers))
+
+
+@student_bp.route("/sessions/<int:session_id>/bundle")
+@login_required
+def exam_bundle(session_id):
+    session = _offline_session(session_id)
+    if session.completed_at is not None:
+        return jsonify(error="Session already submitted", url=url_for("report.session_report", session_id=session.id)), 409
+    subject = Subject.query.get(session.subject_id)
+    answer_buffer.flush([session.id])
+    saved = dict(db.session.query(Response.question_id, Response.selected_option_id).filter_by(session_id=session.id))
+    response = current_app.response_class(build_bundle(session, session_paper(session, subject), saved), mimetype="application/json")
+    response.headers["Cache-Control"] = "private, no-store"
+    return response
+
+
+@student_bp.route("/sessions/<int:session_id>/sync", methods=["POST"])
+@login_required
+def sync_answers(session_id):
+    # One numbered delta of offline answers. Deltas are retried until
+    # acknowledged, so applying one is idempotent: only a seq newer than the
+    # last applied one changes anything.
+    session = _offline_session(session_id)
+    payload = request.get_json(silent=True) or {}
+    if not valid_token(session, payload.get("token")):
+        return jsonify(error="Invalid bundle token"), 403
+    error = outside_window(session, grace=current_app.config["EXAM_SUBMIT_GRACE_SECONDS"])
+    if error:
+        return jsonify(error=error), 409
+    seq = payload.get("seq")
+    if not isinstance(seq, int) or seq < 1:
+        return jsonify(error="Missing delta sequence number"), 400
+    subject = Subject.query.get(session.subject_id)
+    answers = valid_answers(session_paper(session, subject), payload.get("answers") or {})
+    applied = claim_seq(session.id, seq)
+    if applied and answers:
+        answer_buffer.add(session.id, answers)
+        event_bus.publish(subject.id, {"type": "answered", "session_id": session.id, "questions": list(answers)})
+    return jsonify(seq=seq, applied=applied, saved=len(answers) if applied else 0)
+
+
+@student_bp.route("/sessions/<int:session_id>/submit", methods=["POST"])
+@login_required
+def submit_manifest(session_id):
+    # The final manifest: every answer held on the device and their count.
+    # A repeated submit of a graded session just returns its report.
+    session = _offline_session(session_id)
+    payload = request.get_json(silent=True) or {}
+    if not valid_token(session, payload.get("token")):
+        return jsonify(error="Invalid bundle token"), 403
+    url = url_for("report.session_report", session_id=session.id)
+    if session.completed_at is not None:
+        return jsonify(submitted=True, url=url)
+    answers = payload.get("answers")
+    if not isinstance(answers, dict) or payload.get("count") != len(answers):
+        return jsonify(error="Incomplete manifest"), 400
+    if deadline_passed(session, grace=current_app.config["EXAM_SUBMIT_GRACE_SECONDS"]):
+        finalize_sessions([session.id])
+        return jsonify(submitted=True, late=True, url=url)
+    subject = Subject.query.get(session.subject_id)
+    _submit(session, valid_answers(session_paper(session, subject), answers))
+    return jsonify(submitted=True, url=url)
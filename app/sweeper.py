@@ -0,0 +1,100 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from .models import ExamSession
+from .scoring import record_results
+from .autosave import answer_buffer
+from .events import event_bus
+from .tenancy import tenancy
+from . import db
+
+BATCH_SIZE = 500
+
+
+def deadline_passed(session, now=None, grace=0):
+    return session.expires_at is not None and (now or datetime.utcnow()) > session.expires_at + timedelta(seconds=grace)
+
+
+def finalize_sessions(session_ids):
+    # Closes open sessions at their deadline and grades whatever answers were
+    # saved. Sessions already submitted are left alone. Commits per batch.
+    answer_buffer.flush(session_ids)
+    closed = 0
+    for start in range(0, len(session_ids), BATCH_SIZE):
+        chunk = session_ids[start:start + BATCH_SIZE]
+        result = db.session.execute(
+            update(ExamSession)
+            .where(ExamSession.id.in_(chunk), ExamSession.completed_at.is_(None))
+            .values(completed_at=ExamSession.expires_at)
+            .execution_options(synchronize_session="fetch")
+        )
+        results = record_results(chunk)
+        db.session.commit()
+        closed += result.rowcount
+        for sid, graded in results.items():
+            event_bus.publish(graded.subject_id, {
+                "type": "submitted", "session_id": sid, "percentage": graded.percentage, "auto": True,
+            })
+    return closed
+
+
+def sweep_expired(now=None, grace=0, batch_size=BATCH_SIZE):
+    # Sessions are only swept once the grace period (and any autosave still
+    # buffered by another worker) has had time to land.
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=grace)
+    closed = 0
+    while True:
+        ids = [
+            sid for (sid,) in db.session.query(ExamSession.id)
+            .filter(ExamSession.completed_at.is_(None), ExamSession.expires_at <= cutoff)
+            .order_by(ExamSession.expires_at)
+            .limit(batch_size)
+        ]
+        if not ids:
+            return closed
+        closed += finalize_sessions(ids)
+
+
+# Runs sweep_expired every SWEEPER_INTERVAL seconds in a daemon thread,
+# started by the first request each worker serves. Several workers sweeping
+# at once is harmless: only still-open sessions are updated. Every school's
+# database is swept in turn.
+class ExpirySweeper:
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.grace = 0
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.interval = app.config.get("SWEEPER_INTERVAL", self.interval)
+        self.grace = app.config.get("EXAM_SUBMIT_GRACE_SECONDS", 0) + app.config.get("AUTOSAVE_FLUSH_INTERVAL", 0)
+        self._app = app
+        if self.interval:
+            app.before_request(self._ensure_thread)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._app.app_context():
+                for school in tenancy.each():
+                    try:
+                        closed = sweep_expired(grace=self.grace)
+                        if closed:
+                            self._app.logger.info("Auto-submitted %d expired exam session(s)%s", closed, f" at {school}" if school else "")
+                    except Exception:
+                        db.session.rollback()
+                        self._app.logger.exception("Expiry sweep failed%s", f" at {school}" if school else "")
+
+
+expiry_sweeper = ExpirySweeper()
@@ -1,208 +1,472 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
-from flask_login import login_required, current_user
-from .forms import SubjectForm, QuestionForm, OptionForm, DeleteForm
-from .models import Subject, Question, Option
-from . import db
-
-teacher_bp = Blueprint("teacher", __name__)
-
-
-def teacher_required():
-    return current_user.is_authenticated and current_user.is_teacher()
-
-
-@teacher_bp.before_request
-def guard_teacher():
-    allowed = {"teacher.index"}
-    if request.endpoint and request.endpoint.split(":")[-1] in allowed:
-        return None
-    if not teacher_required():
-        flash("Teacher access required", "error")
-        return redirect(url_for("main.dashboard"))
-
-
-@teacher_bp.route("/")
-@login_required
-def index():
-    if not teacher_required():
-        flash("Teacher access required", "error")
-        return redirect(url_for("main.dashboard"))
-    subjects = Subject.query.filter_by(teacher_id=current_user.id).all()
-    delete_form = DeleteForm()
-    return render_template("teacher/index.html", subjects=subjects, delete_form=delete_form)
-
-
-@teacher_bp.route("/subjects/new", methods=["GET", "POST"])
-@login_required
-def create_subject():
-    if not teacher_required():
-        flash("Teacher access required", "error")
-        return redirect(url_for("teacher.index"))
-    form = SubjectForm()
-    if form.validate_on_submit():
-        subject = Subject(
-            name=form.name.data.strip(),
-            description=form.description.data,
-            duration_minutes=form.duration_minutes.data,
-            class_name=form.class_name.data.strip() if form.class_name.data else None,
-            teacher_id=current_user.id,
-        )
-        db.session.add(subject)
-        db.session.commit()
-        flash("Subject created", "success")
-        return redirect(url_for("teacher.index"))
-    return render_template("teacher/subject_form.html", form=form)
-
-
-@teacher_bp.route("/subjects/<int:subject_id>/edit", methods=["GET", "POST"])
-@login_required
-def edit_subject(subject_id):
-    subject = Subject.query.get_or_404(subject_id)
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = SubjectForm(obj=subject)
-    if form.validate_on_submit():
-        subject.name = form.name.data.strip()
-        subject.description = form.description.data
-        subject.duration_minutes = form.duration_minutes.data
-        subject.class_name = form.class_name.data.strip() if form.class_name.data else None
-        db.session.commit()
-        flash("Subject updated", "success")
-        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
-    return render_template("teacher/subject_form.html", form=form)
-
-
-@teacher_bp.route("/subjects/<int:subject_id>/delete", methods=["POST"])
-@login_required
-def delete_subject(subject_id):
-    subject = Subject.query.get_or_404(subject_id)
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = DeleteForm()
-    if form.validate_on_submit():
-        db.session.delete(subject)
-        db.session.commit()
-        flash("Subject deleted", "info")
-    return redirect(url_for("teacher.index"))
-
-
-@teacher_bp.route("/subjects/<int:subject_id>")
-@login_required
-def subject_detail(subject_id):
-    subject = Subject.query.get_or_404(subject_id)
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    delete_form = DeleteForm()
-    return render_template("teacher/subject_detail.html", subject=subject, delete_form=delete_form)
-
-
-@teacher_bp.route("/subjects/<int:subject_id>/questions/new", methods=["GET", "POST"])
-@login_required
-def add_question(subject_id):
-    subject = Subject.query.get_or_404(subject_id)
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = QuestionForm()
-    if form.validate_on_submit():
-        q = Question(subject_id=subject.id, text=form.text.data, time_limit_seconds=form.time_limit_seconds.data)
-        db.session.add(q)
-        db.session.commit()
-        flash("Question added", "success")
-        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
-    return render_template("teacher/question_form.html", form=form, subject=subject)
-
-
-@teacher_bp.route("/questions/<int:question_id>/edit", methods=["GET", "POST"])
-@login_required
-def edit_question(question_id):
-    question = Question.query.get_or_404(question_id)
-    subject = question.subject
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = QuestionForm(obj=question)
-    if form.validate_on_submit():
-        question.text = form.text.data
-        question.time_limit_seconds = form.time_limit_seconds.data
-        db.session.commit()
-        flash("Question updated", "success")
-        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
-    return render_template("teacher/question_form.html", form=form, subject=subject)
-
-
-@teacher_bp.route("/questions/<int:question_id>/delete", methods=["POST"])
-@login_required
-def delete_question(question_id):
-    question = Question.query.get_or_404(question_id)
-    subject = question.subject
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = DeleteForm()
-    if form.validate_on_submit():
-        db.session.delete(question)
-        db.session.commit()
-        flash("Question deleted", "info")
-    return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
-
-
-@teacher_bp.route("/questions/<int:question_id>/options/new", methods=["GET", "POST"])
-@login_required
-def add_option(question_id):
-    question = Question.query.get_or_404(question_id)
-    subject = question.subject
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = OptionForm()
-    if form.validate_on_submit():
-        option = Option(question_id=question.id, text=form.text.data, is_correct=form.is_correct.data)
-        if form.is_correct.data:
-            Option.query.filter_by(question_id=question.id, is_correct=True).update({"is_correct": False})
-        db.session.add(option)
-        db.session.commit()
-        flash("Option added", "success")
-        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
-    return render_template("teacher/option_form.html", form=form, question=question)
-
-
-@teacher_bp.route("/options/<int:option_id>/edit", methods=["GET", "POST"])
-@login_required
-def edit_option(option_id):
-    option = Option.query.get_or_404(option_id)
-    question = option.question
-    subject = question.subject
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = OptionForm(obj=option)
-    if form.validate_on_submit():
-        option.text = form.text.data
-        if form.is_correct.data:
-            Option.query.filter_by(question_id=question.id, is_correct=True).update({"is_correct": False})
-        option.is_correct = form.is_correct.data
-        db.session.commit()
-        flash("Option updated", "success")
-        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
-    return render_template("teacher/option_form.html", form=form, question=question)
-
-
-@teacher_bp.route("/options/<int:option_id>/delete", methods=["POST"])
-@login_required
-def delete_option(option_id):
-    option = Option.query.get_or_404(option_id)
-    question = option.question
-    subject = question.subject
-    if subject.teacher_id != current_user.id:
-        flash("Not authorized", "error")
-        return redirect(url_for("teacher.index"))
-    form = DeleteForm()
-    if form.validate_on_submit():
-        db.session.delete(option)
-        db.session.commit()
-        flash("Option deleted", "info")
-    return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+import io
+from datetime import datetime
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, flash, request, make_response, send_file, jsonify, stream_with_context
+from flask_login import login_required, current_user
+from .forms import SubjectForm, QuestionForm, OptionForm, DeleteForm, QuestionImportForm, RosterUploadForm, GradebookExportForm, ExamWindowForm
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from .models import Subject, Question, Option
+from .scoring import regrade
+from .papers import bump_version, paper_cache, parse_quotas, format_quotas
+from .importer import import_questions, detect_format
+from .enrollment import enroll_students, credentials_csv
+from .pdf import pdf_renderer, request_class_archive
+from .analytics import item_analysis, as_dict
+from .gradebook import gradebook_rows, iter_csv, iter_xlsx, xlsx_available
+from .monitor import monitor_snapshot, event_stream
+from .events import dumps, event_bus
+from .admission import open_exam_window
+from .search import search, index_subjects, index_questions, unindex_questions, unindex_subject
+from .pagination import Page, keyset_page
+from .forms import CLASS_CHOICES
+from . import db
+
+teacher_bp = Blueprint("teacher", __name__)
+
+SUBJECTS_PER_PAGE = 24
+QUESTIONS_PER_PAGE = 25
+
+
+def teacher_required():
+    return current_user.is_authenticated and current_user.is_teacher()
+
+
+@teacher_bp.before_request
+def guard_teacher():
+    allowed = {"teacher.index"}
+    if request.endpoint and request.endpoint.split(":")[-1] in allowed:
+        return None
+    if not teacher_required():
+        flash("Teacher access required", "error")
+        return redirect(url_for("main.dashboard"))
+
+
+@teacher_bp.route("/")
+@login_required
+def index():
+    if not teacher_required():
+        flash("Teacher access required", "error")
+        return redirect(url_for("main.dashboard"))
+    delete_form = DeleteForm()
+    query = request.args.get("q", "").strip()
+    if query:
+        own = db.session.query(Subject.id).filter_by(teacher_id=current_user.id)
+        hits = search(query, subject_ids=own)
+        subjects = {s.id: s for s in Subject.query.filter(Subject.id.in_({h.subject_id for h in hits}))}
+        questions = {q.id: q for q in Question.query.filter(Question.id.in_([h.ref_id for h in hits if h.kind == "question"]))}
+        results = [
+            (hit, subjects.get(hit.subject_id), questions.get(hit.ref_id) if hit.kind == "question" else None)
+            for hit in hits
+        ]
+        return render_template("teacher/search.html", query=query, results=results)
+    page = keyset_page(
+        Subject.query.filter_by(teacher_id=current_user.id),
+        [Subject.created_at, Subject.id],
+        request.args.get("after"),
+        per_page=SUBJECTS_PER_PAGE,
+        descending=True,
+    )
+    counts = dict(
+        db.session.query(Question.subject_id, func.count(Question.id))
+        .filter(Question.subject_id.in_([s.id for s in page.items]))
+        .group_by(Question.subject_id)
+    )
+    return render_template(
+        "teacher/index.html",
+        subjects=page.items,
+        next_cursor=page.next_cursor,
+        question_counts=counts,
+        delete_form=delete_form,
+        class_choices=CLASS_CHOICES,
+    )
+
+
+@teacher_bp.route("/report-cards.zip")
+@login_required
+def class_report_cards():
+    class_name = request.args.get("class_name", "").strip()
+    if not class_name:
+        flash("Choose a class", "error")
+        return redirect(url_for("teacher.index"))
+    state, digest = request_class_archive(class_name)
+    if state == "failed":
+        flash("Failed to generate some report cards", "error")
+        return redirect(url_for("teacher.index"))
+    if state == "pending":
+        return render_template("pdf_pending.html", message=f"Report cards for {class_name} are being generated.", back_url=url_for("teacher.index")), 202
+    filename = f"report_cards_{class_name.replace(' ', '_')}.zip"
+    return send_file(pdf_renderer.path_for(digest, "zip"), mimetype="application/zip", as_attachment=True, download_name=filename)
+
+
+@teacher_bp.route("/gradebook")
+@login_required
+def gradebook():
+    subjects = Subject.query.filter_by(teacher_id=current_user.id).order_by(Subject.name).all()
+    form = GradebookExportForm(request.args)
+    form.subject_id.choices = [(0, "All my subjects")] + [(s.id, s.name) for s in subjects]
+    if "format" in request.args and form.validate():
+        if form.format.data == "xlsx" and not xlsx_available():
+            flash("Excel export needs openpyxl installed; use CSV instead", "error")
+            return render_template("teacher/gradebook.html", form=form)
+        subject_ids = [form.subject_id.data] if form.subject_id.data else [s.id for s in subjects]
+        rows = gradebook_rows(subject_ids, form.class_name.data or None, form.date_from.data, form.date_to.data)
+        filename = f"gradebook_{datetime.utcnow():%Y%m%d_%H%M}.{form.format.data}"
+        if form.format.data == "xlsx":
+            body, mimetype = iter_xlsx(rows), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        else:
+            body, mimetype = iter_csv(rows), "text/csv"
+        return Response(
+            stream_with_context(body),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+    return render_template("teacher/gradebook.html", form=form)
+
+
+@teacher_bp.route("/students/enroll", methods=["GET", "POST"])
+@login_required
+def enroll():
+    form = RosterUploadForm()
+    report = None
+    if form.validate_on_submit():
+        stream = io.TextIOWrapper(form.file.data.stream, encoding="utf-8-sig", newline="")
+        report = enroll_students(stream, default_class=form.class_name.data or None)
+        if report.created and not report.failed:
+            response = make_response(credentials_csv(report.credentials))
+            response.headers["Content-Type"] = "text/csv"
+            response.headers["Content-Disposition"] = "attachment; filename=student_credentials.csv"
+            return response
+        if report.created:
+            flash(f"Enrolled {report.created} student(s)", "success")
+        if report.failed:
+            flash(f"{report.failed} roster row(s) were not enrolled", "error")
+    return render_template("teacher/enroll_form.html", form=form, report=report)
+
+
+@teacher_bp.route("/subjects/new", methods=["GET", "POST"])
+@login_required
+def create_subject():
+    if not teacher_required():
+        flash("Teacher access required", "error")
+        return redirect(url_for("teacher.index"))
+    form = SubjectForm()
+    if form.validate_on_submit():
+        subject = Subject(
+            name=form.name.data.strip(),
+            description=form.description.data,
+            duration_minutes=form.duration_minutes.data,
+            class_name=form.class_name.data.strip() if form.class_name.data else None,
+            teacher_id=current_user.id,
+            questions_per_paper=form.questions_per_paper.data,
+            topic_quotas=parse_quotas(form.topic_quotas.data),
+            shuffle_options=form.shuffle_options.data,
+        )
+        db.session.add(subject)
+        db.session.flush()
+        index_subjects([subject.id])
+        db.session.commit()
+        flash("Subject created", "success")
+        return redirect(url_for("teacher.index"))
+    return render_template("teacher/subject_form.html", form=form)
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/edit", methods=["GET", "POST"])
+@login_required
+def edit_subject(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = SubjectForm(obj=subject)
+    if request.method == "GET":
+        form.topic_quotas.data = format_quotas(subject.topic_quotas)
+    if form.validate_on_submit():
+        subject.name = form.name.data.strip()
+        subject.description = form.description.data
+        subject.duration_minutes = form.duration_minutes.data
+        subject.class_name = form.class_name.data.strip() if form.class_name.data else None
+        subject.questions_per_paper = form.questions_per_paper.data
+        subject.topic_quotas = parse_quotas(form.topic_quotas.data)
+        subject.shuffle_options = form.shuffle_options.data
+        bump_version(subject)
+        db.session.flush()
+        index_subjects([subject.id])
+        db.session.commit()
+        flash("Subject updated", "success")
+        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+    return render_template("teacher/subject_form.html", form=form)
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/delete", methods=["POST"])
+@login_required
+def delete_subject(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = DeleteForm()
+    if form.validate_on_submit():
+        paper_cache.delete((subject.id, subject.version))
+        unindex_subject(subject.id)
+        db.session.delete(subject)
+        db.session.commit()
+        flash("Subject deleted", "info")
+    return redirect(url_for("teacher.index"))
+
+
+@teacher_bp.route("/subjects/<int:subject_id>")
+@login_required
+def subject_detail(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    delete_form = DeleteForm()
+    window_form = ExamWindowForm(class_name=subject.class_name)
+    query = request.args.get("q", "").strip()
+    questions = Question.query.options(selectinload(Question.options)).filter_by(subject_id=subject.id)
+    if query:
+        ids = [hit.ref_id for hit in search(query, kind="question", subject_ids=[subject.id])]
+        rank = {qid: n for n, qid in enumerate(ids)}
+        page = Page(sorted(questions.filter(Question.id.in_(ids)), key=lambda q: rank[q.id]), None)
+    else:
+        page = keyset_page(questions, [Question.id], request.args.get("after"), per_page=QUESTIONS_PER_PAGE)
+    # Questions are numbered in the order they were added; search hits are not.
+    first_number = None
+    if page.items and not query:
+        first_number = 1 + Question.query.filter(Question.subject_id == subject.id, Question.id < page.items[0].id).count()
+    return render_template(
+        "teacher/subject_detail.html",
+        subject=subject,
+        questions=page.items,
+        next_cursor=page.next_cursor,
+        first_number=first_number,
+        query=query,
+        delete_form=delete_form,
+        window_form=window_form,
+    )
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/window", methods=["POST"])
+@login_required
+def open_window(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = ExamWindowForm()
+    if form.validate_on_submit():
+        created = open_exam_window(subject, form.class_name.data)
+        flash(f"Exam window opened: {created} session(s) started for {form.class_name.data}", "success")
+    else:
+        flash("Choose a class to open the exam for", "error")
+    return redirect(url_for("teacher.monitor", subject_id=subject.id))
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/analysis")
+@login_required
+def subject_analysis(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    return render_template("teacher/analysis.html", subject=subject, analysis=item_analysis(subject))
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/analysis.json")
+@login_required
+def subject_analysis_json(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        return jsonify(error="Not authorized"), 403
+    return jsonify(as_dict(item_analysis(subject)))
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/monitor")
+@login_required
+def monitor(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    return render_template("teacher/monitor.html", subject=subject, snapshot=dumps(monitor_snapshot(subject)))
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/monitor/events")
+@login_required
+def monitor_events(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        return jsonify(error="Not authorized"), 403
+    subscription = event_bus.subscribe(subject.id)
+    response = Response(
+        event_stream(subscription, current_app.config["EVENTS_HEARTBEAT"]),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(subscription.close)
+    return response
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/questions/new", methods=["GET", "POST"])
+@login_required
+def add_question(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = QuestionForm()
+    if form.validate_on_submit():
+        q = Question(
+            subject_id=subject.id,
+            text=form.text.data,
+            time_limit_seconds=form.time_limit_seconds.data,
+            topic=form.topic.data.strip() or None,
+        )
+        db.session.add(q)
+        bump_version(subject)
+        db.session.flush()
+        index_questions([q.id])
+        db.session.commit()
+        regrade(subject.id)
+        flash("Question added", "success")
+        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+    return render_template("teacher/question_form.html", form=form, subject=subject)
+
+
+@teacher_bp.route("/subjects/<int:subject_id>/questions/import", methods=["GET", "POST"])
+@login_required
+def import_question_bank(subject_id):
+    subject = Subject.query.get_or_404(subject_id)
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = QuestionImportForm()
+    report = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        fmt = form.format.data or detect_format(upload.filename)
+        report = import_questions(subject, io.TextIOWrapper(upload.stream, encoding="utf-8-sig"), fmt)
+        if report.imported:
+            flash(f"Imported {report.imported} question(s)", "success")
+        if report.failed:
+            flash(f"{report.failed} question(s) could not be imported", "error")
+        if not report.failed:
+            return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+    return render_template("teacher/import_form.html", form=form, subject=subject, report=report)
+
+
+@teacher_bp.route("/questions/<int:question_id>/edit", methods=["GET", "POST"])
+@login_required
+def edit_question(question_id):
+    question = Question.query.get_or_404(question_id)
+    subject = question.subject
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = QuestionForm(obj=question)
+    if form.validate_on_submit():
+        question.text = form.text.data
+        question.time_limit_seconds = form.time_limit_seconds.data
+        question.topic = form.topic.data.strip() or None
+        bump_version(subject)
+        db.session.flush()
+        index_questions([question.id])
+        db.session.commit()
+        flash("Question updated", "success")
+        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+    return render_template("teacher/question_form.html", form=form, subject=subject)
+
+
+@teacher_bp.route("/questions/<int:question_id>/delete", methods=["POST"])
+@login_required
+def delete_question(question_id):
+    question = Question.query.get_or_404(question_id)
+    subject = question.subject
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = DeleteForm()
+    if form.validate_on_submit():
+        unindex_questions([question.id])
+        db.session.delete(question)
+        bump_version(subject)
+        db.session.commit()
+        regrade(subject.id)
+        flash("Question deleted", "info")
+    return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+
+
+@teacher_bp.route("/questions/<int:question_id>/options/new", methods=["GET", "POST"])
+@login_required
+def add_option(question_id):
+    question = Question.query.get_or_404(question_id)
+    subject = question.subject
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = OptionForm()
+    if form.validate_on_submit():
+        option = Option(question_id=question.id, text=form.text.data, is_correct=form.is_correct.data)
+        if form.is_correct.data:
+            Option.query.filter_by(question_id=question.id, is_correct=True).update({"is_correct": False})
+        db.session.add(option)
+        bump_version(subject)
+        db.session.flush()
+        index_questions([question.id])
+        db.session.commit()
+        if option.is_correct:
+            regrade(subject.id)
+        flash("Option added", "success")
+        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+    return render_template("teacher/option_form.html", form=form, question=question)
+
+
+@teacher_bp.route("/options/<int:option_id>/edit", methods=["GET", "POST"])
+@login_required
+def edit_option(option_id):
+    option = Option.query.get_or_404(option_id)
+    question = option.question
+    subject = question.subject
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = OptionForm(obj=option)
+    if form.validate_on_submit():
+        key_changed = bool(option.is_correct) != bool(form.is_correct.data)
+        option.text = form.text.data
+        if form.is_correct.data:
+            Option.query.filter_by(question_id=question.id, is_correct=True).update({"is_correct": False})
+        option.is_correct = form.is_correct.data
+        bump_version(subject)
+        db.session.flush()
+        index_questions([question.id])
+        db.session.commit()
+        if key_changed:
+            regrade(subject.id)
+        flash("Option updated", "success")
+        return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
+    return render_template("teacher/option_form.html", form=form, question=question)
+
+
+@teacher_bp.route("/options/<int:option_id>/delete", methods=["POST"])
+@login_required
+def delete_option(option_id):
+    option = Option.query.get_or_404(option_id)
+    question = option.question
+    subject = question.subject
+    if subject.teacher_id != current_user.id:
+        flash("Not authorized", "error")
+        return redirect(url_for("teacher.index"))
+    form = DeleteForm()
+    if form.validate_on_submit():
+        was_correct = option.is_correct
+        db.session.delete(option)
+        bump_version(subject)
+        db.session.flush()
+        index_questions([question.id])
+        db.session.commit()
+        if was_correct:
+            regrade(subject.id)
+        flash("Option deleted", "info")
+    return redirect(url_for("teacher.subject_detail", subject_id=subject.id))
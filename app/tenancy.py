@@ -0,0 +1,246 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from flask import abort, g, request
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import create_engine
+from . import storage
+
+MODES = ("", "host", "path")
+SLUG = re.compile(r"^[a-z0-9][a-z0-9-]{0,62}$")
+# Set by the WSGI middleware to the slug of the school a request is for.
+ENVIRON_KEY = "cbtpro.tenant"
+
+Tenant = namedtuple("Tenant", ["slug", "name", "database_url", "hosts"])
+
+
+# Schools with their own database, kept in a JSON file (TENANTS_FILE):
+#   {"greenfield": {"name": "...", "database_url": "...", "hosts": ["..."]}}
+# The file is re-read when it changes, so `flask tenants add` on one
+# machine is picked up by running workers without a restart.
+class TenantRegistry:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._tenants = {}
+        self._hosts = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns if self.path else None
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            raw = json.loads(self.path.read_text()) if mtime is not None else {}
+            tenants = {
+                slug: Tenant(slug, entry.get("name") or slug, entry["database_url"], tuple(entry.get("hosts") or ()))
+                for slug, entry in raw.items()
+            }
+            self._tenants = tenants
+            self._hosts = {host.lower(): t.slug for t in tenants.values() for host in t.hosts}
+            self._mtime = mtime
+
+    def get(self, slug):
+        self.refresh()
+        return self._tenants.get(slug)
+
+    def for_host(self, host):
+        self.refresh()
+        return self._hosts.get(host.lower().split(":", 1)[0])
+
+    def all(self):
+        self.refresh()
+        return sorted(self._tenants.values())
+
+    def save(self, tenants):
+        data = {
+            t.slug: {"name": t.name, "database_url": t.database_url, "hosts": list(t.hosts)}
+            for t in sorted(tenants)
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, indent=2) + "\n")
+        os.replace(tmp, self.path)
+        self.refresh()
+
+    def add(self, tenant):
+        if not SLUG.match(tenant.slug):
+            raise ValueError(f"Invalid school slug {tenant.slug!r}; use lowercase letters, digits and dashes")
+        self.save([t for t in self.all() if t.slug != tenant.slug] + [tenant])
+
+    def remove(self, slug):
+        self.save([t for t in self.all() if t.slug != slug])
+
+
+# Resolves the school before Flask sees the request. In path mode
+# /<slug>/student/ becomes SCRIPT_NAME=/<slug>, PATH_INFO=/student/, so
+# routes match unchanged and url_for() keeps the prefix.
+class TenantMiddleware:
+    def __init__(self, wsgi_app, tenancy):
+        self.wsgi_app = wsgi_app
+        self.tenancy = tenancy
+
+    def __call__(self, environ, start_response):
+        if self.tenancy.mode == "host":
+            environ[ENVIRON_KEY] = self.tenancy.registry.for_host(environ.get("HTTP_HOST") or environ.get("SERVER_NAME", ""))
+        elif self.tenancy.mode == "path":
+            path = environ.get("PATH_INFO", "")
+            slug, _, rest = path.lstrip("/").partition("/")
+            if slug and self.tenancy.registry.get(slug) is not None:
+                environ[ENVIRON_KEY] = slug
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + "/" + slug
+                environ["PATH_INFO"] = "/" + rest
+        return self.wsgi_app(environ, start_response)
+
+
+# One database per school. A request's school comes from its host name
+# (TENANT_MODE=host) or a /<slug> path prefix (TENANT_MODE=path); requests
+# that match no school use DATABASE_URL as before. Engines are created on
+# first use, each with its own pool, and at most TENANT_ENGINE_LIMIT are
+# kept: past that the least recently used idle engine is disposed. Looking
+# up an open engine takes no lock; creating (and migrating) one only blocks
+# requests for that school.
+class Tenancy:
+    def __init__(self):
+        self.mode = ""
+        self.limit = 16
+        self.registry = TenantRegistry()
+        self._engines = {}
+        self._used = {}
+        self._creating = {}
+        self._lock = threading.Lock()
+        self._app = None
+
+    def init_app(self, app):
+        self.mode = app.config.get("TENANT_MODE") or ""
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown TENANT_MODE {self.mode!r}; use 'host' or 'path'")
+        self.limit = max(1, app.config.get("TENANT_ENGINE_LIMIT", self.limit))
+        self.registry = TenantRegistry(app.config.get("TENANTS_FILE") or Path(app.instance_path, "tenants.json"))
+        self._app = app
+        if self.mode:
+            app.wsgi_app = TenantMiddleware(app.wsgi_app, self)
+            app.before_request(self._select)
+            app.session_interface = TenantSessionInterface()
+
+    def _select(self):
+        slug = request.environ.get(ENVIRON_KEY)
+        if slug is None:
+            return
+        if self.registry.get(slug) is None:
+            abort(404)
+        g.tenant = slug
+        g._tenant_engine = self.engine(slug)
+
+    def create_engine(self, slug):
+        # A new, unmanaged engine for the school; the caller disposes it.
+        tenant = self.registry.get(slug)
+        if tenant is None:
+            raise KeyError(slug)
+        config = self._app.config
+        engine = create_engine(tenant.database_url, **storage.engine_options(config, tenant.database_url))
+        storage.install_pragmas(engine, config)
+        from .metrics import metrics
+
+        metrics.watch(engine)
+        return engine
+
+    def engine(self, slug):
+        engine = self._engines.get(slug)
+        if engine is None:
+            with self._creating.setdefault(slug, threading.Lock()):
+                engine = self._engines.get(slug)
+                if engine is None:
+                    from .migrations import ensure_schema
+
+                    engine = self.create_engine(slug)
+                    ensure_schema(self._app, engine, slug)
+                    with self._lock:
+                        self._used[slug] = time.monotonic()
+                        self._engines[slug] = engine
+                    self._evict(slug)
+        self._used[slug] = time.monotonic()
+        return engine
+
+    def _evict(self, keep):
+        # Engines with a connection checked out are skipped; the limit is
+        # enforced again on the next engine created.
+        evicted = []
+        with self._lock:
+            for slug in sorted(self._engines, key=lambda s: self._used.get(s, 0)):
+                if len(self._engines) <= self.limit:
+                    break
+                engine = self._engines[slug]
+                if slug != keep and getattr(engine.pool, "checkedout", lambda: 0)() == 0:
+                    del self._engines[slug]
+                    self._used.pop(slug, None)
+                    evicted.append(engine)
+        for engine in evicted:
+            engine.dispose()
+
+    def loaded(self):
+        with self._lock:
+            return dict(self._engines)
+
+    @contextmanager
+    def activate(self, slug, engine=None):
+        # Runs the block against a school's database (None: the primary) in
+        # its own app context, for CLI commands and background threads.
+        if slug == storage.current_tenant() and engine is None:
+            yield
+            return
+        with self._app.app_context():
+            g.tenant = slug
+            g._tenant_engine = engine or (self.engine(slug) if slug is not None else None)
+            yield
+
+    def each(self):
+        # The primary database first, then every school, each activated.
+        # Schools without an open engine get a short-lived one, so periodic
+        # jobs neither churn the LRU nor push out schools serving requests.
+        with self.activate(None):
+            yield None
+        for t in self.registry.all():
+            engine = self._engines.get(t.slug)
+            if engine is not None:
+                with self.activate(t.slug):
+                    yield t.slug
+                continue
+            engine = self.create_engine(t.slug)
+            try:
+                with self.activate(t.slug, engine):
+                    yield t.slug
+            finally:
+                engine.dispose()
+
+
+tenancy = Tenancy()
+
+
+# Sessions are signed and named per school: one school's login cookie is
+# not a login at another school, even under the same host in path mode.
+class TenantSessionInterface(SecureCookieSessionInterface):
+    def get_cookie_name(self, app):
+        slug = request.environ.get(ENVIRON_KEY)
+        name = super().get_cookie_name(app)
+        return f"{name}-{slug}" if slug else name
+
+    def get_signing_serializer(self, app):
+        slug = request.environ.get(ENVIRON_KEY)
+        if not app.secret_key or not slug:
+            return super().get_signing_serializer(app)
+        return URLSafeTimedSerializer(
+            app.secret_key,
+            salt=f"{self.salt}:{slug}",
+            serializer=self.serializer,
+            signer_kwargs={"key_derivation": self.key_derivation, "digest_method": self.digest_method},
+        )
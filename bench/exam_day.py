@@ -0,0 +1,267 @@
+"""Exam-day load test.
+
+Seeds a synthetic school into a scratch database, then drives simulated
+students concurrently through login, start_exam, take_exam (GET and POST),
+answer autosave and session_report using the Flask test client (with
+--offline, through the exam bundle, answer deltas and the submit manifest
+instead). Latency
+percentiles, throughput and SQL query counts are reported per endpoint and
+can be saved as a JSON baseline and compared against a previous run:
+
+    python -m bench.exam_day --students 800 --concurrency 64 --save bench/baselines/main.json
+    python -m bench.exam_day --students 800 --concurrency 64 --compare bench/baselines/main.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+FORMAT_VERSION = 1
+AUTOSAVES_PER_EXAM = 4
+ENDPOINTS = (
+    "login", "student_index", "start_exam", "take_exam_get", "autosave", "take_exam_post",
+    "exam_bundle", "sync", "submit", "session_report",
+)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def count_query(self, *args):
+        self._local.queries = getattr(self._local, "queries", 0) + 1
+
+    def call(self, name, fn, expect=(200, 302)):
+        self._local.queries = 0
+        started = time.perf_counter()
+        response = fn()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples[name].append((elapsed, self._local.queries))
+            if response.status_code not in expect:
+                self.errors[name] += 1
+        return response
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def simulate_student(app, recorder, email, password, subject_id, answer_rate, rng, offline=False):
+    client = app.test_client()
+    recorder.call("login", lambda: client.post("/auth/login", data={"email": email, "password": password}), expect=(302,))
+    recorder.call("student_index", lambda: client.get("/student/"))
+    response = recorder.call("start_exam", lambda: client.get(f"/student/subjects/{subject_id}/start"))
+    exam_url = response.headers.get("Location", "")
+    if offline:
+        report_url = simulate_offline_exam(client, recorder, exam_url, answer_rate, rng)
+    else:
+        page = recorder.call("take_exam_get", lambda: client.get(exam_url))
+        choices = defaultdict(list)
+        for qid, oid in re.findall(rb'name="question_(\d+)" value="(\d+)"', page.data):
+            choices[qid.decode()].append(oid.decode())
+        answers = {qid: rng.choice(oids) for qid, oids in choices.items() if rng.random() < answer_rate}
+        # A handful of autosave deltas, as the exam page sends while answering.
+        items = list(answers.items())
+        step = max(1, len(items) // AUTOSAVES_PER_EXAM)
+        for start in range(0, len(items), step):
+            batch = dict(items[start:start + step])
+            recorder.call("autosave", lambda: client.post(f"{exam_url}/answers", json={"answers": batch}))
+        form = {f"question_{qid}": oid for qid, oid in answers.items()}
+        response = recorder.call("take_exam_post", lambda: client.post(exam_url, data=form))
+        report_url = response.headers.get("Location", "")
+    recorder.call("session_report", lambda: client.get(report_url))
+
+
+def simulate_offline_exam(client, recorder, exam_url, answer_rate, rng):
+    recorder.call("take_exam_get", lambda: client.get(exam_url))
+    bundle = recorder.call("exam_bundle", lambda: client.get(f"{exam_url}/bundle")).get_json()
+    answers = {
+        str(qid): rng.choice(options)[0]
+        for qid, _, _, options in bundle["questions"]
+        if options and rng.random() < answer_rate
+    }
+    # Fewer, larger deltas than autosave: the page syncs every half minute.
+    items = list(answers.items())
+    step = max(1, len(items) // (AUTOSAVES_PER_EXAM // 2))
+    for seq, start in enumerate(range(0, len(items), step), start=1):
+        delta = {"token": bundle["token"], "seq": seq, "answers": dict(items[start:start + step])}
+        recorder.call("sync", lambda: client.post(f"{exam_url}/sync", json=delta))
+    manifest = {"token": bundle["token"], "answers": answers, "count": len(answers)}
+    return recorder.call("submit", lambda: client.post(f"{exam_url}/submit", json=manifest)).get_json()["url"]
+
+
+def summarize(recorder, wall_time):
+    endpoints = {}
+    for name in ENDPOINTS:
+        samples = recorder.samples.get(name, [])
+        if not samples:
+            continue
+        latencies = [s[0] * 1000 for s in samples]
+        queries = [s[1] for s in samples]
+        endpoints[name] = {
+            "count": len(samples),
+            "errors": recorder.errors.get(name, 0),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "throughput_rps": round(len(samples) / wall_time, 2) if wall_time else 0.0,
+            "queries_mean": round(sum(queries) / len(queries), 2),
+            "queries_max": max(queries),
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {
+        "endpoints": endpoints,
+        "total": {
+            "requests": total,
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "wall_time_s": round(wall_time, 3),
+            "throughput_rps": round(total / wall_time, 2) if wall_time else 0.0,
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_table(result):
+    print(f"{'endpoint':<16}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}{'queries':>9}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:<16}{e['count']:>7}{e['errors']:>5}{e['p50_ms']:>10.1f}{e['p95_ms']:>10.1f}{e['p99_ms']:>10.1f}{e['throughput_rps']:>9.1f}{e['queries_mean']:>9.1f}")
+    t = result["total"]
+    print(f"total: {t['requests']} requests, {t['errors']} errors in {t['wall_time_s']:.1f}s ({t['throughput_rps']:.1f} req/s)")
+
+
+def compare(result, baseline, threshold):
+    # Returns the regressions: latency or query count up by more than threshold.
+    regressions = []
+    print(f"\nvs baseline {baseline['meta'].get('git_revision')} ({baseline['meta'].get('timestamp')}):")
+    for name, e in result["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if not base:
+            continue
+        deltas = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "queries_mean"):
+            before, after = base[metric], e[metric]
+            change = (after - before) / before if before else 0.0
+            deltas.append(f"{metric} {before:.1f}->{after:.1f} ({change:+.0%})")
+            if change > threshold and metric != "p99_ms":
+                regressions.append(f"{name} {metric} {change:+.0%}")
+        print(f"  {name:<16}" + "  ".join(deltas))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=800)
+    parser.add_argument("--teachers", type=int, default=2)
+    parser.add_argument("--subjects", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--options", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64, help="Simulated students in flight at once.")
+    parser.add_argument("--answer-rate", type=float, default=0.9, help="Fraction of questions each student answers.")
+    parser.add_argument("--offline", action="store_true", help="Take exams through the offline bundle and delta sync.")
+    parser.add_argument("--db", default=None, help="SQLite file to use (default: a fresh temp file).")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--save", help="Write the result as a JSON baseline.")
+    parser.add_argument("--compare", help="Compare against a JSON baseline.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Regression threshold for --compare (0.2 = 20%%).")
+    args = parser.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="cbtpro-bench-"), "bench.db")
+    if os.path.exists(path):
+        os.remove(path)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(path)}"
+    os.environ.setdefault("PDF_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(path)), "pdf_cache"))
+
+    from sqlalchemy import event
+    from app import create_app, db
+    from app.models import Subject
+    from bench.seed import seed, PASSWORD
+
+    app = create_app()
+    app.config.update(WTF_CSRF_ENABLED=False, OFFLINE_EXAMS=args.offline)
+    recorder = Recorder()
+    with app.app_context():
+        dataset = seed(args.teachers, args.subjects, args.questions, args.options, args.students, args.seed)
+        subject_id = db.session.query(Subject.id).order_by(Subject.id).first()[0]
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", recorder.count_query)
+    print(f"Seeded {dataset} into {path}")
+
+    rng = random.Random(args.seed)
+    jobs = [(f"student{i}@bench.example.org", random.Random(rng.random())) for i in range(args.students)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(simulate_student, app, recorder, email, PASSWORD, subject_id, args.answer_rate, student_rng, args.offline)
+            for email, student_rng in jobs
+        ]
+        failures = 0
+        for future in futures:
+            try:
+                future.result()
+            except Exception as exc:
+                failures += 1
+                if failures <= 5:
+                    print(f"simulated student failed: {exc!r}", file=sys.stderr)
+    wall_time = time.perf_counter() - started
+
+    result = summarize(recorder, wall_time)
+    result["format_version"] = FORMAT_VERSION
+    result["meta"] = {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": dataset,
+        "concurrency": args.concurrency,
+        "answer_rate": args.answer_rate,
+        "offline": args.offline,
+        "failed_students": failures,
+    }
+    print_table(result)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as fh:
+            json.dump(result, fh, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        if baseline.get("format_version") != FORMAT_VERSION:
+            print("Baseline format differs; comparison skipped", file=sys.stderr)
+            return 2
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import random
+from datetime import datetime
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import User, UserRole, Subject, Question, Option
+from app.search import rebuild_index
+
+PASSWORD = "bench-pass"
+CLASS_NAME = "JSS 1"
+
+
+def seed(teachers=2, subjects=4, questions=40, options=4, students=800, seed_value=1234):
+    # Builds a synthetic school in an empty database. Every student shares one
+    # precomputed password hash so seeding does not spend minutes hashing.
+    rng = random.Random(seed_value)
+    password_hash = generate_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {"full_name": f"Teacher {i}", "email": f"teacher{i}@bench.example.org", "password_hash": password_hash,
+         "role": UserRole.TEACHER.value, "created_at": now}
+        for i in range(teachers)
+    ])
+    teacher_ids = [u.id for u in User.query.filter_by(role=UserRole.TEACHER.value).order_by(User.id)]
+    db.session.execute(insert(Subject), [
+        {"name": f"Subject {i}", "description": "Synthetic benchmark subject", "duration_minutes": 60,
+         "class_name": CLASS_NAME, "teacher_id": teacher_ids[i % len(teacher_ids)], "created_at": now, "version": 1}
+        for i in range(subjects)
+    ])
+    subject_ids = [s.id for s in Subject.query.order_by(Subject.id)]
+    db.session.execute(insert(Question), [
+        {"subject_id": sid, "text": f"Synthetic question {n} of subject {sid}?", "time_limit_seconds": None}
+        for sid in subject_ids
+        for n in range(questions)
+    ])
+    question_ids = [qid for (qid,) in db.session.query(Question.id).order_by(Question.id)]
+    rows = []
+    for qid in question_ids:
+        correct = rng.randrange(options)
+        rows.extend(
+            {"question_id": qid, "text": f"Option {chr(65 + k)}", "is_correct": k == correct}
+            for k in range(options)
+        )
+    db.session.execute(insert(Option), rows)
+    db.session.execute(insert(User), [
+        {"full_name": f"Student {i}", "email": f"student{i}@bench.example.org", "password_hash": password_hash,
+         "role": UserRole.STUDENT.value, "class_name": CLASS_NAME, "created_at": now}
+        for i in range(students)
+    ])
+    rebuild_index()
+    db.session.commit()
+    return {
+        "teachers": teachers,
+        "subjects": subjects,
+        "questions": len(question_ids),
+        "options": len(rows),
+        "students": students,
+    }
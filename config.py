@@ -1,16 +1,80 @@
-import os
-from pathlib import Path
-
-BASE_DIR = Path(__file__).resolve().parent
-
-class Config:
-    SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key-change")
-    SQLALCHEMY_DATABASE_URI = os.environ.get(
-        "DATABASE_URL",
-        f"sqlite:///{BASE_DIR / 'app.db'}",
-    )
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
-
-class TestConfig(Config):
-    TESTING = True
-    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+import os
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+class Config:
+    SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key-change")
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        "DATABASE_URL",
+        f"sqlite:///{BASE_DIR / 'app.db'}",
+    )
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Storage profile: "sqlite" (WAL + pragmas) or "server" (pooled Postgres/MySQL);
+    # detected from DATABASE_URL when unset
+    DB_PROFILE = os.environ.get("DB_PROFILE")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", 20000))
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    # Report views read from this database (e.g. a replica) when set; with
+    # REPORTS_READ_ONLY=1 on SQLite they use a read-only connection instead
+    DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL")
+    REPORTS_READ_ONLY = os.environ.get("REPORTS_READ_ONLY", "0") == "1"
+    # One database per school: "host" picks the school by host name, "path" by a
+    # /<slug> prefix; schools are listed in TENANTS_FILE (instance/tenants.json)
+    # and at most TENANT_ENGINE_LIMIT of their engines stay open per worker
+    TENANT_MODE = os.environ.get("TENANT_MODE", "")
+    TENANTS_FILE = os.environ.get("TENANTS_FILE")
+    TENANT_ENGINE_LIMIT = int(os.environ.get("TENANT_ENGINE_LIMIT", 16))
+    # Apply pending schema migrations at startup; set to 0 to only warn
+    AUTO_MIGRATE = os.environ.get("AUTO_MIGRATE", "1") != "0"
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+    # Seconds a worker trusts its cached copy of a logged-in user
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30))
+    # Autosaved answers are coalesced in memory and written in batches
+    AUTOSAVE_FLUSH_SIZE = int(os.environ.get("AUTOSAVE_FLUSH_SIZE", 500))
+    AUTOSAVE_FLUSH_INTERVAL = float(os.environ.get("AUTOSAVE_FLUSH_INTERVAL", 2.0))
+    # Rendered report-card PDFs, content-addressed; defaults to instance/pdf_cache
+    PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR")
+    PDF_WORKERS = int(os.environ.get("PDF_WORKERS", 2))
+    # Password-hashing processes shared by roster enrollments; defaults to the CPU count
+    ENROLL_WORKERS = int(os.environ.get("ENROLL_WORKERS", 0)) or None
+    # Submissions this many seconds past the deadline are still accepted (network lag);
+    # expired sessions are auto-submitted every SWEEPER_INTERVAL seconds (0 disables)
+    EXAM_SUBMIT_GRACE_SECONDS = int(os.environ.get("EXAM_SUBMIT_GRACE_SECONDS", 30))
+    SWEEPER_INTERVAL = int(os.environ.get("SWEEPER_INTERVAL", 30))
+    # Render exams from a downloaded paper bundle that keeps answers on the
+    # device and syncs them in numbered deltas; ?mode=online opts out per visit
+    OFFLINE_EXAMS = os.environ.get("OFFLINE_EXAMS", "0") == "1"
+    # Class positions are kept in memory per worker and reloaded after this many seconds
+    RANKING_TTL = int(os.environ.get("RANKING_TTL", 300))
+    # New exam sessions each worker admits per second per subject (0 disables);
+    # students beyond the burst wait on a page that polls until admitted
+    ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", 10))
+    ADMISSION_BURST = int(os.environ.get("ADMISSION_BURST", 20))
+    # ETag revalidation (304s) for completed session reports and the home
+    # page; rendered fragments of those pages kept per worker, for
+    # FRAGMENT_CACHE_TTL seconds (0: until pushed out by newer ones)
+    HTTP_CACHE = os.environ.get("HTTP_CACHE", "1") != "0"
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 512))
+    FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", 0))
+    # Command `flask build-assets` runs to compile the stylesheet, e.g. "npx tailwindcss@3"
+    TAILWIND_CLI = os.environ.get("TAILWIND_CLI", "tailwindcss")
+    # Seconds between keep-alive ticks on the live exam monitor stream
+    EVENTS_HEARTBEAT = int(os.environ.get("EVENTS_HEARTBEAT", 15))
+    # Per-endpoint query/DB/render histograms on /metrics; requests running more
+    # than METRICS_QUERY_BUDGET queries are logged as likely N+1 (0 disables)
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+    METRICS_QUERY_BUDGET = int(os.environ.get("METRICS_QUERY_BUDGET", 25))
+    # /metrics is only served to scrapers sending this bearer token or
+    # connecting from these comma-separated networks; with neither it is a 404
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    METRICS_NETWORKS = [n for n in os.environ.get("METRICS_NETWORKS", "").split(",") if n.strip()]
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
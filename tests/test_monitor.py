@@ -0,0 +1,59 @@
+import json
+import os
+import pytest
+
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["SWEEPER_INTERVAL"] = "0"
+
+from config import Config  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.events import event_bus  # noqa: E402
+from app.models import Subject, User, UserRole  # noqa: E402
+from app.tenancy import tenancy  # noqa: E402
+
+SCHOOLS = ("alpha", "beta")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    tenants = {slug: {"name": slug.title(), "database_url": f"sqlite:///{tmp_path / slug}.db"} for slug in SCHOOLS}
+    (tmp_path / "tenants.json").write_text(json.dumps(tenants))
+    monkeypatch.setattr(Config, "TENANT_MODE", "path")
+    monkeypatch.setattr(Config, "TENANTS_FILE", str(tmp_path / "tenants.json"))
+    monkeypatch.setattr(Config, "EVENTS_HEARTBEAT", 1)
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    with app.app_context():
+        for slug in (None,) + SCHOOLS:
+            with tenancy.activate(slug):
+                teacher = User(full_name=f"Teacher {slug}", email="t@example.org", role=UserRole.TEACHER.value)
+                teacher.set_password("secret")
+                db.session.add(teacher)
+                db.session.flush()
+                db.session.add(Subject(name=f"Maths {slug}", teacher_id=teacher.id))
+                db.session.commit()
+    yield app
+    for engine in tenancy.loaded().values():
+        engine.dispose()
+
+
+def _publish(app, slug, event):
+    with app.app_context(), tenancy.activate(slug):
+        event_bus.publish(1, event)
+
+
+def test_monitor_only_streams_its_own_school(app):
+    client = app.test_client()
+    client.post("/alpha/auth/login", data={"email": "t@example.org", "password": "secret"})
+    response = client.get("/alpha/teacher/subjects/1/monitor/events", buffered=False)
+    assert response.status_code == 200
+    stream = response.iter_encoded()
+    assert next(stream).startswith(b"retry")
+    # The same subject id at the primary database and another school.
+    _publish(app, None, {"type": "started", "student": "primary"})
+    _publish(app, "beta", {"type": "started", "student": "beta"})
+    _publish(app, "alpha", {"type": "started", "student": "alpha"})
+    assert '"student": "alpha"' in next(stream).decode()
+    response.close()
+    with app.app_context(), tenancy.activate("alpha"):
+        assert event_bus.watchers(1) == 0
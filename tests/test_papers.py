@@ -0,0 +1,43 @@
+import os
+from itertools import combinations
+import pytest
+from sqlalchemy import insert
+
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["SWEEPER_INTERVAL"] = "0"
+
+from app import create_app, db  # noqa: E402
+from app.models import Question, Subject, User, UserRole  # noqa: E402
+from app.papers import draw_paper, unpack_ids  # noqa: E402
+
+BANK = 5000
+PER_PAPER = 40
+
+
+@pytest.fixture
+def subject():
+    app = create_app()
+    with app.app_context():
+        teacher = User(full_name="T", email="t@example.org", role=UserRole.TEACHER.value)
+        teacher.set_password("x")
+        db.session.add(teacher)
+        db.session.flush()
+        subject = Subject(name="Bank", teacher_id=teacher.id, questions_per_paper=PER_PAPER)
+        db.session.add(subject)
+        db.session.flush()
+        db.session.execute(insert(Question), [{"subject_id": subject.id, "text": f"Q{i}"} for i in range(BANK)])
+        db.session.commit()
+        yield subject
+
+
+def test_papers_overlap_like_independent_samples(subject):
+    papers = [set(unpack_ids(draw_paper(subject, seed)[1])) for seed in range(200)]
+    assert all(len(p) == PER_PAPER for p in papers)
+    overlaps = [len(a & b) for a, b in combinations(papers, 2)]
+    # Independent draws share PER_PAPER ** 2 / BANK = 0.32 questions on average.
+    assert sum(overlaps) / len(overlaps) < 1
+    assert max(overlaps) < PER_PAPER // 4
+
+
+def test_same_seed_draws_same_paper(subject):
+    assert draw_paper(subject, 7) == draw_paper(subject, 7)
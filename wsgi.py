@@ -1,5 +1,5 @@
-from app import create_app
-
-app = create_app()
-
-
+from app import create_app
+
+app = create_app()
+
+